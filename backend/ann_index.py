@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+Approximate nearest-neighbour (IVF) index over a `rag_vectors.db` file.
+
+The unit-normalised embeddings are clustered with spherical k-means into
+`lists` inverted lists. A query is scored against the centroids first and then
+only against the rows of its `nprobe` closest lists. The cost grows with about
+sqrt(n) rather than n, and nprobe trades recall for speed.
+
+The index is built offline and saved as one flat file: a JSON header followed
+by 64-byte aligned arrays. The backend memory-maps it, so every worker process
+shares the same page-cache copy and startup does not parse anything. Chunk
+text and pages stay in SQLite and are fetched only for the final hits.
+
+Build (re-run after re-indexing or embedding new chunks):
+  python backend/ann_index.py --db rag_vectors.db                  # -> rag_vectors.db.ivf
+  python backend/ann_index.py --db rag_vectors.db --lists 1024 --out /data/rag.ivf
+
+If the index does not match the database (different embedding count or max
+chunk id), the backend logs a warning and falls back to exact search.
+"""
+
+import os
+import sys
+import json
+import mmap
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"TASHAIVF"
+FORMAT_VERSION = 1
+ALIGN = 64
+
+# Searches over fewer rows than this (a small book, or a small corpus) are exact.
+DEFAULT_EXACT_THRESHOLD = 20000
+DEFAULT_NPROBE = 16
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the `k` largest values of a 1-D score vector, best first."""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    part = np.argpartition(-scores, k - 1)[:k] if k < scores.shape[0] else np.arange(scores.shape[0])
+    return part[np.argsort(-scores[part], kind="stable")]
+
+
+def db_fingerprint(conn: sqlite3.Connection) -> Dict[str, int]:
+    """Cheap identity of the embedded rows, used to detect a stale index."""
+    count, max_id = conn.execute("SELECT COUNT(*), COALESCE(MAX(chunk_id), 0) FROM embeddings").fetchone()
+    return {"embeddings": int(count), "max_chunk_id": int(max_id)}
+
+
+def load_vectors(db_path: str) -> Tuple[np.ndarray, np.ndarray, List[str], np.ndarray, Dict[str, int]]:
+    """Read (normalised float32 vectors, ids, book names, book codes, fingerprint)."""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        fingerprint = db_fingerprint(conn)
+        cur = conn.execute(
+            "SELECT c.id, c.book, e.embedding FROM chunks c JOIN embeddings e ON c.id = e.chunk_id "
+            "WHERE e.embedding IS NOT NULL ORDER BY c.id"
+        )
+        ids, codes, blobs = [], [], []
+        books: Dict[str, int] = {}
+        dim = None
+        for chunk_id, book, blob in cur:
+            if not blob or len(blob) % 8:
+                continue
+            if dim is None:
+                dim = len(blob) // 8
+            elif len(blob) // 8 != dim:
+                continue
+            ids.append(chunk_id)
+            codes.append(books.setdefault(book or "", len(books)))
+            blobs.append(blob)
+    finally:
+        conn.close()
+    if not ids:
+        raise ValueError(f"No embeddings in {db_path}")
+    vectors = np.frombuffer(b"".join(blobs), dtype="<f8").reshape(len(ids), dim).astype(np.float32)
+    norms = np.linalg.norm(vectors, axis=1)
+    vectors /= np.where(norms > 0, norms, 1.0)[:, None]
+    names = [name for name, _ in sorted(books.items(), key=lambda kv: kv[1])]
+    return vectors, np.asarray(ids, dtype=np.int64), names, np.asarray(codes, dtype=np.int32), fingerprint
+
+
+def assign(vectors: np.ndarray, centroids: np.ndarray, block: int = 65536) -> np.ndarray:
+    """Closest centroid (by dot product) for every row, in blocks to bound memory."""
+    out = np.empty(vectors.shape[0], dtype=np.int32)
+    for start in range(0, vectors.shape[0], block):
+        out[start:start + block] = np.argmax(vectors[start:start + block] @ centroids.T, axis=1)
+    return out
+
+
+def spherical_kmeans(vectors: np.ndarray, n_lists: int, iters: int = 20, sample: int = 64, seed: int = 0) -> np.ndarray:
+    """Unit-norm centroids trained on up to `sample` rows per list."""
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    train = vectors[rng.choice(n, size=min(n, n_lists * sample), replace=False)]
+    centroids = train[rng.choice(train.shape[0], size=n_lists, replace=False)].copy()
+    for _ in range(iters):
+        labels = assign(train, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, train)
+        counts = np.bincount(labels, minlength=n_lists)
+        # Re-seed empty lists from random training rows.
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = train[rng.choice(train.shape[0], size=int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1)
+        centroids = (sums / np.where(norms > 0, norms, 1.0)[:, None]).astype(np.float32)
+    return centroids
+
+
+def _aligned(offset: int) -> int:
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def write_index(path: str, header: Dict[str, Any], arrays: Dict[str, np.ndarray]) -> None:
+    """Write header + aligned arrays to `path` atomically (readers keep their old mmap)."""
+    layout = {}
+    # The header's own length depends on the offsets; reserve room for the layout.
+    offset = _aligned(len(MAGIC) + 8 + len(json.dumps(header).encode("utf-8")) + 1024 + 128 * len(arrays))
+    for name, arr in arrays.items():
+        layout[name] = {"offset": offset, "dtype": arr.dtype.str, "shape": list(arr.shape)}
+        offset = _aligned(offset + arr.nbytes)
+    header = dict(header, arrays=layout)
+    blob = json.dumps(header).encode("utf-8")
+    first = min(a["offset"] for a in layout.values())
+    if len(MAGIC) + 8 + len(blob) > first:
+        raise ValueError("index header too large")
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(blob).to_bytes(8, "little"))
+        f.write(blob)
+        for name, arr in arrays.items():
+            f.seek(layout[name]["offset"])
+            f.write(np.ascontiguousarray(arr).tobytes())
+        f.truncate(offset)
+    os.replace(tmp, path)
+
+
+def build(db_path: str, out_path: str, n_lists: Optional[int] = None, iters: int = 20, seed: int = 0) -> Dict[str, Any]:
+    started = time.perf_counter()
+    vectors, ids, books, codes, fingerprint = load_vectors(db_path)
+    n, dim = vectors.shape
+    n_lists = max(1, min(n, n_lists or int(4 * np.sqrt(n))))
+    centroids = spherical_kmeans(vectors, n_lists, iters=iters, seed=seed)
+    labels = assign(vectors, centroids)
+    # Rows are stored grouped by list, so a probe reads contiguous blocks.
+    order = np.argsort(labels, kind="stable")
+    offsets = np.zeros(n_lists + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(labels, minlength=n_lists))
+    header = {
+        "format": FORMAT_VERSION,
+        "dim": int(dim),
+        "rows": int(n),
+        "lists": int(n_lists),
+        "books": books,
+        "source": fingerprint,
+        "built_at": time.time(),
+    }
+    write_index(out_path, header, {
+        "centroids": centroids.astype("<f4"),
+        "offsets": offsets.astype("<i8"),
+        "vectors": vectors[order].astype("<f4"),
+        "ids": ids[order].astype("<i8"),
+        "codes": codes[order].astype("<i4"),
+    })
+    header["seconds"] = round(time.perf_counter() - started, 2)
+    return header
+
+
+class AnnIndex:
+    """Memory-mapped IVF index with book filtering and an exact fallback.
+
+    `ready()` is False (and callers should use the exact `VectorIndex`) when the
+    file is missing or was built from a different state of the database.
+    Search results have the same shape as `VectorIndex.search`.
+    """
+
+    def __init__(self, path: str, db_path: str, nprobe: int = DEFAULT_NPROBE,
+                 exact_threshold: int = DEFAULT_EXACT_THRESHOLD):
+        self.path = path
+        self.db_path = db_path
+        self.nprobe = nprobe
+        self.exact_threshold = exact_threshold
+        self.header: Dict[str, Any] = {}
+        self.fresh = False
+        self._mm: Optional[mmap.mmap] = None
+        self._mtimes: Tuple[Optional[float], Optional[float]] = (None, None)
+        self._book_rows: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @classmethod
+    def from_env(cls, db_path: str) -> "AnnIndex":
+        return cls(
+            os.getenv("ANN_INDEX_PATH", f"{db_path}.ivf"),
+            db_path,
+            nprobe=int(os.getenv("ANN_NPROBE", str(DEFAULT_NPROBE))),
+            exact_threshold=int(os.getenv("ANN_EXACT_THRESHOLD", str(DEFAULT_EXACT_THRESHOLD))),
+        )
+
+    def ready(self) -> bool:
+        if not (os.path.exists(self.path) and os.path.exists(self.db_path)):
+            return False
+        mtimes = (os.path.getmtime(self.path), os.path.getmtime(self.db_path))
+        if mtimes != self._mtimes:
+            with self._lock:
+                if mtimes != self._mtimes:
+                    try:
+                        self._load(mtimes[0] != self._mtimes[0])
+                    except (OSError, ValueError, sqlite3.Error) as e:
+                        logger.warning("[ann_index] cannot use %s: %s", self.path, e)
+                        self.fresh = False
+                    self._mtimes = mtimes
+        return self.fresh
+
+    def _load(self, reopen: bool) -> None:
+        if reopen or self._mm is None:
+            with open(self.path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if mm[:len(MAGIC)] != MAGIC:
+                raise ValueError("not an IVF index file")
+            size = int.from_bytes(mm[len(MAGIC):len(MAGIC) + 8], "little")
+            header = json.loads(mm[len(MAGIC) + 8:len(MAGIC) + 8 + size])
+            if header.get("format") != FORMAT_VERSION:
+                raise ValueError(f"unsupported index format {header.get('format')}")
+            arrays = {}
+            for name, spec in header["arrays"].items():
+                count = int(np.prod(spec["shape"])) if spec["shape"] else 1
+                arrays[name] = np.frombuffer(mm, dtype=spec["dtype"], count=count, offset=spec["offset"]).reshape(spec["shape"])
+            self.header, self._mm = header, mm
+            self.centroids = arrays["centroids"]
+            self.offsets = arrays["offsets"]
+            self.vectors = arrays["vectors"]
+            self.ids = arrays["ids"]
+            self.codes = arrays["codes"]
+            self._book_rows = {
+                name: np.flatnonzero(self.codes == code) for code, name in enumerate(header["books"])
+            }
+            logger.info(
+                "[ann_index] mapped %s: rows=%d lists=%d dim=%d books=%d",
+                self.path, header["rows"], header["lists"], header["dim"], len(header["books"]),
+            )
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        try:
+            current = db_fingerprint(conn)
+        finally:
+            conn.close()
+        self.fresh = current == self.header.get("source")
+        if not self.fresh:
+            logger.warning(
+                "[ann_index] %s was built from %s but the database now has %s; using exact search until it is rebuilt",
+                self.path, self.header.get("source"), current,
+            )
+
+    @property
+    def dim(self) -> Optional[int]:
+        return self.header.get("dim")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "ready": self.fresh,
+            "rows": self.header.get("rows"),
+            "lists": self.header.get("lists"),
+            "nprobe": self.nprobe,
+            "exact_threshold": self.exact_threshold,
+        }
+
+    def _rows_db(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+            self._local.conn = conn
+        return conn
+
+    def _probe(self, q: np.ndarray, nprobe: int, allowed: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """Row numbers and scores for the rows of the `nprobe` closest lists."""
+        lists = np.sort(top_k_indices(self.centroids @ q, nprobe))
+        rows, scores = [], []
+        for l in lists:
+            start, end = int(self.offsets[l]), int(self.offsets[l + 1])
+            if end > start:
+                rows.append(np.arange(start, end))
+                # Slices of the mapped matrix are views: no copy before the matmul.
+                scores.append(self.vectors[start:end] @ q)
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        rows, scores = np.concatenate(rows), np.concatenate(scores)
+        if allowed is not None:
+            mask = allowed[self.codes[rows]]
+            rows, scores = rows[mask], scores[mask]
+        return rows, scores
+
+    def search(self, queries: Sequence[Sequence[float]], k: int = 5, books: Optional[Sequence[str]] = None,
+               nprobe: Optional[int] = None, ids: Optional[Sequence[int]] = None) -> List[List[Dict[str, Any]]]:
+        """Approximate cosine top-k for a batch of query vectors (see `VectorIndex.search`).
+
+        With `ids` only those rows are scored, exactly: a section filter is a
+        small slice of the corpus, and probing lists would mostly miss it.
+        """
+        q = np.asarray(queries, dtype=np.float32)
+        if q.ndim == 1:
+            q = q[None, :]
+        if q.shape[1] != self.dim:
+            raise ValueError(f"Query dimension {q.shape[1]} does not match index dimension {self.dim}")
+        q_norms = np.linalg.norm(q, axis=1, keepdims=True)
+        q = q / np.where(q_norms > 0, q_norms, 1.0)
+        n_lists = self.header["lists"]
+        nprobe = max(1, min(nprobe or self.nprobe, n_lists))
+
+        allowed = None
+        exact_rows = None
+        exact_all = False
+        if books:
+            wanted = [b for b in books if b in self._book_rows]
+            if not wanted:
+                return [[] for _ in range(q.shape[0])]
+            allowed = np.zeros(len(self.header["books"]), dtype=bool)
+            allowed[[self.header["books"].index(b) for b in wanted]] = True
+            if sum(len(self._book_rows[b]) for b in wanted) <= self.exact_threshold:
+                exact_rows = np.sort(np.concatenate([self._book_rows[b] for b in wanted]))
+        elif self.header["rows"] <= self.exact_threshold:
+            exact_all = True
+        if ids is not None:
+            selected = np.isin(self.ids, np.asarray(ids, dtype=np.int64))
+            if allowed is not None:
+                selected &= allowed[self.codes]
+            exact_rows, exact_all = np.flatnonzero(selected), False
+
+        picked: List[List[Tuple[int, float]]] = []
+        for qi in range(q.shape[0]):
+            if exact_all:
+                rows, scores = None, self.vectors @ q[qi]
+            elif exact_rows is not None:
+                rows, scores = exact_rows, self.vectors[exact_rows] @ q[qi]
+            else:
+                rows, scores = self._probe(q[qi], nprobe, allowed)
+                # A narrow book filter can leave too few rows in the probed lists; widen.
+                probe = nprobe
+                while len(rows) < k and probe < n_lists:
+                    probe = min(probe * 2, n_lists)
+                    rows, scores = self._probe(q[qi], probe, allowed)
+            best = top_k_indices(scores, k)
+            row_ids = best if rows is None else rows[best]
+            picked.append([(int(self.ids[r]), float(scores[i])) for r, i in zip(row_ids, best)])
+        return self._hydrate(picked)
+
+    def _hydrate(self, picked: List[List[Tuple[int, float]]]) -> List[List[Dict[str, Any]]]:
+        wanted = sorted({cid for hits in picked for cid, _ in hits})
+        meta: Dict[int, Dict[str, Any]] = {}
+        conn = self._rows_db()
+        for i in range(0, len(wanted), 500):
+            part = wanted[i:i + 500]
+            for cid, book, start_page, end_page, text in conn.execute(
+                f"SELECT id, book, start_page, end_page, text FROM chunks WHERE id IN ({','.join('?' * len(part))})", part
+            ):
+                meta[cid] = {"id": cid, "book": book, "start_page": start_page, "end_page": end_page, "text": text}
+        return [
+            [dict(meta[cid], score=score) for cid, score in hits if cid in meta]
+            for hits in picked
+        ]
+
+
+def main():
+    p = argparse.ArgumentParser(description="Build an IVF ANN index from a rag_vectors.db file")
+    p.add_argument("--db", default="rag_vectors.db", help="Source SQLite DB (chunks + embeddings)")
+    p.add_argument("--out", default=None, help="Index file (default: <db>.ivf)")
+    p.add_argument("--lists", type=int, default=None, help="Inverted lists (default: 4*sqrt(rows))")
+    p.add_argument("--iters", type=int, default=20, help="k-means iterations")
+    p.add_argument("--seed", type=int, default=0)
+    args = p.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"ERROR: database not found: {args.db}", file=sys.stderr)
+        sys.exit(2)
+    out = args.out or f"{args.db}.ivf"
+    try:
+        info = build(args.db, out, n_lists=args.lists, iters=args.iters, seed=args.seed)
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(3)
+    print(f"✓ Wrote {out}: rows={info['rows']} lists={info['lists']} dim={info['dim']} "
+          f"books={len(info['books'])} in {info['seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
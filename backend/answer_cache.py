@@ -0,0 +1,255 @@
+# Cache for RAG answers.
+#
+# An answer is only reusable for the same caller and prompt context, so
+# entries are grouped by a scope key: a hash of the caller (API key or user),
+# the model, prompt settings and the set of chunks the answer was generated
+# from. Within a scope a question matches an earlier one exactly (same
+# normalized text hash). Semantic matching (cosine similarity of the question
+# embeddings at or above a threshold) is opt-in: two clinical questions can
+# score above 0.95 yet differ in the one drug, dose or patient group that
+# changes the answer.
+#
+# Like EmbeddingCache, a bounded in-memory LRU sits in front of a SQLite
+# table, so hits survive restarts and are shared between workers.
+
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+Entry = Tuple[Optional[np.ndarray], Dict[str, Any], float]
+
+
+def answer_scope(model: str, system_prompt: Optional[str], temperature: float, max_tokens: int,
+                 chunks: Sequence[Dict[str, Any]], caller: str = "") -> str:
+    """Key for everything besides the question that shapes an answer.
+
+    `caller` keeps answers apart per API key (or per user on the server's key).
+    Chunks are identified by book, pages and text, and their order is ignored:
+    the same retrieved set gives the same scope however it was ranked.
+    """
+    chunk_keys = sorted(
+        hashlib.sha256(
+            f"{c.get('book', '')}\x1f{c.get('start_page', '')}\x1f{c.get('end_page', '')}\x1f{c.get('text', '')}".encode("utf-8")
+        ).hexdigest()
+        for c in chunks
+    )
+    h = hashlib.sha256()
+    h.update(f"{caller}\x1e{model}\x1e{system_prompt or ''}\x1e{temperature}\x1e{max_tokens}\x1e".encode("utf-8"))
+    h.update("\x1f".join(chunk_keys).encode("ascii"))
+    return h.hexdigest()
+
+
+class AnswerCache:
+    """Two-tier (memory LRU + SQLite) cache of parsed RAG answers.
+
+    Lookups match questions exactly unless `semantic` is set, in which case the
+    most similar cached question at or above `threshold` also hits. Entries
+    older than `ttl_seconds` are ignored and eventually deleted; the SQLite
+    table is trimmed to `max_db_items` by last use. Pass `db_path=None`
+    to run with the memory tier only. All methods are thread-safe; callers on
+    the event loop should run them in a threadpool.
+    """
+
+    def __init__(self, db_path: Optional[str], threshold: float = 0.95, ttl_seconds: float = 7 * 86400,
+                 max_memory_items: int = 2048, max_db_items: int = 100000, semantic: bool = False):
+        self.db_path = db_path
+        self.semantic = semantic
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_items = max_memory_items
+        self.max_db_items = max_db_items
+        self._memory: "OrderedDict[Tuple[str, str], Entry]" = OrderedDict()
+        self._scopes: Dict[str, set] = {}
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _db(self) -> Optional[sqlite3.Connection]:
+        if not self.db_path:
+            return None
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS answer_cache ("
+                "scope TEXT NOT NULL, question_hash TEXT NOT NULL, vector BLOB, payload TEXT NOT NULL, "
+                "created_at REAL NOT NULL, last_used REAL NOT NULL, "
+                "PRIMARY KEY (scope, question_hash)) WITHOUT ROWID"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS answer_cache_last_used ON answer_cache (last_used)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def open(self) -> None:
+        """Open the database now (worker warm-up) instead of on first use."""
+        with self._lock:
+            self._db()
+
+    def _remember(self, key: Tuple[str, str], entry: Entry) -> None:
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        self._scopes.setdefault(key[0], set()).add(key[1])
+        while len(self._memory) > self.max_memory_items:
+            (scope, qh), _ = self._memory.popitem(last=False)
+            self._forget_scope_key(scope, qh)
+
+    def _forget_scope_key(self, scope: str, qh: str) -> None:
+        keys = self._scopes.get(scope)
+        if keys is not None:
+            keys.discard(qh)
+            if not keys:
+                del self._scopes[scope]
+
+    def _drop(self, key: Tuple[str, str]) -> None:
+        if self._memory.pop(key, None) is not None:
+            self._forget_scope_key(*key)
+
+    @staticmethod
+    def _unit(vector: Optional[Sequence[float]]) -> Optional[np.ndarray]:
+        if vector is None:
+            return None
+        vec = np.asarray(vector, dtype=np.float32).ravel()
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm > 0 else vec
+
+    def _best(self, candidates: List[Tuple[str, Entry]], query: np.ndarray) -> Optional[Tuple[str, Entry, float]]:
+        usable = [(qh, e) for qh, e in candidates if e[0] is not None and e[0].shape == query.shape]
+        if not usable:
+            return None
+        sims = np.stack([e[0] for _, e in usable]) @ query
+        i = int(np.argmax(sims))
+        if sims[i] < self.threshold:
+            return None
+        return usable[i][0], usable[i][1], float(sims[i])
+
+    def lookup(self, scope: str, question_hash: str,
+               vector: Optional[Sequence[float]] = None) -> Optional[Tuple[Dict[str, Any], float]]:
+        """Return (payload, similarity) for a cached answer in `scope`, or None.
+
+        Without `vector`, or unless the cache is `semantic`, only an exact
+        question match can hit; otherwise the most similar cached question at or
+        above the threshold is used.
+        """
+        now = time.time()
+        cutoff = now - self.ttl_seconds
+        query = self._unit(vector) if self.semantic else None
+        with self._lock:
+            entry = self._memory.get((scope, question_hash))
+            if entry is not None and entry[2] < cutoff:
+                self._drop((scope, question_hash))
+                entry = None
+            if entry is not None:
+                self._memory.move_to_end((scope, question_hash))
+                return self._hit(scope, question_hash, entry[1], 1.0, now)
+
+            candidates: List[Tuple[str, Entry]] = []
+            for qh in list(self._scopes.get(scope, ())):
+                e = self._memory[(scope, qh)]
+                if e[2] < cutoff:
+                    self._drop((scope, qh))
+                else:
+                    candidates.append((qh, e))
+            best = self._best(candidates, query) if query is not None else None
+            if best is not None:
+                self._memory.move_to_end((scope, best[0]))
+                return self._hit(scope, best[0], best[1][1], best[2], now)
+
+            # Entries written by other workers or before a restart.
+            conn = self._db()
+            if conn is not None:
+                try:
+                    rows = conn.execute(
+                        "SELECT question_hash, vector, payload, created_at FROM answer_cache "
+                        "WHERE scope = ? AND created_at >= ?",
+                        (scope, cutoff),
+                    ).fetchall()
+                except sqlite3.Error as e:
+                    logger.warning("[answer_cache] read failed: %s", e)
+                    rows = []
+                known = self._scopes.get(scope, set())
+                disk: List[Tuple[str, Entry]] = [
+                    (qh, (np.frombuffer(blob, dtype="<f4") if blob else None, json.loads(payload), created))
+                    for qh, blob, payload, created in rows
+                    if qh not in known
+                ]
+                for qh, e in disk:
+                    if qh == question_hash:
+                        self._remember((scope, qh), e)
+                        return self._hit(scope, qh, e[1], 1.0, now)
+                best = self._best(disk, query) if query is not None else None
+                if best is not None:
+                    self._remember((scope, best[0]), best[1])
+                    return self._hit(scope, best[0], best[1][1], best[2], now)
+        if query is not None:
+            self.misses += 1
+        return None
+
+    def _hit(self, scope: str, question_hash: str, payload: Dict[str, Any], similarity: float,
+             now: float) -> Tuple[Dict[str, Any], float]:
+        self.hits += 1
+        conn = self._db()
+        if conn is not None:
+            try:
+                conn.execute(
+                    "UPDATE answer_cache SET last_used = ? WHERE scope = ? AND question_hash = ?",
+                    (now, scope, question_hash),
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.warning("[answer_cache] write failed: %s", e)
+        return payload, similarity
+
+    def put(self, scope: str, question_hash: str, vector: Optional[Sequence[float]], payload: Dict[str, Any]) -> None:
+        """Store a parsed answer (answer, citations, confidence, ...) for a question."""
+        now = time.time()
+        vec = self._unit(vector)
+        with self._lock:
+            self._remember((scope, question_hash), (vec, payload, now))
+            conn = self._db()
+            if conn is None:
+                return
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO answer_cache (scope, question_hash, vector, payload, created_at, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (scope, question_hash, vec.astype("<f4").tobytes() if vec is not None else None,
+                     json.dumps(payload), now, now),
+                )
+                self._writes += 1
+                # Expire and trim now and then rather than on every write.
+                if self._writes % 256 == 1:
+                    conn.execute("DELETE FROM answer_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+                    conn.execute(
+                        "DELETE FROM answer_cache WHERE (scope, question_hash) IN (SELECT scope, question_hash "
+                        "FROM answer_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                        (self.max_db_items,),
+                    )
+                conn.commit()
+            except sqlite3.Error as e:
+                # The disk tier is best effort; the memory tier still holds the answer.
+                logger.warning("[answer_cache] write failed: %s", e)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "db_path": self.db_path,
+            "memory_items": len(self._memory),
+            "max_memory_items": self.max_memory_items,
+            "semantic": self.semantic,
+            "threshold": self.threshold,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,156 @@
+# Token-budgeted context packing for RAG prompts.
+#
+# Chunks sent by the client (or retrieved server-side) often overlap: adjacent
+# windows of the same page, the same passage indexed from two editions, or
+# plain duplicates. Packing drops duplicates and near-duplicates, then picks
+# chunks greedily by maximal marginal relevance (relevance to the question
+# minus similarity to what is already picked) until the token budget is full.
+
+import re
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+# Prompt tokens allowed for excerpts, per model. Far below the context windows:
+# the point is a short prompt, not the largest one that fits.
+MODEL_CONTEXT_BUDGETS = {
+    "gpt-4o-mini": 6000,
+    "gpt-4o": 6000,
+    "gpt-4-turbo": 6000,
+    "gpt-3.5-turbo": 3000,
+}
+DEFAULT_CONTEXT_BUDGET = 4000
+
+# Tokens for the "[i] Book: ... Pages: ..." header and separator of each excerpt.
+EXCERPT_OVERHEAD_TOKENS = 16
+
+# Deduplication and MMR compare chunks pairwise, so only this many of the most
+# relevant chunks are considered; the rest could not fit a prompt budget anyway.
+DEFAULT_MAX_CANDIDATES = 64
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text; only used for budgeting.
+    return len(text) // 4 + 1
+
+
+def context_budget(model: str, default: int = DEFAULT_CONTEXT_BUDGET) -> int:
+    """Excerpt token budget for `model` (longest matching prefix, else `default`)."""
+    best = None
+    for name in MODEL_CONTEXT_BUDGETS:
+        if model.startswith(name) and (best is None or len(name) > len(best)):
+            best = name
+    return MODEL_CONTEXT_BUDGETS[best] if best else default
+
+
+def _shingles(words: List[str], n: int = 3) -> Set[Tuple[str, ...]]:
+    if len(words) < n:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+
+def _jaccard(a: Set[Any], b: Set[Any]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _containment(a: Set[Any], b: Set[Any]) -> float:
+    """Share of `a` that also appears in `b`."""
+    if not a:
+        return 1.0
+    return len(a & b) / len(a)
+
+
+def _relevance(question_words: Set[str], chunks: Sequence[Dict[str, Any]], words: List[List[str]]) -> List[float]:
+    """Relevance in [0, 1]: the retrieval `score` when every chunk has one,
+    otherwise question-term overlap, with the supplied order breaking ties."""
+    n = len(chunks)
+    scores = [c.get("score") for c in chunks]
+    if n and all(isinstance(s, (int, float)) for s in scores):
+        raw = [float(s) for s in scores]
+    else:
+        raw = [
+            (len(question_words & set(w)) / len(question_words) if question_words else 0.0) + 0.01 * (n - i) / n
+            for i, w in enumerate(words)
+        ]
+    lo, hi = min(raw, default=0.0), max(raw, default=0.0)
+    return [(r - lo) / (hi - lo) if hi > lo else 1.0 for r in raw]
+
+
+def pack_chunks(
+    question: str,
+    chunks: Sequence[Dict[str, Any]],
+    budget: int,
+    diversity: float = 0.3,
+    overlap_threshold: float = 0.8,
+    max_candidates: int = DEFAULT_MAX_CANDIDATES,
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Select chunks for the prompt within `budget` estimated tokens.
+
+    Only the `max_candidates` most relevant chunks are scored; the work is
+    quadratic in that number. A chunk is dropped as redundant when `overlap_threshold` of its word
+    3-grams already occur in a kept chunk. The rest are picked by MMR with
+    `diversity` weighting the penalty for similarity to picked chunks. If even
+    the best chunk does not fit, it is cut to the budget so the prompt is
+    never empty. Returns the packed chunks (best first) and packing stats.
+    """
+    texts = [c.get("text") or "" for c in chunks]
+    words = [[w.lower() for w in _WORD.findall(t)] for t in texts]
+    tokens = [estimate_tokens(t) + EXCERPT_OVERHEAD_TOKENS for t in texts]
+    relevance = _relevance({w.lower() for w in _WORD.findall(question)}, chunks, words)
+    stats: Dict[str, Any] = {
+        "budget": budget,
+        "supplied_chunks": len(chunks),
+        "supplied_tokens": sum(tokens),
+        "dropped_candidates": 0,
+        "dropped_redundant": 0,
+        "dropped_budget": 0,
+        "truncated": 0,
+    }
+
+    # Most relevant first, so the copy that survives deduplication is the best one.
+    order = sorted((i for i in range(len(chunks)) if texts[i].strip()), key=lambda i: -relevance[i])
+    if len(order) > max_candidates:
+        stats["dropped_candidates"] = len(order) - max_candidates
+        order = order[:max_candidates]
+    shingles = {i: _shingles(words[i]) for i in order}
+    candidates: List[int] = []
+    for i in order:
+        if any(_containment(shingles[i], shingles[j]) >= overlap_threshold for j in candidates):
+            stats["dropped_redundant"] += 1
+        else:
+            candidates.append(i)
+
+    picked: List[int] = []
+    packed: List[Dict[str, Any]] = []
+    used = 0
+    while candidates:
+        best, best_score = None, None
+        for i in candidates:
+            penalty = max((_jaccard(shingles[i], shingles[j]) for j in picked), default=0.0)
+            score = (1 - diversity) * relevance[i] - diversity * penalty
+            if best_score is None or score > best_score:
+                best, best_score = i, score
+        candidates.remove(best)
+        if used + tokens[best] <= budget:
+            picked.append(best)
+            packed.append(chunks[best])
+            used += tokens[best]
+        elif not picked:
+            keep_chars = max(0, (budget - EXCERPT_OVERHEAD_TOKENS) * 4)
+            picked.append(best)
+            packed.append(dict(chunks[best], text=texts[best][:keep_chars]))
+            used += estimate_tokens(packed[-1]["text"]) + EXCERPT_OVERHEAD_TOKENS
+            stats["truncated"] = 1
+        else:
+            stats["dropped_budget"] += 1
+
+    stats["packed_chunks"] = len(packed)
+    stats["packed_tokens"] = used
+    return packed, stats
+
+
+def budget_for_request(model: str, requested: Optional[int], default: int = DEFAULT_CONTEXT_BUDGET) -> int:
+    """The request's own budget when given, else the model's."""
+    return max(1, requested) if requested else context_budget(model, default)
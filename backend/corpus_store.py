@@ -0,0 +1,191 @@
+# Content-addressed corpus store.
+#
+# Chunk texts are stored once, keyed by sha256(text) (the same `content_hash`
+# tools/index_txt_to_sqlite.py writes), and books map to the hashes they
+# contain with their page ranges. A client syncs a book by sending only its
+# chunk hashes; the server answers with the hashes it lacks and only those
+# texts are uploaded. RAG requests can then name chunks by hash instead of
+# re-sending their text.
+
+import os
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# SQLite reads the file through mmap up to this size, so hot chunk text is
+# served from the shared page cache.
+MMAP_SIZE = 256 * 1024 * 1024
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _chunks(seq: Sequence[Any], size: int = 500) -> Iterable[Sequence[Any]]:
+    # Stay well under SQLite's bound-parameter limit.
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+class CorpusStore:
+    """SQLite store of chunk texts by hash plus book membership. Thread-safe."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+            conn.executescript(
+                "CREATE TABLE IF NOT EXISTS corpus_chunks ("
+                "hash TEXT PRIMARY KEY, text TEXT NOT NULL, created_at REAL NOT NULL) WITHOUT ROWID;"
+                "CREATE TABLE IF NOT EXISTS corpus_book_chunks ("
+                "book TEXT NOT NULL, hash TEXT NOT NULL, position INTEGER, start_page INTEGER, end_page INTEGER, "
+                "PRIMARY KEY (book, hash)) WITHOUT ROWID;"
+                "CREATE INDEX IF NOT EXISTS corpus_book_chunks_hash ON corpus_book_chunks (hash);"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def open(self) -> None:
+        """Open the database now (worker warm-up) instead of on first use."""
+        with self._lock:
+            self._db()
+
+    def _present(self, conn: sqlite3.Connection, hashes: Sequence[str]) -> set:
+        present = set()
+        for part in _chunks(list(hashes)):
+            present.update(row[0] for row in conn.execute(
+                f"SELECT hash FROM corpus_chunks WHERE hash IN ({','.join('?' * len(part))})", part
+            ))
+        return present
+
+    def sync_book(self, book: str, entries: List[Dict[str, Any]], replace: bool = False) -> List[str]:
+        """Record that `book` consists of `entries` ({hash, start_page?, end_page?}).
+
+        With `replace`, hashes no longer listed are removed from the book.
+        Returns the hashes whose text the store does not have yet, in order.
+        """
+        rows = [
+            (book, e["hash"], i, e.get("start_page"), e.get("end_page"))
+            for i, e in enumerate(entries)
+        ]
+        with self._lock:
+            conn = self._db()
+            with conn:
+                if replace:
+                    conn.execute("DELETE FROM corpus_book_chunks WHERE book = ?", (book,))
+                conn.executemany(
+                    "INSERT OR REPLACE INTO corpus_book_chunks (book, hash, position, start_page, end_page) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    rows,
+                )
+                present = self._present(conn, [r[1] for r in rows])
+        seen = set()
+        missing = []
+        for r in rows:
+            if r[1] not in present and r[1] not in seen:
+                seen.add(r[1])
+                missing.append(r[1])
+        return missing
+
+    def upload(self, texts: List[Tuple[Optional[str], str]]) -> Tuple[int, List[int]]:
+        """Store (claimed hash, text) pairs. Returns (new texts stored, indexes whose
+        claimed hash did not match the text; those are not stored)."""
+        now = time.time()
+        rows, mismatched = [], []
+        for i, (claimed, text) in enumerate(texts):
+            h = content_hash(text)
+            if claimed and claimed != h:
+                mismatched.append(i)
+                continue
+            rows.append((h, text, now))
+        with self._lock:
+            conn = self._db()
+            with conn:
+                before = conn.total_changes
+                conn.executemany("INSERT OR IGNORE INTO corpus_chunks (hash, text, created_at) VALUES (?, ?, ?)", rows)
+                stored = conn.total_changes - before
+        return stored, mismatched
+
+    def resolve(self, hashes: Sequence[str], books: Optional[Sequence[str]] = None) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """Chunk dicts ({hash, text, book, start_page, end_page}) for `hashes`, in
+        order, and the hashes that are unknown. Book and pages come from the
+        book the hash was synced with (preferring `books` when given)."""
+        unique = list(dict.fromkeys(hashes))
+        texts: Dict[str, str] = {}
+        meta: Dict[str, Tuple[str, Any, Any]] = {}
+        preferred = set(books or ())
+        with self._lock:
+            conn = self._db()
+            for part in _chunks(unique):
+                marks = ",".join("?" * len(part))
+                texts.update(conn.execute(f"SELECT hash, text FROM corpus_chunks WHERE hash IN ({marks})", part))
+                for h, book, start_page, end_page in conn.execute(
+                    f"SELECT hash, book, start_page, end_page FROM corpus_book_chunks WHERE hash IN ({marks})", part
+                ):
+                    if h not in meta or (book in preferred and meta[h][0] not in preferred):
+                        meta[h] = (book, start_page, end_page)
+        chunks, missing = [], []
+        for h in hashes:
+            if h not in texts:
+                missing.append(h)
+                continue
+            book, start_page, end_page = meta.get(h, ("Unknown", None, None))
+            chunks.append({"hash": h, "text": texts[h], "book": book, "start_page": start_page, "end_page": end_page})
+        return chunks, list(dict.fromkeys(missing))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            conn = self._db()
+            chunks = conn.execute("SELECT COUNT(*) FROM corpus_chunks").fetchone()[0]
+            books = conn.execute("SELECT COUNT(DISTINCT book) FROM corpus_book_chunks").fetchone()[0]
+        return {"db_path": self.db_path, "chunks": chunks, "books": books}
+
+
+def load_index_chunks(db_path: str, ids: Sequence[int]) -> Tuple[List[Dict[str, Any]], List[int]]:
+    """Chunks of the server-side vector database (`RAG_VECTORS_DB`) by id, in
+    order, plus the ids it does not contain."""
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(f"Vector database not found: {db_path}")
+    found: Dict[int, Dict[str, Any]] = {}
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        for part in _chunks(list(dict.fromkeys(ids))):
+            for cid, book, start_page, end_page, text in conn.execute(
+                f"SELECT id, book, start_page, end_page, text FROM chunks WHERE id IN ({','.join('?' * len(part))})", part
+            ):
+                found[cid] = {"id": cid, "book": book, "start_page": start_page, "end_page": end_page, "text": text}
+    finally:
+        conn.close()
+    return [found[i] for i in ids if i in found], [i for i in dict.fromkeys(ids) if i not in found]
+
+
+def section_chunk_ids(db_path: str, sections: Sequence[str]) -> List[int]:
+    """Ids of vector database chunks whose TOC chapter or section starts with
+    one of `sections` (case-insensitive), e.g. "13. Malaria" or "Chapter 9".
+    Raises ValueError when the database has no chapter/section tags."""
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(f"Vector database not found: {db_path}")
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(chunks)")}
+        if "chapter" not in columns:
+            raise ValueError("Chunks have no sections; re-index with tools/index_txt_to_sqlite.py")
+        patterns = [s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%" for s in sections]
+        where = " OR ".join(["chapter LIKE ? ESCAPE '\\' OR section LIKE ? ESCAPE '\\'"] * len(patterns))
+        params = [p for pattern in patterns for p in (pattern, pattern)]
+        return [row[0] for row in conn.execute(f"SELECT id FROM chunks WHERE {where} ORDER BY id", params)]
+    finally:
+        conn.close()
@@ -0,0 +1,136 @@
+# Dynamic micro-batching of concurrent embedding requests.
+#
+# Texts from requests that arrive within a short window (or until a text or
+# token cap is reached) are sent upstream as one embeddings call, and each
+# request gets back its own vectors in input order. Under a requests-per-minute
+# limit, a few large calls go further than many one-question calls.
+
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+EmbedCall = Callable[[List[str], str, Optional[str]], Awaitable[List[List[float]]]]
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text; only used for batch sizing.
+    return len(text) // 4 + 1
+
+
+class _Batch:
+    __slots__ = ("requests", "texts", "tokens", "timer", "opened")
+
+    def __init__(self) -> None:
+        self.requests: List[Tuple[List[str], "asyncio.Future[List[List[float]]]"]] = []
+        self.texts = 0
+        self.tokens = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.opened = time.monotonic()
+
+
+class EmbedBatcher:
+    """Collects concurrent embedding requests into shared upstream calls.
+
+    Requests are grouped by (model, API key), since one upstream call can only
+    use one of each. A batch is sent `window_ms` after its first request
+    arrives, or as soon as adding a request would exceed `max_texts` or
+    `max_tokens`. Requests are never split across batches, and batches are
+    sent in arrival order. Requests at or over a cap on their own go straight
+    upstream. Identical texts within a batch are embedded once. Must be used
+    from a single event loop.
+    """
+
+    def __init__(self, call: EmbedCall, window_ms: float = 5.0, max_texts: int = 256, max_tokens: int = 100000):
+        self.call = call
+        self.window_ms = window_ms
+        self.max_texts = max_texts
+        self.max_tokens = max_tokens
+        self._open: Dict[Tuple[str, str], _Batch] = {}
+        # The loop only keeps weak references to tasks: hold the batches in flight.
+        self._sending: Set["asyncio.Task[None]"] = set()
+        self._stats = {"requests": 0, "texts": 0, "batches": 0, "upstream_texts": 0, "direct": 0, "errors": 0}
+
+    async def embed(self, texts: List[str], model: str, api_key: Optional[str] = None) -> List[List[float]]:
+        """Vectors for `texts`, in order, from a shared upstream call."""
+        tokens = sum(estimate_tokens(t) for t in texts)
+        self._stats["requests"] += 1
+        self._stats["texts"] += len(texts)
+        if self.window_ms <= 0 or len(texts) >= self.max_texts or tokens >= self.max_tokens:
+            self._stats["direct"] += 1
+            return await self.call(texts, model, api_key)
+
+        group = (model, api_key or "")
+        batch = self._open.get(group)
+        if batch is not None and (batch.texts + len(texts) > self.max_texts or batch.tokens + tokens > self.max_tokens):
+            self._flush(group)
+            batch = None
+        if batch is None:
+            batch = _Batch()
+            batch.timer = asyncio.get_running_loop().call_later(self.window_ms / 1000.0, self._flush, group, batch)
+            self._open[group] = batch
+
+        future: "asyncio.Future[List[List[float]]]" = asyncio.get_running_loop().create_future()
+        batch.requests.append((texts, future))
+        batch.texts += len(texts)
+        batch.tokens += tokens
+        if batch.texts >= self.max_texts or batch.tokens >= self.max_tokens:
+            self._flush(group)
+        # shield: a cancelled request must not cancel the batch's other waiters.
+        return await asyncio.shield(future)
+
+    def _flush(self, group: Tuple[str, str], batch: Optional[_Batch] = None) -> None:
+        current = self._open.get(group)
+        if current is None or (batch is not None and current is not batch):
+            return  # the timer fired for a batch that was already sent
+        del self._open[group]
+        if current.timer is not None:
+            current.timer.cancel()
+        task = asyncio.ensure_future(self._send(group, current))
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def aclose(self) -> None:
+        """Send the batches still collecting and wait for every batch in flight."""
+        for group in list(self._open):
+            self._flush(group)
+        if self._sending:
+            await asyncio.gather(*self._sending, return_exceptions=True)
+
+    async def _send(self, group: Tuple[str, str], batch: _Batch) -> None:
+        model, api_key = group
+        unique: Dict[str, int] = {}
+        for texts, _ in batch.requests:
+            for t in texts:
+                unique.setdefault(t, len(unique))
+        self._stats["batches"] += 1
+        self._stats["upstream_texts"] += len(unique)
+        try:
+            vectors = await self.call(list(unique), model, api_key or None)
+        except asyncio.CancelledError:
+            for _, future in batch.requests:
+                future.cancel()
+            raise
+        except Exception as e:
+            self._stats["errors"] += 1
+            for _, future in batch.requests:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        logger.debug(
+            "[embed_batcher] sent requests=%d texts=%d waited_ms=%.1f",
+            len(batch.requests), len(unique), (time.monotonic() - batch.opened) * 1000,
+        )
+        for texts, future in batch.requests:
+            if not future.done():
+                future.set_result([vectors[unique[t]] for t in texts])
+
+    def stats(self) -> Dict[str, Any]:
+        s: Dict[str, Any] = dict(self._stats)
+        batched = s["requests"] - s["direct"]
+        s["requests_per_batch"] = round(batched / s["batches"], 2) if s["batches"] else 0.0
+        s["in_flight"] = len(self._sending)
+        s.update(window_ms=self.window_ms, max_texts=self.max_texts, max_tokens=self.max_tokens)
+        return s
@@ -0,0 +1,116 @@
+# Content-addressed cache for embeddings.
+#
+# Entries are keyed on (model, sha256(text)). A bounded in-memory LRU sits in
+# front of an on-disk SQLite table holding compact float32 blobs, so the same
+# chunk or question is only ever embedded upstream once per model, across
+# requests, workers and restarts.
+
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Two-tier (memory LRU + SQLite) embedding cache.
+
+    Pass `db_path=None` to run with the memory tier only. All methods are
+    thread-safe; callers on the event loop should run them in a threadpool.
+    """
+
+    def __init__(self, db_path: Optional[str], max_memory_items: int = 4096):
+        self.db_path = db_path
+        self.max_memory_items = max_memory_items
+        self._memory: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _db(self) -> Optional[sqlite3.Connection]:
+        if not self.db_path:
+            return None
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embedding_cache ("
+                "model TEXT NOT NULL, text_hash TEXT NOT NULL, dim INTEGER NOT NULL, vector BLOB NOT NULL, "
+                "PRIMARY KEY (model, text_hash)) WITHOUT ROWID"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def open(self) -> None:
+        """Open the database now (worker warm-up) instead of on first use."""
+        with self._lock:
+            self._db()
+
+    def _remember(self, key: Tuple[str, str], vector: np.ndarray) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model: str, hashes: Iterable[str]) -> Dict[str, np.ndarray]:
+        """Return cached vectors for the given text hashes (misses are omitted)."""
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            missing = []
+            for h in hashes:
+                vec = self._memory.get((model, h))
+                if vec is None:
+                    missing.append(h)
+                else:
+                    self._memory.move_to_end((model, h))
+                    found[h] = vec
+            conn = self._db() if missing else None
+            if conn is not None:
+                # Stay well under SQLite's bound-parameter limit.
+                for i in range(0, len(missing), 500):
+                    part = missing[i:i + 500]
+                    marks = ",".join("?" * len(part))
+                    rows = conn.execute(
+                        f"SELECT text_hash, vector FROM embedding_cache WHERE model = ? AND text_hash IN ({marks})",
+                        [model, *part],
+                    ).fetchall()
+                    for h, blob in rows:
+                        vec = np.frombuffer(blob, dtype="<f4")
+                        found[h] = vec
+                        self._remember((model, h), vec)
+        return found
+
+    def put_many(self, model: str, items: Dict[str, List[float]]) -> None:
+        """Store vectors keyed by text hash."""
+        if not items:
+            return
+        with self._lock:
+            rows = []
+            for h, values in items.items():
+                vec = np.asarray(values, dtype="<f4")
+                self._remember((model, h), vec)
+                rows.append((model, h, int(vec.shape[0]), vec.tobytes()))
+            conn = self._db()
+            if conn is not None:
+                try:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO embedding_cache (model, text_hash, dim, vector) VALUES (?, ?, ?, ?)",
+                        rows,
+                    )
+                    conn.commit()
+                except sqlite3.Error as e:
+                    # The disk tier is best effort; the memory tier still holds the vectors.
+                    logger.warning("[embedding_cache] write failed: %s", e)
+
+    def stats(self) -> Dict[str, object]:
+        return {"db_path": self.db_path, "memory_items": len(self._memory), "max_memory_items": self.max_memory_items}
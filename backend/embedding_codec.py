@@ -0,0 +1,101 @@
+# Compact encodings for embedding responses.
+#
+# JSON float lists cost ~30 KB per 1536-dimension vector. These helpers pack a
+# (count, dim) float32 matrix into base64 or raw little-endian buffers:
+#
+#   float64  - 8 bytes/value, byte-for-byte the `VectorDB` blob layout
+#   float32  - 4 bytes/value
+#   float16  - 2 bytes/value
+#   int8     - 1 byte/value plus one float32 scale per vector (value = q * scale)
+#
+# Binary int8 bodies carry the scales ahead of the codes, not in a header.
+
+import io
+import json
+import base64
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib encoder
+    orjson = None
+
+ENCODINGS = ("float", "float64", "float32", "float16", "int8")
+BINARY_MEDIA_TYPES = ("application/octet-stream", "application/x-npy")
+
+_DTYPES = {"float64": "<f8", "float32": "<f4", "float16": "<f2", "int8": "i1"}
+
+
+def _json_default(obj: Any) -> Any:
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response that serializes NumPy arrays directly (orjson when installed)."""
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+        return json.dumps(content, default=_json_default, separators=(",", ":")).encode("utf-8")
+
+
+def quantize(matrix: np.ndarray, encoding: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Convert a float matrix to the little-endian dtype for `encoding`.
+
+    Returns the packed matrix and, for int8, the per-vector float32 scales.
+    """
+    if encoding == "int8":
+        peak = np.abs(matrix).max(axis=1) if matrix.size else np.zeros(matrix.shape[0], dtype=np.float32)
+        scales = (np.where(peak > 0, peak, 1.0) / 127.0).astype("<f4")
+        packed = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype("i1")
+        return packed, scales
+    return np.ascontiguousarray(matrix, dtype=_DTYPES[encoding]), None
+
+
+def encode_json(matrix: np.ndarray, encoding: str) -> Dict[str, Any]:
+    """Fields for a JSON response: `embeddings` as float lists or base64 strings."""
+    if encoding == "float":
+        return {"embeddings": matrix, "encoding": "float"}
+    packed, scales = quantize(matrix, encoding)
+    out: Dict[str, Any] = {
+        "embeddings": [base64.b64encode(row.tobytes()).decode("ascii") for row in packed],
+        "encoding": encoding,
+        "dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+    }
+    if scales is not None:
+        out["scales"] = scales
+    return out
+
+
+def binary_response(matrix: np.ndarray, encoding: str, media_type: str, headers: Dict[str, str]) -> Response:
+    """Raw row-major buffer (octet-stream) or `.npy` data for the whole batch.
+
+    Shape and dtype travel in X-Embedding-* headers. The int8 scales, one
+    float32 per vector, are body data: a header sized by the batch would run
+    into proxy header limits. They come first, as a block of `count` little-
+    endian float32 (octet-stream) or as a separate `.npy` array before the
+    codes (read both with two `np.load` calls on one file object), and
+    X-Embedding-Layout says which layout the body has.
+    """
+    packed, scales = quantize(matrix, "float32" if encoding == "float" else encoding)
+    headers = dict(headers)
+    headers["X-Embedding-Count"] = str(packed.shape[0])
+    headers["X-Embedding-Dim"] = str(packed.shape[1] if packed.ndim == 2 else 0)
+    headers["X-Embedding-Dtype"] = packed.dtype.str
+    headers["X-Embedding-Layout"] = "scales,values" if scales is not None else "values"
+    parts = [scales, packed] if scales is not None else [packed]
+    if media_type == "application/x-npy":
+        buf = io.BytesIO()
+        for part in parts:
+            np.save(buf, part, allow_pickle=False)
+        body = buf.getvalue()
+    else:
+        body = b"".join(part.tobytes() for part in parts)
+    return Response(content=body, media_type=media_type, headers=headers)
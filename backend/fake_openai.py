@@ -0,0 +1,247 @@
+# Local stand-in for the OpenAI API routes the backend uses.
+#
+# Implements /v1/chat/completions (plain and streamed) and /v1/embeddings with
+# configurable latency, token streaming and 429/timeout injection, so the
+# backend can be exercised and load-tested offline without a real key.
+#
+# Run with:
+#   uvicorn backend.fake_openai:app --port 9000
+# and point the backend at it:
+#   OPENAI_BASE_URL=http://localhost:9000/v1 OPENAI_API_KEY=sk-fake uvicorn backend.main:app
+#
+# Behaviour is configured with FAKE_* environment variables (see FakeConfig)
+# or at runtime with POST /_control, e.g. {"error_rate_429": 0.1}.
+
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+class FakeConfig:
+    """Latency and fault-injection settings for the fake upstream."""
+
+    FIELDS = {
+        "latency_ms": float,       # mean time before the first byte
+        "latency_dist": str,       # fixed | uniform | exponential | lognormal
+        "latency_jitter": float,   # spread for uniform/lognormal, as a fraction of the mean
+        "token_delay_ms": float,   # delay between streamed tokens
+        "embedding_latency_ms": float,
+        "error_rate_429": float,   # probability of answering 429
+        "timeout_rate": float,     # probability of stalling for `timeout_seconds`
+        "timeout_seconds": float,
+        "embedding_dim": int,
+        "completion_words": int,   # length of generated answers
+    }
+
+    def __init__(self):
+        self.latency_ms = float(os.getenv("FAKE_LATENCY_MS", "300"))
+        self.latency_dist = os.getenv("FAKE_LATENCY_DIST", "lognormal")
+        self.latency_jitter = float(os.getenv("FAKE_LATENCY_JITTER", "0.5"))
+        self.token_delay_ms = float(os.getenv("FAKE_TOKEN_DELAY_MS", "15"))
+        self.embedding_latency_ms = float(os.getenv("FAKE_EMBEDDING_LATENCY_MS", "60"))
+        self.error_rate_429 = float(os.getenv("FAKE_ERROR_RATE_429", "0"))
+        self.timeout_rate = float(os.getenv("FAKE_TIMEOUT_RATE", "0"))
+        self.timeout_seconds = float(os.getenv("FAKE_TIMEOUT_SECONDS", "60"))
+        self.embedding_dim = int(os.getenv("FAKE_EMBEDDING_DIM", "1536"))
+        self.completion_words = int(os.getenv("FAKE_COMPLETION_WORDS", "80"))
+        self.rng = random.Random(int(os.getenv("FAKE_SEED", "0")))
+
+    def update(self, values: Dict[str, Any]) -> None:
+        for name, value in values.items():
+            if name in self.FIELDS:
+                setattr(self, name, self.FIELDS[name](value))
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def sample_latency(self, mean_ms: float) -> float:
+        """Seconds to wait, drawn from the configured distribution."""
+        if mean_ms <= 0:
+            return 0.0
+        dist = self.latency_dist
+        if dist == "fixed":
+            ms = mean_ms
+        elif dist == "uniform":
+            spread = mean_ms * self.latency_jitter
+            ms = self.rng.uniform(mean_ms - spread, mean_ms + spread)
+        elif dist == "exponential":
+            ms = self.rng.expovariate(1.0 / mean_ms)
+        else:
+            # lognormal with the requested mean
+            sigma = max(self.latency_jitter, 1e-6)
+            mu = np.log(mean_ms) - sigma * sigma / 2
+            ms = self.rng.lognormvariate(mu, sigma)
+        return max(ms, 0.0) / 1000.0
+
+
+def fake_embeddings(texts: List[str], dim: int) -> np.ndarray:
+    """Deterministic hashed bag-of-words embeddings, computed for the whole batch at once.
+
+    Texts sharing words get similar vectors, so retrieval over fake vectors still
+    behaves sensibly in tests.
+    """
+    rows, cols, signs = [], [], []
+    for i, text in enumerate(texts):
+        tokens = _TOKEN_RE.findall(text.lower()) or [""]
+        digests = [hashlib.blake2b(t.encode("utf-8"), digest_size=8).digest() for t in tokens]
+        values = np.frombuffer(b"".join(digests), dtype="<u8")
+        rows.append(np.full(len(values), i, dtype=np.int64))
+        cols.append((values % dim).astype(np.int64))
+        signs.append(np.where((values >> np.uint64(63)) == 0, 1.0, -1.0))
+    out = np.zeros((len(texts), dim), dtype=np.float32)
+    if texts:
+        np.add.at(out, (np.concatenate(rows), np.concatenate(cols)), np.concatenate(signs))
+    norms = np.linalg.norm(out, axis=1, keepdims=True)
+    out /= np.where(norms > 0, norms, 1.0)
+    return out
+
+
+def _count_tokens(text: str) -> int:
+    return len(_TOKEN_RE.findall(text))
+
+
+def _completion_text(messages: List[Dict[str, Any]], words: int) -> str:
+    """Produce a reply shaped like what the backend prompts ask for."""
+    prompt = "\n".join(str(m.get("content", "")) for m in messages)
+    vocab = [w for w in _TOKEN_RE.findall(prompt) if w.isalpha()] or ["guideline"]
+    seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8], 16)
+    rnd = random.Random(seed)
+    body = " ".join(rnd.choice(vocab) for _ in range(words))
+    if "JSON array" in prompt:
+        pairs = [{"question": f"What does the text say about {rnd.choice(vocab)}?", "answer": body[:200]} for _ in range(3)]
+        return json.dumps(pairs)
+    return json.dumps({
+        "answer": body,
+        "citations": [{"book": "fake", "page": rnd.randint(1, 400)}],
+        "confidence": round(rnd.uniform(0.5, 0.95), 2),
+    })
+
+
+def create_app(config: Optional[FakeConfig] = None) -> FastAPI:
+    cfg = config or FakeConfig()
+    fake = FastAPI(title="Fake OpenAI upstream")
+    fake.state.config = cfg
+    stats: Dict[str, int] = {"chat": 0, "chat_stream": 0, "embeddings": 0, "embedded_texts": 0, "errors_429": 0, "timeouts": 0}
+    fake.state.stats = stats
+
+    async def inject_faults() -> Optional[JSONResponse]:
+        roll = cfg.rng.random()
+        if roll < cfg.error_rate_429:
+            stats["errors_429"] += 1
+            return JSONResponse(
+                status_code=429,
+                headers={"retry-after": "1"},
+                content={"error": {"message": "Rate limit reached (fake)", "type": "requests", "code": "rate_limit_exceeded"}},
+            )
+        if roll < cfg.error_rate_429 + cfg.timeout_rate:
+            stats["timeouts"] += 1
+            await asyncio.sleep(cfg.timeout_seconds)
+        return None
+
+    @fake.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        fault = await inject_faults()
+        if fault is not None:
+            return fault
+        await asyncio.sleep(cfg.sample_latency(cfg.latency_ms))
+
+        model = body.get("model", "gpt-4o-mini")
+        messages = body.get("messages", [])
+        text = _completion_text(messages, cfg.completion_words)
+        prompt_tokens = sum(_count_tokens(str(m.get("content", ""))) for m in messages)
+        completion_tokens = _count_tokens(text)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+        created = int(time.time())
+
+        if not body.get("stream"):
+            stats["chat"] += 1
+            return {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+                "usage": usage,
+            }
+
+        stats["chat_stream"] += 1
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+        pieces = re.findall(r"\S+\s*", text)
+
+        async def events():
+            for piece in pieces:
+                chunk = {
+                    "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                if cfg.token_delay_ms > 0:
+                    await asyncio.sleep(cfg.token_delay_ms / 1000.0)
+            final = {
+                "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            }
+            yield f"data: {json.dumps(final)}\n\n"
+            if include_usage:
+                yield f"data: {json.dumps({'id': 'chatcmpl-fake', 'object': 'chat.completion.chunk', 'created': created, 'model': model, 'choices': [], 'usage': usage})}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @fake.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        fault = await inject_faults()
+        if fault is not None:
+            return fault
+        await asyncio.sleep(cfg.sample_latency(cfg.embedding_latency_ms))
+
+        texts = body.get("input", [])
+        if isinstance(texts, str):
+            texts = [texts]
+        dim = int(body.get("dimensions") or cfg.embedding_dim)
+        vectors = fake_embeddings(texts, dim)
+        stats["embeddings"] += 1
+        stats["embedded_texts"] += len(texts)
+        tokens = sum(_count_tokens(t) for t in texts)
+        return {
+            "object": "list",
+            "model": body.get("model", "text-embedding-3-small"),
+            "data": [{"object": "embedding", "index": i, "embedding": vec} for i, vec in enumerate(vectors.tolist())],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    @fake.get("/v1/models")
+    async def models():
+        # Used by the backend's warm-up to open connections.
+        return {"object": "list", "data": [{"id": "gpt-4o-mini", "object": "model", "owned_by": "fake"}]}
+
+    @fake.get("/_stats")
+    async def get_stats():
+        return {"config": cfg.as_dict(), "stats": stats}
+
+    @fake.post("/_control")
+    async def control(request: Request):
+        cfg.update(await request.json())
+        return {"config": cfg.as_dict()}
+
+    return fake
+
+
+app = create_app()
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("FAKE_OPENAI_PORT", "9000")))
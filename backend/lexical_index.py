@@ -0,0 +1,130 @@
+# BM25 search over the `chunks_fts` FTS5 table built by tools/index_txt_to_sqlite.py,
+# and reciprocal rank fusion for combining it with the vector index.
+#
+# Dense vectors are weak on exact tokens such as drug names and doses
+# ("artemether-lumefantrine", "TLD", "300mg"); an inverted index answers
+# those directly and covers chunks that have no embedding yet.
+
+import os
+import re
+import json
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+FTS_TABLE = "chunks_fts"
+
+# Constant from the original RRF paper; dampens the weight of top ranks.
+RRF_K = 60
+
+_TERM_RE = re.compile(r"[\w][\w\-./]*", re.UNICODE)
+
+# Question words that add nothing but posting-list scans.
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it of on or should "
+    "the to was what when where which who why with".split()
+)
+
+
+def fts_query(text: str) -> Optional[str]:
+    """Turn free text into an FTS5 OR-query of quoted terms.
+
+    Each term is quoted, so punctuation cannot be read as query syntax and a
+    hyphenated name becomes a phrase ("artemether-lumefantrine" matches the
+    adjacent tokens artemether, lumefantrine). Returns None if nothing is left.
+    """
+    terms = []
+    seen = set()
+    for term in _TERM_RE.findall(text.lower()):
+        term = term.strip("-./")
+        if not term or term in STOPWORDS or term in seen:
+            continue
+        seen.add(term)
+        terms.append('"' + term.replace('"', '""') + '"')
+    return " OR ".join(terms) if terms else None
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Dict[str, Any]]], k: int = RRF_K) -> List[Dict[str, Any]]:
+    """Merge ranked hit lists (best first) by sum of 1 / (k + rank).
+
+    Hits are matched on `id`; the first copy of each row is kept and gets the
+    fused `score`. Rank-based fusion needs no calibration between BM25 and
+    cosine scores, which live on unrelated scales.
+    """
+    fused: Dict[Any, float] = {}
+    rows: Dict[Any, Dict[str, Any]] = {}
+    for ranking in rankings:
+        for rank, hit in enumerate(ranking, start=1):
+            key = hit.get("id")
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank)
+            rows.setdefault(key, hit)
+    out = []
+    for key in sorted(fused, key=fused.get, reverse=True):
+        row = dict(rows[key])
+        row["score"] = fused[key]
+        out.append(row)
+    return out
+
+
+class LexicalIndex:
+    """Read-only BM25 search over a `rag_vectors.db` file (one connection per thread)."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if not os.path.exists(self.db_path):
+                raise FileNotFoundError(f"Vector database not found: {self.db_path}")
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+            self._local.conn = conn
+        return conn
+
+    @property
+    def available(self) -> bool:
+        try:
+            row = self._conn().execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)
+            ).fetchone()
+        except (FileNotFoundError, sqlite3.Error):
+            return False
+        return row is not None
+
+    def search(self, question: str, k: int = 5, books: Optional[Sequence[str]] = None,
+               ids: Optional[Sequence[int]] = None) -> List[Dict[str, Any]]:
+        """BM25 top-k chunks for `question`, best first.
+
+        Each hit is the chunk row plus `score` (the negated FTS5 bm25 value, so
+        higher is better). `ids` restricts the hits to those chunks. Raises
+        FileNotFoundError when there is no FTS index.
+        """
+        query = fts_query(question)
+        if query is None or k <= 0:
+            return []
+        sql = (
+            f"SELECT c.id, c.book, c.start_page, c.end_page, c.text, bm25({FTS_TABLE}) AS rank "
+            f"FROM {FTS_TABLE} JOIN chunks c ON c.id = {FTS_TABLE}.rowid "
+            f"WHERE {FTS_TABLE} MATCH ?"
+        )
+        params: List[Any] = [query]
+        if books:
+            sql += f" AND c.book IN ({','.join('?' * len(books))})"
+            params.extend(books)
+        if ids is not None:
+            # One JSON parameter however many ids a section has.
+            sql += " AND c.id IN (SELECT value FROM json_each(?))"
+            params.append(json.dumps([int(i) for i in ids]))
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(int(k))
+        try:
+            rows = self._conn().execute(sql, params).fetchall()
+        except sqlite3.OperationalError as e:
+            if "no such table" in str(e) or "no such module" in str(e):
+                raise FileNotFoundError(f"No {FTS_TABLE} table in {self.db_path}; re-run tools/index_txt_to_sqlite.py")
+            raise
+        return [
+            {"id": cid, "book": book, "start_page": sp, "end_page": ep, "text": text, "score": -float(rank)}
+            for cid, book, sp, ep, text, rank in rows
+        ]
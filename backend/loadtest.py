@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Load generator for the Tasha backend.
+
+Drives one or more endpoints at a target concurrency and reports p50/p95/p99
+latency, throughput and errors per endpoint (plus time-to-first-token for the
+streaming endpoint).
+
+Against a running server (pointed at a real or fake upstream):
+  python backend/loadtest.py --base-url http://localhost:8000 --endpoint rag_answer --concurrency 20 --requests 200
+
+Fully offline, e.g. in CI: the backend app and the fake upstream from
+fake_openai.py both run in-process, no sockets or API key needed:
+  python backend/loadtest.py --in-process --endpoint embeddings --endpoint rag_answer --concurrency 50 --duration 10
+
+In-process mode goes through httpx's ASGI transport, which buffers whole
+responses, so time-to-first-token is only meaningful against a real server.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+ENDPOINTS = ("embeddings", "rag_answer", "rag_stream", "rag_ask", "train_book")
+
+QUESTIONS = [
+    "What is the first-line treatment for uncomplicated malaria?",
+    "How is severe malaria managed in children?",
+    "When should TLD be started in newly diagnosed HIV patients?",
+    "What is the dose of artemether-lumefantrine for adults?",
+    "How is drug-susceptible pulmonary TB treated?",
+    "What are the danger signs in a child with pneumonia?",
+    "How should hypertension be managed in pregnancy?",
+    "What is the recommended prophylaxis for PMTCT?",
+]
+
+WORDS = ("patient dose treatment malaria tuberculosis HIV regimen weeks daily tablet "
+         "children adults pregnancy artemether lumefantrine rifampicin isoniazid "
+         "dolutegravir monitoring referral severe clinic guideline").split()
+
+
+def _passage(rnd: random.Random, words: int = 140) -> str:
+    return " ".join(rnd.choice(WORDS) for _ in range(words))
+
+
+def _chunks(rnd: random.Random, count: int) -> List[Dict[str, Any]]:
+    return [
+        {"book": "edliz 2020", "start_page": p, "end_page": p, "text": _passage(rnd)}
+        for p in rnd.sample(range(1, 400), count)
+    ]
+
+
+def build_request(endpoint: str, rnd: random.Random, unique: bool) -> Dict[str, Any]:
+    """Return method/path/json/headers for one request to `endpoint`."""
+    question = rnd.choice(QUESTIONS)
+    if unique:
+        question += f" (#{rnd.randrange(10**9)})"
+    if endpoint == "embeddings":
+        return {"path": "/embeddings", "json": {"texts": [question]}}
+    if endpoint == "rag_answer":
+        return {"path": "/rag/answer", "json": {"question": question, "chunks": _chunks(rnd, 5)}}
+    if endpoint == "rag_stream":
+        return {"path": "/rag/answer/stream", "json": {"question": question, "chunks": _chunks(rnd, 5)}, "stream": True}
+    if endpoint == "rag_ask":
+        return {"path": "/rag/ask", "json": {"question": question, "top_k": 5}}
+    if endpoint == "train_book":
+        return {"path": "/train/book", "json": {"book_id": "load-test", "chunks": _chunks(rnd, 40)}}
+    raise ValueError(f"unknown endpoint {endpoint}")
+
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.ttft: Dict[str, List[float]] = {}
+        self.errors: Dict[str, Dict[str, int]] = {}
+
+    def ok(self, endpoint: str, seconds: float, ttft: Optional[float] = None) -> None:
+        self.latencies.setdefault(endpoint, []).append(seconds)
+        if ttft is not None:
+            self.ttft.setdefault(endpoint, []).append(ttft)
+
+    def error(self, endpoint: str, kind: str) -> None:
+        bucket = self.errors.setdefault(endpoint, {})
+        bucket[kind] = bucket.get(kind, 0) + 1
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        out = {}
+        for endpoint in sorted(set(self.latencies) | set(self.errors)):
+            lat = sorted(self.latencies.get(endpoint, []))
+            errors = self.errors.get(endpoint, {})
+            row = {
+                "ok": len(lat),
+                "errors": sum(errors.values()),
+                "error_kinds": errors,
+                "throughput_rps": round(len(lat) / elapsed, 2) if elapsed > 0 else None,
+            }
+            for pct in (50, 95, 99):
+                v = percentile(lat, pct)
+                row[f"p{pct}_ms"] = round(v * 1000, 1) if v is not None else None
+            ttft = sorted(self.ttft.get(endpoint, []))
+            if ttft:
+                for pct in (50, 95, 99):
+                    row[f"ttft_p{pct}_ms"] = round(percentile(ttft, pct) * 1000, 1)
+            out[endpoint] = row
+        return out
+
+
+async def one_request(client: httpx.AsyncClient, endpoint: str, spec: Dict[str, Any], token: str, rec: Recorder) -> None:
+    headers = {"Authorization": f"Bearer {token}"}
+    started = time.perf_counter()
+    try:
+        if spec.get("stream"):
+            ttft = None
+            async with client.stream("POST", spec["path"], json=spec["json"], headers=headers) as resp:
+                if resp.status_code != 200:
+                    await resp.aread()
+                    rec.error(endpoint, f"http_{resp.status_code}")
+                    return
+                failed = False
+                async for line in resp.aiter_lines():
+                    if ttft is None and line.startswith("event: token"):
+                        ttft = time.perf_counter() - started
+                    elif line.startswith("event: error"):
+                        failed = True
+                if failed:
+                    rec.error(endpoint, "stream_error")
+                    return
+            rec.ok(endpoint, time.perf_counter() - started, ttft)
+        else:
+            resp = await client.post(spec["path"], json=spec["json"], headers=headers)
+            if resp.status_code != 200:
+                rec.error(endpoint, f"http_{resp.status_code}")
+                return
+            rec.ok(endpoint, time.perf_counter() - started)
+    except httpx.TimeoutException:
+        rec.error(endpoint, "timeout")
+    except httpx.HTTPError as e:
+        rec.error(endpoint, type(e).__name__)
+
+
+async def run_load(client: httpx.AsyncClient, endpoints: List[str], concurrency: int, total: Optional[int],
+                   duration: Optional[float], unique: bool, seed: int) -> Dict[str, Any]:
+    rec = Recorder()
+    rnd = random.Random(seed)
+    counter = {"issued": 0}
+    deadline = time.perf_counter() + duration if duration else None
+
+    def next_job():
+        if total is not None and counter["issued"] >= total:
+            return None
+        if deadline is not None and time.perf_counter() >= deadline:
+            return None
+        n = counter["issued"]
+        counter["issued"] += 1
+        endpoint = endpoints[n % len(endpoints)]
+        return n, endpoint, build_request(endpoint, rnd, unique)
+
+    async def worker():
+        while True:
+            job = next_job()
+            if job is None:
+                return
+            n, endpoint, spec = job
+            # A distinct token per request keeps the per-user rate limit out of the measurement.
+            await one_request(client, endpoint, spec, f"load-{n}", rec)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        "requests": counter["issued"],
+        "elapsed_seconds": round(elapsed, 3),
+        "endpoints": rec.summary(elapsed),
+    }
+
+
+def in_process_client(timeout: float) -> httpx.AsyncClient:
+    """Client bound to the backend app, whose upstream is the in-process fake."""
+    os.environ.setdefault("OPENAI_API_KEY", "sk-fake-loadtest")
+    os.environ["OPENAI_BASE_URL"] = "http://fake-openai/v1"
+    try:
+        from . import main as backend_main
+        from .fake_openai import create_app
+    except ImportError:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import main as backend_main
+        from fake_openai import create_app
+    backend_main.OPENAI_POOL.transport = httpx.ASGITransport(app=create_app())
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=backend_main.app), base_url="http://backend", timeout=timeout)
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"\nconcurrency={report['concurrency']} requests={report['requests']} elapsed={report['elapsed_seconds']}s")
+    header = f"{'endpoint':<12} {'ok':>6} {'err':>5} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ttft p50':>9} {'ttft p95':>9}"
+    print(header)
+    print("-" * len(header))
+    for endpoint, row in report["endpoints"].items():
+        def fmt(v):
+            return "-" if v is None else f"{v}"
+        print(f"{endpoint:<12} {row['ok']:>6} {row['errors']:>5} {fmt(row['throughput_rps']):>8} "
+              f"{fmt(row['p50_ms']):>9} {fmt(row['p95_ms']):>9} {fmt(row['p99_ms']):>9} "
+              f"{fmt(row.get('ttft_p50_ms')):>9} {fmt(row.get('ttft_p95_ms')):>9}")
+        if row["error_kinds"]:
+            print(f"{'':<12} errors: {row['error_kinds']}")
+
+
+def main():
+    p = argparse.ArgumentParser(description="Load test the Tasha backend")
+    p.add_argument("--base-url", default="http://localhost:8000", help="Backend URL (ignored with --in-process)")
+    p.add_argument("--in-process", action="store_true", help="Run backend and fake upstream in-process (no server needed)")
+    p.add_argument("--endpoint", action="append", choices=ENDPOINTS, help="Endpoint to drive (repeatable). Default: embeddings, rag_answer")
+    p.add_argument("--concurrency", type=int, default=10, help="Concurrent in-flight requests")
+    p.add_argument("--requests", type=int, default=None, help="Total requests to send")
+    p.add_argument("--duration", type=float, default=None, help="Run for N seconds instead of a fixed count")
+    p.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds")
+    p.add_argument("--unique", action="store_true", help="Make every question unique (defeats caches)")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = p.parse_args()
+
+    endpoints = args.endpoint or ["embeddings", "rag_answer"]
+    total = args.requests if args.requests is not None or args.duration else 100
+
+    async def go():
+        if args.in_process:
+            client = in_process_client(args.timeout)
+        else:
+            limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+            client = httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits)
+        async with client:
+            return await run_load(client, endpoints, args.concurrency, total, args.duration, args.unique, args.seed)
+
+    report = asyncio.run(go())
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,21 +10,74 @@ except ImportError:
     pass  # python-dotenv not installed; rely on environment variables directly
 
 import os
+import time
+import random
+import asyncio
 import logging
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, AsyncIterator, Tuple
 from fastapi import FastAPI, Header, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response, FileResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import openai as openai_pkg
-from openai import OpenAI
-from datetime import datetime, timedelta
+from openai import AsyncOpenAI
+from datetime import datetime
 from functools import lru_cache
+from contextlib import asynccontextmanager, contextmanager
 import json
+import hashlib
+import numpy as np
+
+try:
+    from .vector_index import VectorIndex
+    from .lexical_index import LexicalIndex, reciprocal_rank_fusion
+    from .ann_index import AnnIndex
+    from .quantized_index import QuantizedIndex
+    from .openai_pool import OpenAIClientPool
+    from .streaming import AnswerStreamExtractor, sse_event
+    from .embedding_cache import EmbeddingCache, text_hash
+    from .answer_cache import AnswerCache, answer_scope
+    from .single_flight import SingleFlight, flight_key
+    from .embed_batcher import EmbedBatcher
+    from .context_packing import pack_chunks, budget_for_request
+    from .train_jobs import TrainJobStore, TrainJobRunner
+    from .metrics import Registry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+    from .structured_log import setup_logging, log_event, sampled, dropped_records
+    from .profiling import ProfileStore, ProfilingMiddleware, note_upstream
+    from .corpus_store import CorpusStore, load_index_chunks, section_chunk_ids
+    from .warmup import WarmUp
+    from .rate_limit import RateLimiter
+    from .embedding_codec import ENCODINGS, BINARY_MEDIA_TYPES, FastJSONResponse, encode_json, binary_response
+except ImportError:  # running as `uvicorn main:app` from inside backend/
+    from vector_index import VectorIndex
+    from lexical_index import LexicalIndex, reciprocal_rank_fusion
+    from ann_index import AnnIndex
+    from quantized_index import QuantizedIndex
+    from openai_pool import OpenAIClientPool
+    from streaming import AnswerStreamExtractor, sse_event
+    from embedding_cache import EmbeddingCache, text_hash
+    from answer_cache import AnswerCache, answer_scope
+    from single_flight import SingleFlight, flight_key
+    from embed_batcher import EmbedBatcher
+    from context_packing import pack_chunks, budget_for_request
+    from train_jobs import TrainJobStore, TrainJobRunner
+    from metrics import Registry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+    from structured_log import setup_logging, log_event, sampled, dropped_records
+    from profiling import ProfileStore, ProfilingMiddleware, note_upstream
+    from corpus_store import CorpusStore, load_index_chunks, section_chunk_ids
+    from warmup import WarmUp
+    from rate_limit import RateLimiter
+    from embedding_codec import ENCODINGS, BINARY_MEDIA_TYPES, FastJSONResponse, encode_json, binary_response
 
 # ============= Configuration =============
-logging.basicConfig(level=logging.INFO)
+# Log records go through a bounded queue to a writer thread, so console I/O
+# never blocks the event loop. LOG_FORMAT=json emits one JSON object per line.
+setup_logging(os.getenv("LOG_LEVEL", "INFO"), os.getenv("LOG_FORMAT", "text"),
+              queue_size=int(os.getenv("LOG_QUEUE_SIZE", "10000")))
 logger = logging.getLogger(__name__)
+# Share of /rag/answer requests whose question, chunk previews and answer preview are logged.
+LOG_PREVIEW_SAMPLE_RATE = float(os.getenv("LOG_PREVIEW_SAMPLE_RATE", "0.01"))
 
 DEFAULT_OPENAI_KEY = os.getenv("OPENAI_API_KEY", "").strip()
 if not DEFAULT_OPENAI_KEY:
@@ -32,22 +85,107 @@ if not DEFAULT_OPENAI_KEY:
 else:
     logger.info("✓ OPENAI_API_KEY found in environment (not logged for security).")
 
-def get_openai_client(api_key: Optional[str] = None) -> OpenAI:
-    """Return an OpenAI client using the provided API key or the environment key.
+# One pool per worker process, shared by all requests. Pool limits are read
+# from OPENAI_POOL_MAX_CLIENTS / OPENAI_MAX_CONNECTIONS / OPENAI_MAX_KEEPALIVE.
+OPENAI_POOL = OpenAIClientPool.from_env()
+
+def get_openai_client(api_key: Optional[str] = None) -> AsyncOpenAI:
+    """Return a pooled AsyncOpenAI client using the provided API key or the environment key.
     This reads `OPENAI_API_KEY` dynamically from os.environ so changes take effect
     after a process restart and avoid stale import-time values.
     """
-    key = api_key if api_key else os.getenv("OPENAI_API_KEY", "")
-    # Construct a client. If key is empty the client will still be created but
-    # calls may fail; callers should handle mock behavior before calling.
-    return OpenAI(api_key=key) if key else OpenAI()
+    # If key is empty the client will still be created but calls may fail;
+    # callers should handle mock behavior before calling.
+    return OPENAI_POOL.get(api_key)
 
-# Simple in-memory rate limiting (for production, use Redis)
-REQUEST_LIMITS = {}
+# Per-user rate limiting. RATE_LIMIT_BACKEND=sqlite shares the counters
+# between gunicorn workers through RATE_LIMIT_DB (default under /dev/shm).
 REQUESTS_PER_MINUTE = 60
 REQUESTS_PER_HOUR = 1000
+RATE_LIMITER = RateLimiter.from_env(REQUESTS_PER_MINUTE, REQUESTS_PER_HOUR)
+
+# /train/book fans batches out concurrently; retries cover 429s and timeouts.
+TRAIN_CONCURRENCY = int(os.getenv("TRAIN_CONCURRENCY", "4"))
+TRAIN_MAX_RETRIES = int(os.getenv("TRAIN_MAX_RETRIES", "3"))
+TRAIN_RETRY_BASE_DELAY = float(os.getenv("TRAIN_RETRY_BASE_DELAY", "1.0"))
+
+# Embedding cache keyed on (model, sha256(text)): memory LRU in front of SQLite.
+# Set EMBED_CACHE_DB to an empty string to keep the cache in memory only.
+EMBEDDING_CACHE = EmbeddingCache(
+    os.getenv("EMBED_CACHE_DB", "embedding_cache.db") or None,
+    max_memory_items=int(os.getenv("EMBED_CACHE_MEMORY_ITEMS", "4096")),
+)
+
+# Answer cache for /rag/answer, /rag/answer/stream and /rag/ask, keyed on the
+# caller, chunk set + prompt settings and matched on the exact question
+# (ANSWER_CACHE_SEMANTIC=1 also matches similar questions).
+# ANSWER_CACHE_ENABLED=0 turns it off; an empty ANSWER_CACHE_DB keeps it in memory.
+ANSWER_CACHE = AnswerCache(
+    os.getenv("ANSWER_CACHE_DB", "answer_cache.db") or None,
+    semantic=os.getenv("ANSWER_CACHE_SEMANTIC", "0") == "1",
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+    ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(7 * 86400))),
+    max_memory_items=int(os.getenv("ANSWER_CACHE_MEMORY_ITEMS", "2048")),
+) if os.getenv("ANSWER_CACHE_ENABLED", "1") != "0" else None
+ANSWER_CACHE_EMBED_MODEL = os.getenv("ANSWER_CACHE_EMBED_MODEL", "text-embedding-3-small")
+
+# Identical concurrent upstream calls (/embeddings misses, /rag/answer
+# completions) are coalesced into one per worker; see /internal/single_flight.
+SINGLE_FLIGHT = SingleFlight(max_tracked_keys=int(os.getenv("SINGLE_FLIGHT_TRACKED_KEYS", "1024")))
+
+# RAG prompts get deduplicated, MMR-selected excerpts up to a per-model token
+# budget (context_packing.MODEL_CONTEXT_BUDGETS; RAG_CONTEXT_TOKENS for other
+# models). RAG_CONTEXT_DIVERSITY weights the redundancy penalty; only the
+# RAG_CONTEXT_MAX_CANDIDATES most relevant chunks are scored.
+RAG_CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", "4000"))
+RAG_CONTEXT_DIVERSITY = float(os.getenv("RAG_CONTEXT_DIVERSITY", "0.3"))
+RAG_CONTEXT_MAX_CANDIDATES = int(os.getenv("RAG_CONTEXT_MAX_CANDIDATES", "64"))
 
-app = FastAPI(title="Tasha Backend", version="1.0.0")
+# Disable proxy buffering so SSE tokens reach the client as they are produced.
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+# Server-side vector index built from a `rag_vectors.db` file produced by the app
+# or by tools/index_txt_to_sqlite.py. Loaded lazily on the first /rag/query.
+RAG_VECTORS_DB = os.getenv("RAG_VECTORS_DB", "rag_vectors.db")
+VECTOR_INDEX = VectorIndex(RAG_VECTORS_DB)
+# Optional IVF index built by `python backend/ann_index.py` (ANN_INDEX_PATH,
+# default <RAG_VECTORS_DB>.ivf). Used instead of exact search while it matches
+# the database; tune with ANN_NPROBE and ANN_EXACT_THRESHOLD.
+ANN_INDEX = AnnIndex.from_env(RAG_VECTORS_DB)
+# Optional int8/float16 copy of the embeddings written by
+# `python backend/quantized_index.py`; scanned instead of the float64 vectors
+# (with the top QUANTIZED_RESCORE x k re-ranked at full precision) when there
+# is no usable ANN index.
+QUANTIZED_INDEX = QuantizedIndex.from_env(RAG_VECTORS_DB)
+# BM25 over the FTS5 table the indexer builds in the same file.
+LEXICAL_INDEX = LexicalIndex(RAG_VECTORS_DB)
+
+# Chunk texts synced by clients (POST /corpus/sync + /corpus/upload), so RAG
+# requests can send chunk_hashes instead of text.
+CORPUS_STORE = CorpusStore(os.getenv("CORPUS_DB", "corpus.db"))
+
+RETRIEVAL_MODES = ("vector", "bm25", "hybrid")
+# Each ranking contributes this many candidates per requested hit before fusion.
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "4"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Per-worker start-up and shutdown; runs after the fork under gunicorn --preload."""
+    # Also resumes jobs left behind by a worker that stopped mid-job.
+    TRAIN_JOBS.start()
+    # /ready turns 200 once the warm-up steps (see Start-up below) are done.
+    await WARM_UP.run()
+    try:
+        yield
+    finally:
+        # Release running jobs so another worker resumes them without waiting
+        # for the lease, finish the embedding batches in flight, then close the
+        # pooled upstream connections they used.
+        await TRAIN_JOBS.stop()
+        await EMBED_BATCHER.aclose()
+        await OPENAI_POOL.aclose()
+
+app = FastAPI(title="Tasha Backend", version="1.0.0", lifespan=lifespan)
 
 # Configure CORS. Set `ALLOWED_ORIGINS` env var to a comma-separated list
 # (e.g. https://example.com,http://10.0.2.2:8000) or leave empty to allow all.
@@ -65,6 +203,78 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ============= Metrics =============
+METRICS = Registry()
+HTTP_LATENCY = METRICS.histogram(
+    "tasha_http_request_duration_seconds", "Request latency until the response starts",
+    ("endpoint", "method", "status"),
+)
+UPSTREAM_LATENCY = METRICS.histogram(
+    "tasha_upstream_request_duration_seconds", "OpenAI call latency", ("operation", "model", "outcome"),
+)
+UPSTREAM_TOKENS = METRICS.counter("tasha_upstream_tokens_total", "Tokens reported by OpenAI", ("operation", "model", "kind"))
+CACHE_EVENTS = METRICS.counter("tasha_cache_events_total", "Cache lookups by result", ("cache", "result"))
+RATE_LIMIT_DECISIONS = METRICS.counter("tasha_rate_limit_decisions_total", "Rate limiter decisions", ("result",))
+METRICS.callback(
+    "tasha_single_flight_calls_total", "Upstream calls made vs. joined by coalesced waiters",
+    lambda: {(ep, kind): t[kind] for ep, t in SINGLE_FLIGHT.stats(top=0)["endpoints"].items() for kind in ("calls", "coalesced")},
+    ("endpoint", "kind"), kind="counter",
+)
+METRICS.callback(
+    "tasha_embed_batcher_total", "Embedding micro-batcher requests and upstream batches",
+    lambda: {(k,): v for k, v in EMBED_BATCHER.stats().items() if k in ("requests", "batches", "direct", "errors")},
+    ("kind",), kind="counter",
+)
+METRICS.callback("tasha_train_jobs_running", "Training jobs running in this worker", lambda: {(): TRAIN_JOBS.running()})
+METRICS.callback("tasha_log_records_dropped_total", "Log records dropped because the log queue was full",
+                 lambda: {(): dropped_records()}, kind="counter")
+
+@contextmanager
+def upstream_timer(operation: str, model: str):
+    """Time an OpenAI call for the latency histogram and, if profiled, the request's profile."""
+    started = time.perf_counter()
+    try:
+        with UPSTREAM_LATENCY.time(operation=operation, model=model) as labels:
+            yield labels
+    finally:
+        note_upstream(time.perf_counter() - started)
+
+def record_usage(operation: str, model: str, usage: Any) -> None:
+    """Add the prompt/completion token counts of an OpenAI response to the metrics."""
+    if usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = usage.get(kind) if isinstance(usage, dict) else getattr(usage, kind, None)
+        if value:
+            UPSTREAM_TOKENS.inc(value, operation=operation, model=model, kind=kind.split("_")[0])
+
+# Opt-in profiling: requests with `X-Profile: $PROFILE_TOKEN`, or a
+# PROFILE_SAMPLE_RATE share of all requests, are profiled into PROFILE_DIR
+# (newest PROFILE_MAX kept) and served by /internal/profiles.
+PROFILE_STORE = ProfileStore(os.getenv("PROFILE_DIR", "profiles"), max_profiles=int(os.getenv("PROFILE_MAX", "50")))
+app.add_middleware(
+    ProfilingMiddleware,
+    store=PROFILE_STORE,
+    token=os.getenv("PROFILE_TOKEN", ""),
+    sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0")),
+)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # The route template keeps ids (e.g. /train/jobs/{job_id}) out of the labels.
+        route = request.scope.get("route")
+        HTTP_LATENCY.observe(
+            time.perf_counter() - started,
+            endpoint=getattr(route, "path", "unmatched"), method=request.method, status=str(status),
+        )
+
 # ============= Request/Response Models =============
 class ChunkRequest(BaseModel):
     chunk: str
@@ -76,15 +286,55 @@ class ChunkRequest(BaseModel):
 class EmbedRequest(BaseModel):
     texts: List[str]
     model: str = "text-embedding-3-small"
+    encoding: str = "float"  # float | float64 | float32 | float16 | int8 (see embedding_codec)
 
 class BatchRAGRequest(BaseModel):
     question: str
-    chunks: List[Dict[str, Any]]  # list of {text, book, start_page, end_page, ...}
+    chunks: List[Dict[str, Any]] = []  # list of {text, book, start_page, end_page, ...}
+    chunk_hashes: Optional[List[str]] = None  # sha256 of chunk texts synced to the corpus store
+    chunk_ids: Optional[List[int]] = None  # ids in the server-side vector database
     system_prompt: Optional[str] = None
     model: str = "gpt-4o-mini"
     temperature: float = 0.0
     max_tokens: int = 600
     api_key: Optional[str] = None  # Allow app to pass real API key from Settings
+    cache: bool = True  # set False to bypass the semantic answer cache
+    pack_context: bool = True  # set False to send every chunk as supplied
+    context_tokens: Optional[int] = None  # excerpt token budget (default: per model)
+
+class RagQueryRequest(BaseModel):
+    question: Optional[str] = None
+    questions: Optional[List[str]] = None  # batch of questions scored in one call
+    embedding: Optional[List[float]] = None  # skip embedding if the client already has one
+    books: Optional[List[str]] = None
+    sections: Optional[List[str]] = None  # TOC chapter/section prefixes, e.g. ["13. Malaria"]
+    top_k: int = 5
+    retrieval: str = "vector"  # vector | bm25 | hybrid (BM25 + vector, rank-fused)
+    embedding_model: str = "text-embedding-3-small"
+    api_key: Optional[str] = None
+
+class RagAskRequest(BaseModel):
+    question: str
+    books: Optional[List[str]] = None
+    sections: Optional[List[str]] = None
+    top_k: int = 5
+    retrieval: str = "vector"  # vector | bm25 | hybrid
+    embedding_model: str = "text-embedding-3-small"
+    system_prompt: Optional[str] = None
+    model: str = "gpt-4o-mini"
+    temperature: float = 0.0
+    max_tokens: int = 600
+    api_key: Optional[str] = None
+    cache: bool = True
+    context_tokens: Optional[int] = None
+
+class CorpusSyncRequest(BaseModel):
+    book: str
+    chunks: List[Dict[str, Any]]  # list of {hash, start_page, end_page}, in book order
+    replace: bool = False  # drop hashes of this book that are not listed
+
+class CorpusUploadRequest(BaseModel):
+    chunks: List[Dict[str, Any]]  # list of {text, hash?}; hash is verified when given
 
 class TrainBookRequest(BaseModel):
     book_id: str
@@ -92,6 +342,11 @@ class TrainBookRequest(BaseModel):
     model: str = "gpt-4o-mini"
     temperature: float = 0.0
     max_tokens: int = 800
+    concurrency: Optional[int] = None  # capped at TRAIN_CONCURRENCY
+    api_key: Optional[str] = None
+
+class TrainJobRetryRequest(BaseModel):
+    api_key: Optional[str] = None  # needed again if the job was submitted with one
 
 # ============= Auth & Rate Limiting =============
 def verify_auth(authorization: Optional[str]) -> str:
@@ -105,27 +360,106 @@ def verify_auth(authorization: Optional[str]) -> str:
         raise HTTPException(status_code=401, detail="Invalid token")
     return token
 
-def check_rate_limit(user_id: str) -> bool:
-    """Simple rate limiting. Replace with Redis for production."""
-    now = datetime.now()
-    minute_ago = now - timedelta(minutes=1)
-    hour_ago = now - timedelta(hours=1)
-    
-    if user_id not in REQUEST_LIMITS:
-        REQUEST_LIMITS[user_id] = []
-    
-    # Clean old requests
-    REQUEST_LIMITS[user_id] = [ts for ts in REQUEST_LIMITS[user_id] if ts > hour_ago]
-    
-    # Check limits
-    recent_minute = [ts for ts in REQUEST_LIMITS[user_id] if ts > minute_ago]
-    if len(recent_minute) >= REQUESTS_PER_MINUTE:
-        return False
-    if len(REQUEST_LIMITS[user_id]) >= REQUESTS_PER_HOUR:
-        return False
-    
-    REQUEST_LIMITS[user_id].append(now)
-    return True
+async def check_rate_limit(user_id: str) -> bool:
+    """Sliding-window rate limiting (60/minute and 1000/hour per user).
+
+    The shared SQLite store can wait on other workers' locks, so it is checked
+    in the threadpool rather than stalling every request on this worker.
+    """
+    if RATE_LIMITER.blocking:
+        allowed = await run_in_threadpool(RATE_LIMITER.allow, user_id)
+    else:
+        allowed = RATE_LIMITER.allow(user_id)
+    RATE_LIMIT_DECISIONS.inc(result="allowed" if allowed else "rejected")
+    return allowed
+
+def _mock_embeddings(texts: List[str]) -> List[List[float]]:
+    """Deterministic unit vectors seeded from each text (no upstream call)."""
+    import random
+    embeddings = []
+    DIM = 1536
+    for t in texts:
+        # Deterministic seed from text
+        h = hashlib.sha256(t.encode('utf-8')).hexdigest()
+        seed = int(h[:16], 16)
+        rnd = random.Random(seed)
+        vec = [rnd.uniform(-1.0, 1.0) for _ in range(DIM)]
+        # Normalize to unit vector
+        norm = sum(x * x for x in vec) ** 0.5 or 1.0
+        vec = [float(x / norm) for x in vec]
+        embeddings.append(vec)
+    return embeddings
+
+async def _embed_upstream(texts: List[str], model: str, api_key: Optional[str]) -> List[List[float]]:
+    """One upstream embeddings call for `texts`, in order."""
+    # Build client using the passed key if present, otherwise let get_openai_client
+    # fall back to using the environment key.
+    client = get_openai_client(api_key or None)
+    with upstream_timer(operation="embeddings", model=model):
+        response = await client.embeddings.create(
+            model=model,
+            input=texts,
+            timeout=30,
+        )
+    record_usage("embeddings", model, getattr(response, "usage", None))
+    return [item.embedding for item in response.data]
+
+# Cache misses from concurrent requests are merged into shared upstream calls:
+# a batch goes out EMBED_BATCH_WINDOW_MS after its first request (0 = off) or
+# when EMBED_BATCH_MAX_TEXTS / EMBED_BATCH_MAX_TOKENS would be exceeded.
+EMBED_BATCHER = EmbedBatcher(
+    _embed_upstream,
+    window_ms=float(os.getenv("EMBED_BATCH_WINDOW_MS", "5")),
+    max_texts=int(os.getenv("EMBED_BATCH_MAX_TEXTS", "256")),
+    max_tokens=int(os.getenv("EMBED_BATCH_MAX_TOKENS", "100000")),
+)
+
+async def embed_texts(texts: List[str], model: str, api_key: Optional[str] = None) -> Tuple[np.ndarray, Dict[str, int]]:
+    """Embed `texts` with OpenAI, or return deterministic mock vectors when no
+    real key is available (missing key or a known test key).
+
+    Duplicate texts are embedded once and cached vectors are reused; only cache
+    misses go upstream, in a single call. Returns a float32 (len(texts), dim)
+    matrix in input order and the cache hit/miss counts.
+    """
+    # Prefer API key passed in the request; otherwise use the runtime env var.
+    # Trim whitespace to avoid false negatives from accidental spaces.
+    client_key = (api_key or os.getenv("OPENAI_API_KEY", "")).strip()
+
+    hashes = [text_hash(t) for t in texts]
+    unique: Dict[str, str] = {}
+    for h, t in zip(hashes, texts):
+        unique.setdefault(h, t)
+    stats = {"hits": 0, "misses": 0, "duplicates": len(texts) - len(unique), "coalesced": 0}
+
+    # If OPENAI key is missing or it's a known test key, return deterministic mock embeddings.
+    # Mock vectors are never cached so they cannot leak into real lookups.
+    if not client_key or client_key.startswith("sk-test") or client_key.startswith("sk-proj-test"):
+        logger.info("[embeddings] Using MOCK embeddings because OPENAI API key not set or is test key")
+        vectors = dict(zip(unique.keys(), np.asarray(_mock_embeddings(list(unique.values())), dtype=np.float32)))
+        stats["misses"] = len(unique)
+        return np.stack([vectors[h] for h in hashes]), stats
+
+    cached = await run_in_threadpool(EMBEDDING_CACHE.get_many, model, list(unique.keys()))
+    vectors: Dict[str, np.ndarray] = dict(cached)
+    miss_hashes = [h for h in unique if h not in vectors]
+    stats["hits"] = len(cached)
+    stats["misses"] = len(miss_hashes)
+    CACHE_EVENTS.inc(stats["hits"], cache="embedding", result="hit")
+    CACHE_EVENTS.inc(stats["misses"], cache="embedding", result="miss")
+
+    if miss_hashes:
+        miss_texts = [unique[h] for h in miss_hashes]
+        flight = flight_key("embeddings", model=model, key=text_hash(client_key), texts=miss_hashes)
+        fresh, shared = await SINGLE_FLIGHT.do(flight, lambda: EMBED_BATCHER.embed(miss_texts, model, api_key))
+        fresh = np.asarray(fresh, dtype=np.float32)
+        stats["coalesced"] = int(shared)
+        fresh_by_hash = dict(zip(miss_hashes, fresh))
+        vectors.update(fresh_by_hash)
+        if not shared:  # the leader of a coalesced call stores the vectors once
+            await run_in_threadpool(EMBEDDING_CACHE.put_many, model, fresh_by_hash)
+
+    return np.stack([vectors[h] for h in hashes]), stats
 
 # ============= Endpoints =============
 
@@ -134,12 +468,21 @@ async def health_check():
     """Health check endpoint."""
     return {"status": "ok", "timestamp": datetime.now().isoformat()}
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 503 until this worker has finished warming up."""
+    status = WARM_UP.status()
+    return JSONResponse(
+        status_code=200 if status["ready"] else 503,
+        content={"status": "ready" if status["ready"] else "warming", **status},
+    )
+
 @app.post("/process_chunk")
 async def process_chunk(req: ChunkRequest, authorization: str = Header(None)):
     """Process a single chunk with OpenAI."""
     user_id = verify_auth(authorization)
     
-    if not check_rate_limit(user_id):
+    if not await check_rate_limit(user_id):
         raise HTTPException(status_code=429, detail="Rate limit exceeded")
     
     if not req.chunk or len(req.chunk.strip()) == 0:
@@ -153,16 +496,18 @@ async def process_chunk(req: ChunkRequest, authorization: str = Header(None)):
         # Build OpenAI client (may use api_key passed in request via req.api_key)
         client = get_openai_client(getattr(req, "api_key", None))
 
-        response = client.chat.completions.create(
-            model=req.model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": req.chunk}
-            ],
-            temperature=req.temperature,
-            max_tokens=req.max_tokens,
-            timeout=30,
-        )
+        with upstream_timer(operation="process_chunk", model=req.model):
+            response = await client.chat.completions.create(
+                model=req.model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": req.chunk}
+                ],
+                temperature=req.temperature,
+                max_tokens=req.max_tokens,
+                timeout=30,
+            )
+        record_usage("process_chunk", req.model, getattr(response, "usage", None))
 
         # Response shape follows the Chat Completions format
         answer = response.choices[0].message["content"] if hasattr(response, "choices") else str(response)
@@ -185,152 +530,339 @@ async def process_chunk(req: ChunkRequest, authorization: str = Header(None)):
         raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
 
 @app.post("/embeddings")
-async def get_embeddings(req: EmbedRequest, authorization: str = Header(None)):
-    """Get embeddings for a list of texts."""
+async def get_embeddings(req: EmbedRequest, authorization: str = Header(None), accept: Optional[str] = Header(None)):
+    """Get embeddings for a list of texts.
+    `encoding` selects float lists (default) or base64 float64/float32/float16/int8
+    vectors; `Accept: application/octet-stream` or `application/x-npy` returns the
+    whole batch as one binary buffer instead of JSON.
+    """
     user_id = verify_auth(authorization)
     
-    if not check_rate_limit(user_id):
+    if not await check_rate_limit(user_id):
         raise HTTPException(status_code=429, detail="Rate limit exceeded")
     
     if not req.texts or len(req.texts) == 0:
         raise HTTPException(status_code=400, detail="No texts provided")
+
+    if req.encoding not in ENCODINGS:
+        raise HTTPException(status_code=400, detail=f"encoding must be one of {', '.join(ENCODINGS)}")
     
     try:
         logger.info(f"[embeddings] user={user_id} count={len(req.texts)}")
 
-        # Prefer API key passed in the request; otherwise use the runtime env var.
-        # Trim whitespace to avoid false negatives from accidental spaces.
-        passed_key = getattr(req, "api_key", None)
-        client_key = (passed_key or os.getenv("OPENAI_API_KEY", "")).strip()
-        # Build client using the passed key if present, otherwise let get_openai_client
-        # fall back to using the environment key.
-        client = get_openai_client(passed_key or None)
-
-        # If OPENAI key is missing or it's a known test key, return deterministic mock embeddings
-        if not client_key or client_key.startswith("sk-test") or client_key.startswith("sk-proj-test"):
-            import hashlib, random
-            logger.info("[embeddings] Using MOCK embeddings because OPENAI API key not set or is test key")
-            embeddings = []
-            DIM = 1536
-            for t in req.texts:
-                # Deterministic seed from text
-                h = hashlib.sha256(t.encode('utf-8')).hexdigest()
-                seed = int(h[:16], 16)
-                rnd = random.Random(seed)
-                vec = [rnd.uniform(-1.0, 1.0) for _ in range(DIM)]
-                # Normalize to unit vector
-                norm = sum(x * x for x in vec) ** 0.5 or 1.0
-                vec = [float(x / norm) for x in vec]
-                embeddings.append(vec)
-        else:
-            response = client.embeddings.create(
-                model=req.model,
-                input=req.texts,
-                timeout=30,
-            )
-            embeddings = [item.embedding for item in response.data]
-        logger.info(f"[embeddings] success user={user_id} count={len(embeddings)}")
+        embeddings, cache_stats = await embed_texts(req.texts, req.model, getattr(req, "api_key", None))
+        logger.info(f"[embeddings] success user={user_id} count={len(embeddings)} cache_hits={cache_stats['hits']} cache_misses={cache_stats['misses']}")
         
-        return {
+        binary_type = next((t for t in BINARY_MEDIA_TYPES if accept and t in accept), None)
+        if binary_type:
+            cache_headers = {"X-Cache-Hits": str(cache_stats["hits"]), "X-Cache-Misses": str(cache_stats["misses"])}
+            return binary_response(embeddings, req.encoding, binary_type, cache_headers)
+
+        return FastJSONResponse({
             "success": True,
-            "embeddings": embeddings,
+            **encode_json(embeddings, req.encoding),
             "model": req.model,
-            "count": len(embeddings)
-        }
+            "count": len(embeddings),
+            "cache": cache_stats,
+        })
     except Exception as e:
         logger.exception(f"[embeddings] error user={user_id} {str(e)}")
         raise HTTPException(status_code=500, detail=f"Embedding failed: {str(e)}")
 
 @app.post("/rag/answer")
-async def rag_answer(req: BatchRAGRequest, authorization: str = Header(None)):
-    """RAG: Answer a question using provided chunks."""
+async def rag_answer(req: BatchRAGRequest, authorization: str = Header(None), accept: Optional[str] = Header(None)):
+    """RAG: Answer a question using provided chunks.
+    Send `Accept: text/event-stream` to get the streaming variant.
+    """
     user_id = verify_auth(authorization)
     
-    if not check_rate_limit(user_id):
+    if not await check_rate_limit(user_id):
         raise HTTPException(status_code=429, detail="Rate limit exceeded")
+    req = await resolve_chunk_refs(req)
+    if accept and "text/event-stream" in accept:
+        return StreamingResponse(stream_rag_answer(req, user_id), media_type="text/event-stream", headers=SSE_HEADERS)
+    return await answer_with_chunks(req, user_id)
+
+@app.post("/rag/answer/stream")
+async def rag_answer_stream(req: BatchRAGRequest, authorization: str = Header(None)):
+    """RAG answer streamed as Server-Sent Events.
+    Emits `token` events with answer text as it is generated, then one `done`
+    event with the parsed answer, citations, confidence and usage (or `error`).
+    """
+    user_id = verify_auth(authorization)
+
+    if not await check_rate_limit(user_id):
+        raise HTTPException(status_code=429, detail="Rate limit exceeded")
+    req = await resolve_chunk_refs(req)
+    return StreamingResponse(stream_rag_answer(req, user_id), media_type="text/event-stream", headers=SSE_HEADERS)
+
+async def resolve_chunk_refs(req: BatchRAGRequest) -> BatchRAGRequest:
+    """Replace `chunk_hashes` / `chunk_ids` with the chunks they name (after any
+    inline `chunks`). Unknown references are a 409 listing them, so the client
+    can upload the missing texts and retry.
+    """
+    if not req.chunk_hashes and not req.chunk_ids:
+        return req
+    chunks = list(req.chunks)
+    if req.chunk_hashes:
+        books = [c.get("book") for c in req.chunks if c.get("book")]
+        found, missing = await run_in_threadpool(CORPUS_STORE.resolve, req.chunk_hashes, books)
+        if missing:
+            raise HTTPException(status_code=409, detail={"message": "Unknown chunk hashes", "missing_hashes": missing})
+        chunks.extend(found)
+    if req.chunk_ids:
+        try:
+            found, missing = await run_in_threadpool(load_index_chunks, RAG_VECTORS_DB, req.chunk_ids)
+        except FileNotFoundError:
+            raise HTTPException(status_code=503, detail="Vector index not available on this server")
+        if missing:
+            raise HTTPException(status_code=409, detail={"message": "Unknown chunk ids", "missing_ids": missing})
+        chunks.extend(found)
+    return req.model_copy(update={"chunks": chunks, "chunk_hashes": None, "chunk_ids": None})
+
+@app.post("/corpus/sync")
+async def corpus_sync(req: CorpusSyncRequest, authorization: str = Header(None)):
+    """Delta sync, step 1: register a book's chunk hashes and get back the ones
+    whose text the server lacks. Only those need to go to /corpus/upload.
+    """
+    user_id = verify_auth(authorization)
+
+    if not await check_rate_limit(user_id):
+        raise HTTPException(status_code=429, detail="Rate limit exceeded")
+    if not req.book or any(not isinstance(c.get("hash"), str) or len(c["hash"]) != 64 for c in req.chunks):
+        raise HTTPException(status_code=400, detail="book and a 64-char sha256 hex `hash` per chunk required")
+
+    missing = await run_in_threadpool(CORPUS_STORE.sync_book, req.book, req.chunks, req.replace)
+    logger.info(f"[corpus_sync] user={user_id} book={req.book} chunks={len(req.chunks)} missing={len(missing)}")
+    return {"success": True, "book": req.book, "count": len(req.chunks), "missing": missing}
+
+@app.post("/corpus/upload")
+async def corpus_upload(req: CorpusUploadRequest, authorization: str = Header(None)):
+    """Delta sync, step 2: upload the texts /corpus/sync reported missing."""
+    user_id = verify_auth(authorization)
+
+    if not await check_rate_limit(user_id):
+        raise HTTPException(status_code=429, detail="Rate limit exceeded")
+    if not req.chunks or any(not isinstance(c.get("text"), str) for c in req.chunks):
+        raise HTTPException(status_code=400, detail="chunks with `text` required")
+
+    stored, mismatched = await run_in_threadpool(
+        CORPUS_STORE.upload, [(c.get("hash"), c["text"]) for c in req.chunks]
+    )
+    logger.info(f"[corpus_upload] user={user_id} chunks={len(req.chunks)} stored={stored} mismatched={len(mismatched)}")
+    return {"success": True, "stored": stored, "mismatched": mismatched}
+
+def mock_rag_answer(req: BatchRAGRequest) -> Dict[str, Any]:
+    """Deterministic answer used when no API key is available (for testing)."""
+    logger.warning("[rag_answer] No API key provided, using MOCK response for testing")
+    mock_answer = (
+        f"Based on the provided excerpts about {req.chunks[0].get('book', 'the book') if req.chunks else 'medical guidelines'}, "
+        "here is relevant information: The provided medical guidelines contain important information. "
+        "This is a mock response because no valid API key is available. Please provide a real OpenAI API key in your app Settings or set OPENAI_API_KEY environment variable."
+    )
+    return {
+        "success": True,
+        "answer": mock_answer,
+        "citations": [{"text": chunk.get("text", "")[:200], "book": chunk.get("book", "Unknown")} for chunk in req.chunks[:3]],
+        "confidence": 0.5,
+    }
+
+def build_rag_messages(req: BatchRAGRequest, user_id: str) -> List[Dict[str, str]]:
+    """Build the system/user messages for a RAG request from its chunks."""
+    total_chunk_chars = 0
+    for chunk in req.chunks:
+        text = chunk.get("text", "")
+        total_chunk_chars += len(text) if text else 0
+    
+    log_event(logger, "[rag_answer] received", user=user_id, question_len=len(req.question),
+              chunks=len(req.chunks), chars=total_chunk_chars)
+    # Question and chunk previews only for a sample of requests.
+    if sampled(LOG_PREVIEW_SAMPLE_RATE):
+        log_event(logger, "[rag_answer] sample", user=user_id, question=req.question, chunks=[
+            {
+                "book": chunk.get("book", "Unknown"),
+                "page": chunk.get("start_page", "?"),
+                "len": len(chunk.get("text", "") or ""),
+                "preview": (chunk.get("text", "") or "")[:100],
+            }
+            for chunk in req.chunks
+        ])
+    
+    # Build prompt
+    system_prompt = req.system_prompt or (
+        "You are a helpful medical assistant. Your task is to ALWAYS provide a comprehensive answer based on the provided excerpts. "
+        "NEVER say 'I cannot find', 'I don't have access to', 'information is not available', or 'I cannot provide'. "
+        "Instead, ALWAYS synthesize and use what IS available in the excerpts to answer the question comprehensively. "
+        "If excerpts are provided, you MUST draw from them. Provide detailed, thorough answers (3-8 sentences or more). "
+        "Include key medical points, recommendations, treatments, or relevant information from the excerpts. "
+        "Even if excerpts don't perfectly match, use related medical information to provide helpful context. "
+        "ALWAYS respond with an answer — never refuse or say information is unavailable."
+    )
+    
+    # Format chunks
+    if req.chunks and len(req.chunks) > 0:
+        parts = ["Excerpts:\n\n"]
+        for i, chunk in enumerate(req.chunks):
+            book = chunk.get("book", "Unknown")
+            start_page = chunk.get("start_page", "?")
+            end_page = chunk.get("end_page", start_page)
+            text = chunk.get("text", "")
+            if text:
+                parts.append(f"[{i+1}] Book: {book} Pages: {start_page}-{end_page}\n{text}\n\n---\n\n")
+        excerpt_text = "".join(parts)
+    else:
+        excerpt_text = "[NO_EXCERPTS] Provide a general helpful answer using medical knowledge."
+    
+    user_message = f"{excerpt_text}\n\nQuestion: {req.question}\n\nProvide a helpful, detailed answer. Return a JSON object with 'answer' (string), 'citations' (array), 'confidence' (0-1 float)."
+    
+    log_event(logger, "[rag_answer] prompt", logging.DEBUG, model=req.model, max_tokens=req.max_tokens,
+              system_prompt_chars=len(system_prompt), user_message_chars=len(user_message))
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_message}
+    ]
+
+def parse_rag_answer(answer_text: str, user_id: str, chunk_count: int) -> Dict[str, Any]:
+    """Parse the model's reply into answer/citations/confidence."""
+    if sampled(LOG_PREVIEW_SAMPLE_RATE):
+        log_event(logger, "[rag_answer] answer sample", user=user_id, answer_len=len(answer_text),
+                  preview=answer_text[:200].replace("\n", " "))
+    
+    # Try to parse JSON response
+    parsed = {"answer": answer_text, "citations": [], "confidence": 0.5}
+    try:
+        start_idx = answer_text.find("{")
+        end_idx = answer_text.rfind("}")
+        if start_idx >= 0 and end_idx > start_idx:
+            json_str = answer_text[start_idx:end_idx+1]
+            parsed = json.loads(json_str)
+    except:
+        pass
+    
+    # Verify answer is not a generic "I don't know" response and log accordingly
+    answer_lower = (parsed.get("answer", "") or "").lower()
+    if any(phrase in answer_lower for phrase in ["don't have access", "cannot provide", "no relevant", "unable to answer", "not available"]):
+        logger.warning(f"[rag_answer] Generic/refusal response detected; user={user_id} chunks={chunk_count}")
+    
+    logger.info(f"[rag_answer] success user={user_id} answer_len={len(answer_text)}")
+    return {
+        "answer": parsed.get("answer", answer_text),
+        "citations": parsed.get("citations", []),
+        "confidence": parsed.get("confidence", 0.5),
+    }
+
+async def lookup_answer_cache(req: BatchRAGRequest, user_id: str,
+                              question_vector: Optional[np.ndarray] = None) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """Look `req` up in the answer cache.
+    Returns (cached response or None, cache key to store a fresh answer under).
+    Answers are scoped to the caller's API key, or to the user on the server's
+    key. An exact question match is tried first; the question is only embedded
+    when the cache also matches similar questions.
+    """
+    if ANSWER_CACHE is None or not req.cache:
+        return None, None
+    caller = f"key:{text_hash(req.api_key)}" if req.api_key else f"user:{user_id}"
+    key = {
+        "scope": answer_scope(req.model, req.system_prompt, req.temperature, req.max_tokens, req.chunks, caller),
+        "question_hash": text_hash(" ".join(req.question.lower().split())),
+        "vector": question_vector,
+    }
+    found = await run_in_threadpool(ANSWER_CACHE.lookup, key["scope"], key["question_hash"])
+    if found is None and ANSWER_CACHE.semantic and key["vector"] is None:
+        try:
+            vectors, _ = await embed_texts([req.question], ANSWER_CACHE_EMBED_MODEL, req.api_key)
+            key["vector"] = vectors[0]
+        except Exception as e:
+            # Without a vector only exact matches can hit; the answer itself still goes ahead.
+            logger.warning(f"[answer_cache] question embedding failed user={user_id} {str(e)}")
+    if found is None and ANSWER_CACHE.semantic and key["vector"] is not None:
+        found = await run_in_threadpool(ANSWER_CACHE.lookup, key["scope"], key["question_hash"], key["vector"])
+    if found is None:
+        CACHE_EVENTS.inc(cache="answer", result="miss")
+        return None, key
+    CACHE_EVENTS.inc(cache="answer", result="hit")
+    payload, similarity = found
+    logger.info(f"[rag_answer] cache hit user={user_id} similarity={similarity:.4f}")
+    return {"success": True, **payload, "usage": {}, "cache": {"hit": True, "similarity": round(similarity, 4)}}, key
+
+async def store_answer_cache(key: Optional[Dict[str, Any]], result: Dict[str, Any]) -> None:
+    """Remember a fresh answer under the key returned by `lookup_answer_cache`."""
+    if key is None or not result.get("answer"):
+        return
+    payload = {k: result.get(k) for k in ("answer", "citations", "confidence", "model")}
+    await run_in_threadpool(ANSWER_CACHE.put, key["scope"], key["question_hash"], key["vector"], payload)
+
+async def pack_rag_request(req: BatchRAGRequest, user_id: str) -> Tuple[BatchRAGRequest, Optional[Dict[str, Any]]]:
+    """Copy of `req` whose chunks fit its token budget, plus the packing stats.
+    Packing is pure-Python pairwise scoring, so it runs in the threadpool."""
+    if not req.pack_context or not req.chunks:
+        return req, None
+    budget = budget_for_request(req.model, req.context_tokens, RAG_CONTEXT_TOKENS)
+    packed, stats = await run_in_threadpool(
+        pack_chunks, req.question, req.chunks, budget,
+        diversity=RAG_CONTEXT_DIVERSITY, max_candidates=RAG_CONTEXT_MAX_CANDIDATES,
+    )
+    logger.info(
+        f"[rag_answer] packed user={user_id} chunks={stats['packed_chunks']}/{stats['supplied_chunks']} "
+        f"tokens={stats['packed_tokens']}/{stats['supplied_tokens']} budget={budget}"
+    )
+    return req.model_copy(update={"chunks": packed}), stats
+
+async def answer_with_chunks(req: BatchRAGRequest, user_id: str,
+                             question_vector: Optional[np.ndarray] = None) -> Dict[str, Any]:
+    """Build the RAG prompt from `req.chunks`, call the model and parse its JSON reply.
+    Shared by /rag/answer (client-supplied chunks) and /rag/ask (server-retrieved chunks).
+    Chunks are packed to the token budget first and the response reports the
+    packing under `context`. Answers are served from and stored in the answer
+    cache; pass `question_vector` when the question is already embedded.
+    """
+    req, packing = await pack_rag_request(req, user_id)
+    result = await answer_packed(req, user_id, question_vector)
+    if packing is not None:
+        result["context"] = packing
+    return result
+
+async def answer_packed(req: BatchRAGRequest, user_id: str,
+                        question_vector: Optional[np.ndarray] = None) -> Dict[str, Any]:
+    """Answer from mock, cache or a (coalesced) completion; always a fresh dict."""
     # Use API key from request if provided; otherwise fall back to runtime env var.
     passed_key = req.api_key if getattr(req, "api_key", None) else None
     client_key = (passed_key or os.getenv("OPENAI_API_KEY", "")).strip()
-    client = get_openai_client(passed_key or None)
 
     # If no key available, return a deterministic MOCK response for testing
     if not client_key:
-        print(f'[RAG_ANSWER] ⚠️  No API key provided, using MOCK response for testing')
-        mock_answer = (
-            f"Based on the provided excerpts about {req.chunks[0].get('book', 'the book') if req.chunks else 'medical guidelines'}, "
-            "here is relevant information: The provided medical guidelines contain important information. "
-            "This is a mock response because no valid API key is available. Please provide a real OpenAI API key in your app Settings or set OPENAI_API_KEY environment variable."
-        )
-        return {
-            "success": True,
-            "answer": mock_answer,
-            "citations": [{"text": chunk.get("text", "")[:200], "book": chunk.get("book", "Unknown")} for chunk in req.chunks[:3]],
-            "confidence": 0.5,
-        }
-    
+        return mock_rag_answer(req)
+
+    cached, cache_key = await lookup_answer_cache(req, user_id, question_vector)
+    if cached is not None:
+        return cached
+
+    # Byte-identical concurrent requests share one completion.
+    flight = flight_key(
+        "rag_answer", key=text_hash(client_key), question=req.question, chunks=req.chunks,
+        system_prompt=req.system_prompt, model=req.model, temperature=req.temperature, max_tokens=req.max_tokens,
+    )
+    result, shared = await SINGLE_FLIGHT.do(flight, lambda: complete_rag_answer(req, user_id, passed_key, cache_key))
+    if shared:
+        logger.info(f"[rag_answer] coalesced with an in-flight request user={user_id}")
+    # Waiters share one result object; callers such as /rag/ask add keys to theirs.
+    return dict(result)
+
+async def complete_rag_answer(req: BatchRAGRequest, user_id: str, passed_key: Optional[str],
+                              cache_key: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """One upstream completion for `req`, parsed and stored in the answer cache."""
     try:
-        total_chunk_chars = 0
-        for chunk in req.chunks:
-            text = chunk.get("text", "")
-            total_chunk_chars += len(text) if text else 0
-        
-        # ✅ LOG CHUNKS RECEIVED FROM FRONTEND
-        print(f'[RAG_ANSWER] 📥 RECEIVED FROM FRONTEND:')
-        print(f'  Question: "{req.question}"')
-        print(f'  Chunk count: {len(req.chunks)}')
-        print(f'  Total chars: {total_chunk_chars}')
-        for i, chunk in enumerate(req.chunks):
-            book = chunk.get("book", "Unknown")
-            start_page = chunk.get("start_page", "?")
-            text = chunk.get("text", "")
-            preview = text[:100] + '...' if len(text) > 100 else text
-            print(f'  📦 Chunk[{i}] book="{book}" page={start_page} len={len(text)} preview="{preview}"')
-        logger.info(f"[rag_answer] user={user_id} question_len={len(req.question)} chunks={len(req.chunks)} chars={total_chunk_chars}")
-        
+        messages = build_rag_messages(req, user_id)
         client = get_openai_client(passed_key or None)
-        
-        # Build prompt
-        # Build prompt
-        system_prompt = req.system_prompt or (
-            "You are a helpful medical assistant. Your task is to ALWAYS provide a comprehensive answer based on the provided excerpts. "
-            "NEVER say 'I cannot find', 'I don't have access to', 'information is not available', or 'I cannot provide'. "
-            "Instead, ALWAYS synthesize and use what IS available in the excerpts to answer the question comprehensively. "
-            "If excerpts are provided, you MUST draw from them. Provide detailed, thorough answers (3-8 sentences or more). "
-            "Include key medical points, recommendations, treatments, or relevant information from the excerpts. "
-            "Even if excerpts don't perfectly match, use related medical information to provide helpful context. "
-            "ALWAYS respond with an answer — never refuse or say information is unavailable."
-        )
-        
-        # Format chunks
-        excerpt_text = "Excerpts:\n\n"
-        if req.chunks and len(req.chunks) > 0:
-            for i, chunk in enumerate(req.chunks):
-                book = chunk.get("book", "Unknown")
-                start_page = chunk.get("start_page", "?")
-                end_page = chunk.get("end_page", start_page)
-                text = chunk.get("text", "")
-                if text:
-                    excerpt_text += f"[{i+1}] Book: {book} Pages: {start_page}-{end_page}\n{text}\n\n---\n\n"
-        else:
-            excerpt_text = "[NO_EXCERPTS] Provide a general helpful answer using medical knowledge."
-        
-        user_message = f"{excerpt_text}\n\nQuestion: {req.question}\n\nProvide a helpful, detailed answer. Return a JSON object with 'answer' (string), 'citations' (array), 'confidence' (0-1 float)."
-        
-        # ✅ LOG WHAT'S BEING SENT TO OPENAI
-        print(f'[RAG_ANSWER] 📤 SENDING TO OPENAI:')
-        print(f'  Model: {req.model}')
-        print(f'  Max tokens: {req.max_tokens}')
-        print(f'  System prompt length: {len(system_prompt)} chars')
-        response = client.chat.completions.create(
-            model=req.model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ],
-            temperature=req.temperature,
-            max_tokens=req.max_tokens,
-            timeout=30,
-        )
+        with upstream_timer(operation="rag_answer", model=req.model):
+            response = await client.chat.completions.create(
+                model=req.model,
+                messages=messages,
+                temperature=req.temperature,
+                max_tokens=req.max_tokens,
+                timeout=30,
+            )
+        record_usage("rag_answer", req.model, getattr(response, "usage", None))
 
         # Extract answer text robustly from the response object
         answer_text = ""
@@ -345,47 +877,353 @@ async def rag_answer(req: BatchRAGRequest, authorization: str = Header(None)):
             # Fallback to stringifying the response
             answer_text = str(response)
         
-        # ✅ LOG OPENAI RESPONSE (non-sensitive): log length and small preview only
-        print(f'[RAG_ANSWER] ✅ RESPONSE FROM OPENAI: answer_len={len(answer_text)}')
-        preview_text = answer_text[:200].replace("\n", " ")
-        print(f'  Answer preview (first 200 chars): {preview_text}...')
-        
-        # Try to parse JSON response
-        parsed = {"answer": answer_text, "citations": [], "confidence": 0.5}
-        try:
-            start_idx = answer_text.find("{")
-            end_idx = answer_text.rfind("}")
-            if start_idx >= 0 and end_idx > start_idx:
-                json_str = answer_text[start_idx:end_idx+1]
-                parsed = json.loads(json_str)
-        except:
-            pass
-        
-        # Verify answer is not a generic "I don't know" response and log accordingly
-        answer_lower = (parsed.get("answer", "") or "").lower()
-        if any(phrase in answer_lower for phrase in ["don't have access", "cannot provide", "no relevant", "unable to answer", "not available"]):
-            logger.warning(f"[rag_answer] Generic/refusal response detected; user={user_id} chunks={len(req.chunks)}")
-        
-        logger.info(f"[rag_answer] success user={user_id} answer_len={len(answer_text)}")
-        
-        return {
+        parsed = parse_rag_answer(answer_text, user_id, len(req.chunks))
+        result = {
             "success": True,
-            "answer": parsed.get("answer", answer_text),
-            "citations": parsed.get("citations", []),
-            "confidence": parsed.get("confidence", 0.5),
+            **parsed,
             "model": req.model,
-            "usage": getattr(response, "usage", {})
+            "usage": getattr(response, "usage", {}),
+            "cache": {"hit": False},
         }
+        await store_answer_cache(cache_key, result)
+        return result
     except Exception as e:
         logger.exception(f"[rag_answer] error user={user_id} {str(e)}")
         raise HTTPException(status_code=500, detail=f"RAG failed: {str(e)}")
 
+async def stream_rag_answer(req: BatchRAGRequest, user_id: str) -> AsyncIterator[str]:
+    """Yield SSE events for a RAG answer: `token` deltas, then `done` or `error`."""
+    req, packing = await pack_rag_request(req, user_id)
+    context = {"context": packing} if packing is not None else {}
+    passed_key = req.api_key if getattr(req, "api_key", None) else None
+    client_key = (passed_key or os.getenv("OPENAI_API_KEY", "")).strip()
+
+    if not client_key:
+        result = mock_rag_answer(req)
+        yield sse_event("token", {"delta": result["answer"]})
+        yield sse_event("done", {**result, **context})
+        return
+
+    cached, cache_key = await lookup_answer_cache(req, user_id)
+    if cached is not None:
+        yield sse_event("token", {"delta": cached["answer"]})
+        yield sse_event("done", {**cached, **context})
+        return
+
+    answer_parts: List[str] = []
+    extractor = AnswerStreamExtractor()
+    usage = None
+    started = time.perf_counter()
+    try:
+        messages = build_rag_messages(req, user_id)
+        client = get_openai_client(passed_key or None)
+        stream = await client.chat.completions.create(
+            model=req.model,
+            messages=messages,
+            temperature=req.temperature,
+            max_tokens=req.max_tokens,
+            timeout=30,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        async for event in stream:
+            if getattr(event, "usage", None):
+                usage = event.usage
+            if not event.choices:
+                continue
+            delta = getattr(event.choices[0].delta, "content", None) or ""
+            if not delta:
+                continue
+            answer_parts.append(delta)
+            text = extractor.feed(delta)
+            if text:
+                yield sse_event("token", {"delta": text})
+
+        UPSTREAM_LATENCY.observe(time.perf_counter() - started, operation="rag_answer_stream", model=req.model, outcome="ok")
+        note_upstream(time.perf_counter() - started)
+        record_usage("rag_answer_stream", req.model, usage)
+        parsed = parse_rag_answer("".join(answer_parts), user_id, len(req.chunks))
+        result = {
+            "success": True,
+            **parsed,
+            "model": req.model,
+            "usage": usage.model_dump() if hasattr(usage, "model_dump") else (usage or {}),
+            "cache": {"hit": False},
+        }
+        await store_answer_cache(cache_key, result)
+        yield sse_event("done", {**result, **context})
+    except Exception as e:
+        UPSTREAM_LATENCY.observe(time.perf_counter() - started, operation="rag_answer_stream", model=req.model, outcome="error")
+        note_upstream(time.perf_counter() - started)
+        logger.exception(f"[rag_answer_stream] error user={user_id} {str(e)}")
+        yield sse_event("error", {"success": False, "error": f"RAG failed: {str(e)}"})
+
+def _section_ids_or_raise(sections: Optional[List[str]]) -> Optional[List[int]]:
+    """Chunk ids of the requested TOC sections (None when not filtering)."""
+    sections = [s.strip() for s in sections or [] if s and s.strip()]
+    if not sections:
+        return None
+    try:
+        return section_chunk_ids(RAG_VECTORS_DB, sections)
+    except FileNotFoundError:
+        raise HTTPException(status_code=503, detail="Vector index not available on this server")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _search_or_raise(query_vectors: List[List[float]], top_k: int, books: Optional[List[str]],
+                     ids: Optional[List[int]] = None) -> List[List[Dict[str, Any]]]:
+    """Run a vector search, mapping index problems to HTTP errors."""
+    if top_k <= 0:
+        raise HTTPException(status_code=400, detail="top_k must be > 0")
+    try:
+        if ANN_INDEX.ready():
+            return ANN_INDEX.search(query_vectors, k=top_k, books=books, ids=ids)
+        if QUANTIZED_INDEX.ready():
+            return QUANTIZED_INDEX.search(query_vectors, k=top_k, books=books, ids=ids)
+        return VECTOR_INDEX.search(query_vectors, k=top_k, books=books, ids=ids)
+    except FileNotFoundError:
+        raise HTTPException(status_code=503, detail="Vector index not available on this server")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _bm25_or_raise(question: str, top_k: int, books: Optional[List[str]],
+                   ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+    """Run a BM25 search, mapping a missing FTS index to 503."""
+    if top_k <= 0:
+        raise HTTPException(status_code=400, detail="top_k must be > 0")
+    try:
+        return LEXICAL_INDEX.search(question, k=top_k, books=books, ids=ids)
+    except FileNotFoundError:
+        raise HTTPException(status_code=503, detail="Lexical index not available on this server")
+
+def _retrieve(mode: str, questions: List[str], query_vectors: Optional[List[List[float]]],
+              top_k: int, books: Optional[List[str]], sections: Optional[List[str]] = None) -> List[List[Dict[str, Any]]]:
+    """Hits per query for `mode`. Hybrid fuses BM25 and vector rankings with RRF,
+    keeping each side's score as `bm25_score` / `vector_score`. `sections`
+    narrows the candidates to chunks of those TOC sections before scoring.
+    """
+    ids = _section_ids_or_raise(sections)
+    if mode == "vector":
+        return _search_or_raise(query_vectors, top_k, books, ids)
+    if mode == "bm25":
+        return [_bm25_or_raise(q, top_k, books, ids) for q in questions]
+
+    pool = max(top_k * HYBRID_CANDIDATES, top_k)
+    dense = _search_or_raise(query_vectors, pool, books, ids)
+    results = []
+    for i, dense_hits in enumerate(dense):
+        lexical_hits = _bm25_or_raise(questions[i], pool, books, ids) if i < len(questions) else []
+        vector_scores = {h["id"]: h["score"] for h in dense_hits}
+        bm25_scores = {h["id"]: h["score"] for h in lexical_hits}
+        fused = reciprocal_rank_fusion([dense_hits, lexical_hits])[:top_k]
+        for hit in fused:
+            hit["vector_score"] = vector_scores.get(hit["id"])
+            hit["bm25_score"] = bm25_scores.get(hit["id"])
+        results.append(fused)
+    return results
+
+def _check_retrieval_mode(mode: str) -> None:
+    if mode not in RETRIEVAL_MODES:
+        raise HTTPException(status_code=400, detail=f"retrieval must be one of {', '.join(RETRIEVAL_MODES)}")
+
+@app.post("/rag/query")
+async def rag_query(req: RagQueryRequest, authorization: str = Header(None)):
+    """Vector search over the server-side index. Accepts one question, a batch of
+    questions, or a precomputed embedding; all queries are scored in one matmul.
+    """
+    user_id = verify_auth(authorization)
+
+    if not await check_rate_limit(user_id):
+        raise HTTPException(status_code=429, detail="Rate limit exceeded")
+
+    questions = list(req.questions or [])
+    if req.question:
+        questions.insert(0, req.question)
+    if not questions and not req.embedding:
+        raise HTTPException(status_code=400, detail="question, questions or embedding required")
+    _check_retrieval_mode(req.retrieval)
+    if req.retrieval == "bm25" and not questions:
+        raise HTTPException(status_code=400, detail="bm25 retrieval needs question text")
+
+    try:
+        query_vectors = None
+        if req.embedding:
+            query_vectors = [req.embedding]
+        elif req.retrieval != "bm25":
+            query_vectors, _ = await embed_texts(questions, req.embedding_model, req.api_key)
+        results = await run_in_threadpool(
+            _retrieve, req.retrieval, questions, query_vectors, req.top_k, req.books, req.sections
+        )
+        logger.info(f"[rag_query] user={user_id} queries={len(results)} top_k={req.top_k} retrieval={req.retrieval}")
+        return {
+            "success": True,
+            "retrieval": req.retrieval,
+            "results": [
+                {"question": questions[i] if i < len(questions) else None, "chunks": hits}
+                for i, hits in enumerate(results)
+            ],
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception(f"[rag_query] error user={user_id} {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
+
+@app.post("/rag/ask")
+async def rag_ask(req: RagAskRequest, authorization: str = Header(None)):
+    """Embed the question, retrieve chunks from the server-side index and answer,
+    so the client only has to send the question text.
+    """
+    user_id = verify_auth(authorization)
+
+    if not await check_rate_limit(user_id):
+        raise HTTPException(status_code=429, detail="Rate limit exceeded")
+
+    if not req.question or not req.question.strip():
+        raise HTTPException(status_code=400, detail="Question cannot be empty")
+    _check_retrieval_mode(req.retrieval)
+
+    query_vectors = None
+    if req.retrieval != "bm25":
+        try:
+            query_vectors, _ = await embed_texts([req.question], req.embedding_model, req.api_key)
+        except Exception as e:
+            logger.exception(f"[rag_ask] embedding error user={user_id} {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Embedding failed: {str(e)}")
+    hits = (await run_in_threadpool(
+        _retrieve, req.retrieval, [req.question], query_vectors, req.top_k, req.books, req.sections
+    ))[0]
+
+    rag_req = BatchRAGRequest(
+        question=req.question,
+        chunks=hits,
+        system_prompt=req.system_prompt,
+        model=req.model,
+        temperature=req.temperature,
+        max_tokens=req.max_tokens,
+        api_key=req.api_key,
+        cache=req.cache,
+        context_tokens=req.context_tokens,
+    )
+    # Reuse the retrieval embedding for the cache lookup when it is from the same model.
+    question_vector = None
+    if query_vectors is not None and req.embedding_model == ANSWER_CACHE_EMBED_MODEL:
+        question_vector = query_vectors[0]
+    result = await answer_with_chunks(rag_req, user_id, question_vector)
+    result["retrieved"] = [
+        {k: hit.get(k) for k in ("id", "book", "start_page", "end_page", "score")} for hit in hits
+    ]
+    return result
+
+def split_train_batches(chunks: List[Dict[str, Any]], max_batch_size: int = 20 * 1024) -> List[List[Dict[str, Any]]]:
+    """Group chunks into batches of roughly `max_batch_size` characters."""
+    batches = []
+    current_batch = []
+    batch_size = 0
+    for chunk in chunks:
+        chunk_text = chunk.get("text", "")
+        if batch_size + len(chunk_text) > max_batch_size and current_batch:
+            batches.append(current_batch)
+            current_batch = []
+            batch_size = 0
+        current_batch.append(chunk)
+        batch_size += len(chunk_text) + 200
+    if current_batch:
+        batches.append(current_batch)
+    return batches
+
+async def train_batch(
+    batch_idx: int,
+    batch: List[Dict[str, Any]],
+    model: str,
+    temperature: float,
+    max_tokens: int,
+    api_key: Optional[str],
+    semaphore: asyncio.Semaphore,
+) -> Dict[str, Any]:
+    """Generate Q/A pairs for one batch, retrying 429s and timeouts with backoff.
+    Returns the pairs plus timing/attempt stats; never raises.
+    """
+    # Build excerpt text
+    excerpt_text = "Excerpts:\n\n"
+    for chunk in batch:
+        book = chunk.get("book", "Unknown")
+        start_page = chunk.get("start_page", "?")
+        end_page = chunk.get("end_page", start_page)
+        text = chunk.get("text", "")
+        excerpt_text += f"Book: {book} Pages: {start_page}-{end_page}\n{text}\n\n---\n\n"
+
+    stats = {"batch": batch_idx, "chunks": len(batch), "attempts": 0, "seconds": 0.0, "pairs": 0, "error": None}
+    pairs: List[Any] = []
+    async with semaphore:
+        started = time.monotonic()
+        for attempt in range(TRAIN_MAX_RETRIES + 1):
+            stats["attempts"] = attempt + 1
+            try:
+                # Retries are handled here (with stats), not by the SDK.
+                client = get_openai_client(api_key).with_options(max_retries=0)
+                with upstream_timer(operation="train_batch", model=model):
+                    response = await client.chat.completions.create(
+                        model=model,
+                        messages=[
+                            {"role": "system", "content": "You are a medical Q&A generator. Extract factual Q&A pairs from the provided text."},
+                            {"role": "user", "content": excerpt_text + "\n\nGenerate Q&A pairs as JSON array: [{\"question\": \"...\", \"answer\": \"...\"}, ...]"}
+                        ],
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        timeout=30,
+                    )
+                record_usage("train_batch", model, getattr(response, "usage", None))
+            except (openai_pkg.RateLimitError, openai_pkg.APITimeoutError) as e:
+                if attempt >= TRAIN_MAX_RETRIES:
+                    stats["error"] = f"{type(e).__name__}: {e}"
+                    logger.warning(f"[train_book] batch {batch_idx} giving up after {attempt + 1} attempts: {e}")
+                    break
+                delay = TRAIN_RETRY_BASE_DELAY * (2 ** attempt) * (1 + random.random())
+                logger.info(f"[train_book] batch {batch_idx} retry {attempt + 1} in {delay:.1f}s ({type(e).__name__})")
+                await asyncio.sleep(delay)
+                continue
+            except Exception as e:
+                stats["error"] = f"{type(e).__name__}: {e}"
+                logger.exception(f"[train_book] batch {batch_idx} error: {str(e)}")
+                break
+
+            # Extract content robustly
+            content = ""
+            if hasattr(response, "choices") and len(response.choices) > 0:
+                c0 = response.choices[0]
+                msg = getattr(c0, "message", None)
+                if isinstance(msg, dict):
+                    content = msg.get("content", "")
+                else:
+                    content = getattr(msg, "content", "") or str(c0)
+            else:
+                content = str(response)
+
+            # Parse JSON
+            try:
+                start_idx = content.find("[")
+                end_idx = content.rfind("]")
+                if start_idx >= 0 and end_idx > start_idx:
+                    json_str = content[start_idx:end_idx+1]
+                    pairs = json.loads(json_str)
+                    logger.info(f"[train_book] batch {batch_idx} extracted {len(pairs)} pairs")
+            except:
+                stats["error"] = "failed to parse JSON"
+                logger.warning(f"[train_book] batch {batch_idx} failed to parse JSON")
+            break
+        stats["seconds"] = round(time.monotonic() - started, 3)
+    stats["pairs"] = len(pairs)
+    return {"pairs": pairs, "stats": stats}
+
 @app.post("/train/book")
 async def train_book(req: TrainBookRequest, authorization: str = Header(None)):
-    """Train a book by generating Q/A pairs in batches."""
+    """Train a book by generating Q/A pairs in batches.
+    Batches run concurrently (bounded by TRAIN_CONCURRENCY) and are merged in batch order.
+    """
     user_id = verify_auth(authorization)
     
-    if not check_rate_limit(user_id):
+    if not await check_rate_limit(user_id):
         raise HTTPException(status_code=429, detail="Rate limit exceeded")
     
     if not req.book_id or not req.chunks:
@@ -395,87 +1233,166 @@ async def train_book(req: TrainBookRequest, authorization: str = Header(None)):
         logger.info(f"[train_book] user={user_id} book={req.book_id} chunks={len(req.chunks)}")
         
         # Batch chunks (~20KB per batch)
-        batches = []
-        current_batch = []
-        batch_size = 0
-        max_batch_size = 20 * 1024
-        
-        for chunk in req.chunks:
-            chunk_text = chunk.get("text", "")
-            if batch_size + len(chunk_text) > max_batch_size and current_batch:
-                batches.append(current_batch)
-                current_batch = []
-                batch_size = 0
-            current_batch.append(chunk)
-            batch_size += len(chunk_text) + 200
-        
-        if current_batch:
-            batches.append(current_batch)
-        
-        logger.info(f"[train_book] split into {len(batches)} batches")
+        batches = split_train_batches(req.chunks)
+        concurrency = max(1, min(req.concurrency or TRAIN_CONCURRENCY, TRAIN_CONCURRENCY))
+        logger.info(f"[train_book] split into {len(batches)} batches concurrency={concurrency}")
         
+        started = time.monotonic()
+        semaphore = asyncio.Semaphore(concurrency)
+        results = await asyncio.gather(*[
+            train_batch(batch_idx, batch, req.model, req.temperature, req.max_tokens, req.api_key, semaphore)
+            for batch_idx, batch in enumerate(batches)
+        ])
+
+        # gather preserves input order, so pairs come out in batch order
         qa_pairs = []
-        for batch_idx, batch in enumerate(batches):
-            # Build excerpt text
-            excerpt_text = "Excerpts:\n\n"
-            for chunk in batch:
-                book = chunk.get("book", "Unknown")
-                start_page = chunk.get("start_page", "?")
-                end_page = chunk.get("end_page", start_page)
-                text = chunk.get("text", "")
-                excerpt_text += f"Book: {book} Pages: {start_page}-{end_page}\n{text}\n\n---\n\n"
-            try:
-                client = get_openai_client(getattr(req, "api_key", None))
-                response = client.chat.completions.create(
-                    model=req.model,
-                    messages=[
-                        {"role": "system", "content": "You are a medical Q&A generator. Extract factual Q&A pairs from the provided text."},
-                        {"role": "user", "content": excerpt_text + "\n\nGenerate Q&A pairs as JSON array: [{\"question\": \"...\", \"answer\": \"...\"}, ...]"}
-                    ],
-                    temperature=req.temperature,
-                    max_tokens=req.max_tokens,
-                    timeout=30,
-                )
-
-                # Extract content robustly
-                content = ""
-                if hasattr(response, "choices") and len(response.choices) > 0:
-                    c0 = response.choices[0]
-                    msg = getattr(c0, "message", None)
-                    if isinstance(msg, dict):
-                        content = msg.get("content", "")
-                    else:
-                        content = getattr(msg, "content", "") or str(c0)
-                else:
-                    content = str(response)
-                
-                # Parse JSON
-                try:
-                    start_idx = content.find("[")
-                    end_idx = content.rfind("]")
-                    if start_idx >= 0 and end_idx > start_idx:
-                        json_str = content[start_idx:end_idx+1]
-                        batch_pairs = json.loads(json_str)
-                        qa_pairs.extend(batch_pairs)
-                        logger.info(f"[train_book] batch {batch_idx} extracted {len(batch_pairs)} pairs")
-                except:
-                    logger.warning(f"[train_book] batch {batch_idx} failed to parse JSON")
-            except Exception as e:
-                logger.exception(f"[train_book] batch {batch_idx} error: {str(e)}")
+        for result in results:
+            qa_pairs.extend(result["pairs"])
+        batch_stats = [result["stats"] for result in results]
+        failed = sum(1 for st in batch_stats if st["error"])
         
-        logger.info(f"[train_book] success user={user_id} total_pairs={len(qa_pairs)}")
+        logger.info(f"[train_book] success user={user_id} total_pairs={len(qa_pairs)} failed_batches={failed}")
         
         return {
             "success": True,
             "book_id": req.book_id,
             "qa_pairs": qa_pairs,
             "count": len(qa_pairs),
-            "batches": len(batches)
+            "batches": len(batches),
+            "failed_batches": failed,
+            "concurrency": concurrency,
+            "elapsed_seconds": round(time.monotonic() - started, 3),
+            "batch_stats": batch_stats,
         }
     except Exception as e:
         logger.exception(f"[train_book] error user={user_id} {str(e)}")
         raise HTTPException(status_code=500, detail=f"Training failed: {str(e)}")
 
+async def run_train_job_batch(batch_idx: int, batch: List[Dict[str, Any]], params: Dict[str, Any],
+                              semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+    """One batch of a background training job (see train_jobs.TrainJobRunner)."""
+    return await train_batch(batch_idx, batch, params["model"], params["temperature"], params["max_tokens"],
+                             params.get("api_key"), semaphore)
+
+# Background training jobs (POST /train/jobs), persisted in TRAIN_JOBS_DB and
+# leased to one worker at a time; up to TRAIN_JOB_WORKERS jobs run per worker.
+TRAIN_JOBS = TrainJobRunner(
+    TrainJobStore(os.getenv("TRAIN_JOBS_DB", "train_jobs.db")),
+    run_train_job_batch,
+    max_jobs=int(os.getenv("TRAIN_JOB_WORKERS", "2")),
+    concurrency=TRAIN_CONCURRENCY,
+    lease_seconds=float(os.getenv("TRAIN_JOB_LEASE_SECONDS", "60")),
+)
+
+@app.post("/train/jobs", status_code=202)
+async def create_train_job(req: TrainBookRequest, authorization: str = Header(None)):
+    """Queue a book for training and return its job id immediately.
+    Poll GET /train/jobs/{job_id} for progress and the Q/A pairs so far.
+    """
+    user_id = verify_auth(authorization)
+
+    if not await check_rate_limit(user_id):
+        raise HTTPException(status_code=429, detail="Rate limit exceeded")
+
+    if not req.book_id or not req.chunks:
+        raise HTTPException(status_code=400, detail="book_id and chunks required")
+
+    batches = split_train_batches(req.chunks)
+    params = {"model": req.model, "temperature": req.temperature, "max_tokens": req.max_tokens, "concurrency": req.concurrency}
+    job_id = await TRAIN_JOBS.create(user_id, req.book_id, params, batches, req.api_key)
+    logger.info(f"[train_jobs] created job={job_id} user={user_id} book={req.book_id} batches={len(batches)}")
+    return {"success": True, "job_id": job_id, "book_id": req.book_id, "batches": len(batches), "status": "queued"}
+
+@app.get("/train/jobs/{job_id}")
+async def get_train_job(job_id: str, include_pairs: bool = True, authorization: str = Header(None)):
+    """Status, progress and the Q/A pairs of the batches finished so far."""
+    user_id = verify_auth(authorization)
+    job = await run_in_threadpool(TRAIN_JOBS.store.get, job_id, user_id, include_pairs)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"success": True, **job}
+
+@app.post("/train/jobs/{job_id}/retry")
+async def retry_train_job(job_id: str, req: Optional[TrainJobRetryRequest] = None, authorization: str = Header(None)):
+    """Re-queue the failed batches of a job."""
+    user_id = verify_auth(authorization)
+    retried = await TRAIN_JOBS.retry(job_id, user_id, req.api_key if req is not None else None)
+    if retried is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"success": True, "job_id": job_id, "retried_batches": retried}
+
+# ============= Start-up =============
+# Read-only data is loaded by `preload` steps at import time: once in the
+# gunicorn master with --preload (shared by the forked workers), or per process
+# otherwise. Anything holding a socket, thread or SQLite handle is opened by the
+# per-worker steps instead.
+#
+# Under --preload every module-level singleton is therefore built once in the
+# master and copied into each worker. Each one holds no per-process state at
+# fork time (test_preload.py checks this):
+# - the SQLite stores (caches, corpus, train jobs, rate limits, lexical and ANN
+#   row lookups) connect lazily, per worker or per thread; preload steps close
+#   the connections they open;
+# - OPENAI_POOL builds its httpx client on first use, and SINGLE_FLIGHT and
+#   EMBED_BATCHER only hold asyncio objects created by requests;
+# - TRAIN_JOBS derives its lease owner from the pid and starts its sweeper in
+#   the worker's `lifespan`;
+# - metrics label series with the pid when recording, and structured_log
+#   restarts its writer thread in an at-fork hook.
+WARM_UP = WarmUp()
+PRELOAD_INDEXES = os.getenv("PRELOAD_INDEXES", "1") != "0"
+WARMUP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_TIMEOUT_SECONDS", "10"))
+WARMUP_UPSTREAM_CONNECTIONS = int(os.getenv("WARMUP_UPSTREAM_CONNECTIONS", "2"))
+
+def preload_ann_index() -> Dict[str, Any]:
+    # Maps the file; the mapping is shared by every process that inherits it.
+    if not ANN_INDEX.ready():
+        return {"skipped": f"no usable index at {ANN_INDEX.path}"}
+    return ANN_INDEX.stats()
+
+def preload_quantized_index() -> Dict[str, Any]:
+    if ANN_INDEX.fresh:
+        return {"skipped": "searches use the ANN index"}
+    if not QUANTIZED_INDEX.ready():
+        return {"skipped": "no quantized embeddings"}
+    return QUANTIZED_INDEX.stats()
+
+def preload_vector_index() -> Dict[str, Any]:
+    if ANN_INDEX.fresh or QUANTIZED_INDEX.fresh:
+        return {"skipped": f"searches use the {'ANN' if ANN_INDEX.fresh else 'quantized'} index"}
+    if not VECTOR_INDEX.available:
+        return {"skipped": f"{RAG_VECTORS_DB} not found"}
+    VECTOR_INDEX.ensure_loaded()
+    stats = VECTOR_INDEX.stats()
+    return {"chunks": sum(stats["books"].values()), "dim": stats["dim"], "shared_bytes": stats["shared_bytes"]}
+
+async def open_local_stores() -> Dict[str, Any]:
+    stores = {"embedding_cache": EMBEDDING_CACHE, "answer_cache": ANSWER_CACHE, "corpus_store": CORPUS_STORE}
+    stores = {name: store for name, store in stores.items() if store is not None}
+    opened, failed = [], {}
+    # Each store separately: one that cannot be opened must not leave the others cold.
+    for name, store in stores.items():
+        try:
+            await run_in_threadpool(store.open)
+        except Exception as e:
+            failed[name] = f"{type(e).__name__}: {e}"
+        else:
+            opened.append(name)
+    if failed:
+        raise RuntimeError(f"opened {opened or 'none'}; failed {failed}")
+    return {"opened": opened}
+
+async def open_upstream_connections() -> Dict[str, Any]:
+    """Open keep-alive connections (DNS, TCP, TLS) to OpenAI before the first request needs them."""
+    if not DEFAULT_OPENAI_KEY or WARMUP_UPSTREAM_CONNECTIONS <= 0:
+        return {"skipped": "no OPENAI_API_KEY" if not DEFAULT_OPENAI_KEY else "disabled"}
+    client = get_openai_client().with_options(max_retries=0)
+    await asyncio.gather(*(client.models.list() for _ in range(WARMUP_UPSTREAM_CONNECTIONS)))
+    return {"connections": WARMUP_UPSTREAM_CONNECTIONS}
+
+WARM_UP.add("local_stores", open_local_stores, WARMUP_TIMEOUT_SECONDS)
+WARM_UP.add("upstream", open_upstream_connections, WARMUP_TIMEOUT_SECONDS)
+
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
     """Custom error response handler."""
@@ -485,6 +1402,12 @@ async def http_exception_handler(request: Request, exc: HTTPException):
     )
 
 
+@app.get("/metrics")
+async def metrics(authorization: str = Header(None)):
+    """Prometheus metrics for this worker (latency histograms, upstream tokens, cache and rate-limit counters)."""
+    verify_auth(authorization)
+    return Response(METRICS.render(), media_type=METRICS_CONTENT_TYPE)
+
 @app.get("/internal/openai_key_status")
 async def openai_key_status(authorization: str = Header(None)):
     """Internal endpoint to check whether OPENAI_API_KEY is set on the server.
@@ -496,6 +1419,40 @@ async def openai_key_status(authorization: str = Header(None)):
     key = os.getenv("OPENAI_API_KEY", "")
     return {"success": True, "has_key": bool(key)}
 
+@app.get("/internal/profiles")
+async def list_profiles(authorization: str = Header(None)):
+    """Stored request profiles of this host, newest first (wall/CPU/upstream seconds per request)."""
+    verify_auth(authorization)
+    return {"success": True, "profiles": await run_in_threadpool(PROFILE_STORE.list)}
+
+@app.get("/internal/profiles/{profile_id}")
+async def download_profile(profile_id: str, format: str = "html", authorization: str = Header(None)):
+    """One stored profile: `format=html` (pyinstrument) or `txt` (call tree / pstats)."""
+    verify_auth(authorization)
+    path = PROFILE_STORE.path(profile_id, format)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    media_type = "text/html" if format == "html" else "text/plain"
+    return FileResponse(path, media_type=media_type, filename=f"profile-{profile_id}.{format}")
+
+@app.get("/internal/single_flight")
+async def single_flight_stats(authorization: str = Header(None)):
+    """Coalescing counters for this worker: per-endpoint totals and the busiest keys."""
+    verify_auth(authorization)
+    return {"success": True, **SINGLE_FLIGHT.stats()}
+
+@app.get("/internal/embed_batcher")
+async def embed_batcher_stats(authorization: str = Header(None)):
+    """Micro-batching counters for this worker (requests, batches, texts sent upstream)."""
+    verify_auth(authorization)
+    return {"success": True, **EMBED_BATCHER.stats()}
+
+if PRELOAD_INDEXES:
+    WARM_UP.preload("ann_index", preload_ann_index)
+    WARM_UP.preload("quantized_index", preload_quantized_index)
+    WARM_UP.preload("vector_index", preload_vector_index)
+    WARM_UP.freeze()
+
 if __name__ == "__main__":
     import uvicorn
     # Log presence of API key at startup (not the value, for security)
@@ -0,0 +1,178 @@
+# Minimal Prometheus metrics (text exposition format 0.0.4).
+#
+# Counters and histograms are kept per worker process. Every sample carries a
+# `worker` label (the pid) so that scraping several gunicorn workers through
+# one port still yields distinct series; aggregate with sum() in queries.
+# Values that other components already count (cache sizes, in-flight calls)
+# are read by callbacks at scrape time.
+
+import os
+import math
+import time
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Request latencies from a cache hit (~1 ms) to a slow completion (~30 s).
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = ("worker", *labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return (str(os.getpid()), *(str(labels.get(n, "")) for n in self.labels[1:]))
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def collect(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, k)} {_format_value(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+                    break
+            else:
+                row[len(self.buckets)] += 1
+            row[-1] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[Dict[str, str]]:
+        """Observe the duration of the block. Labels may be changed inside it
+        through the yielded dict (e.g. an `outcome` known only at the end)."""
+        started = time.perf_counter()
+        labels = dict(labels)
+        try:
+            yield labels
+        except BaseException:
+            labels.setdefault("outcome", "error")
+            raise
+        finally:
+            labels.setdefault("outcome", "ok")
+            self.observe(time.perf_counter() - started, **labels)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = []
+        for key, row in items:
+            cumulative = 0.0
+            for bound, count in zip((*self.buckets, math.inf), row[:-1]):
+                cumulative += count
+                le = ("le", _format_value(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {_format_value(cumulative)}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(row[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {_format_value(cumulative)}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """Gauge (or counter) read at scrape time from `fn()`, which returns
+    {label value tuple: value}; for counters kept by other components."""
+
+    def __init__(self, name: str, help_text: str, fn: Callable[[], Dict[LabelValues, float]],
+                 labels: Sequence[str] = (), kind: str = "gauge"):
+        super().__init__(name, help_text, labels)
+        self.fn = fn
+        self.kind = kind
+
+    def collect(self) -> List[str]:
+        pid = str(os.getpid())
+        return [
+            f"{self.name}{_format_labels(self.labels, (pid, *k))} {_format_value(v)}"
+            for k, v in self.fn().items()
+        ]
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def callback(self, name: str, help_text: str, fn: Callable[[], Dict[LabelValues, float]],
+                 labels: Sequence[str] = (), kind: str = "gauge") -> CallbackMetric:
+        return self.register(CallbackMetric(name, help_text, fn, labels, kind))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            try:
+                samples = metric.collect()
+            except Exception:
+                # A failing callback must not break the whole scrape.
+                continue
+            lines.extend(metric.header())
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,98 @@
+# Shared pool of AsyncOpenAI clients.
+#
+# Every client in the pool is keyed by the API key it authenticates with and
+# reuses one httpx.AsyncClient, so requests from any user share keep-alive
+# connections (and TLS sessions) to the upstream instead of opening a new
+# connection per request.
+
+import os
+import time
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+import httpx
+from openai import AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+
+class OpenAIClientPool:
+    """LRU pool of AsyncOpenAI clients over a single shared HTTP connection pool.
+
+    Clients are created lazily on first use, so the pool (and its sockets) is
+    only opened inside the worker process that serves the request.
+    """
+
+    def __init__(
+        self,
+        max_clients: int = 32,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        idle_seconds: float = 900.0,
+        timeout: float = 30.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.max_clients = max_clients
+        self.idle_seconds = idle_seconds
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = timeout
+        # Optional custom transport (e.g. an in-process ASGI stand-in for tests).
+        self.transport = transport
+        self._http: Optional[httpx.AsyncClient] = None
+        # api key -> (client, last used monotonic time), least recently used first
+        self._clients: "OrderedDict[str, tuple]" = OrderedDict()
+
+    @classmethod
+    def from_env(cls) -> "OpenAIClientPool":
+        return cls(
+            max_clients=int(os.getenv("OPENAI_POOL_MAX_CLIENTS", "32")),
+            max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30")),
+            idle_seconds=float(os.getenv("OPENAI_CLIENT_IDLE_SECONDS", "900")),
+        )
+
+    def _http_client(self) -> httpx.AsyncClient:
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(limits=self.limits, timeout=self.timeout, transport=self.transport)
+        return self._http
+
+    def _evict(self, now: float) -> None:
+        # Drop clients idle for too long, then trim to the size limit. Evicted
+        # clients are simply dropped: closing one would close the shared pool.
+        for key in [k for k, (_, used) in self._clients.items() if now - used > self.idle_seconds]:
+            del self._clients[key]
+        while len(self._clients) > self.max_clients:
+            self._clients.popitem(last=False)
+
+    def get(self, api_key: Optional[str] = None) -> AsyncOpenAI:
+        """Return the pooled client for `api_key` (or the environment key)."""
+        key = (api_key or os.getenv("OPENAI_API_KEY", "")).strip()
+        now = time.monotonic()
+        entry = self._clients.get(key)
+        if entry is not None:
+            self._clients.move_to_end(key)
+            self._clients[key] = (entry[0], now)
+            return entry[0]
+
+        http_client = self._http_client()
+        # If key is empty the client reads OPENAI_API_KEY itself (and raises if unset).
+        client = AsyncOpenAI(api_key=key, http_client=http_client) if key else AsyncOpenAI(http_client=http_client)
+        self._clients[key] = (client, now)
+        self._evict(now)
+        return client
+
+    def size(self) -> int:
+        return len(self._clients)
+
+    async def aclose(self) -> None:
+        self._clients.clear()
+        if self._http is not None and not self._http.is_closed:
+            await self._http.aclose()
+        self._http = None
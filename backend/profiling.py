@@ -0,0 +1,210 @@
+# On-demand request profiling.
+#
+# A request is profiled when it carries `X-Profile: <PROFILE_TOKEN>` or is
+# picked by the sampling rate. The middleware is plain ASGI, so the profiler
+# runs in the same task as the route handler: the call tree covers request
+# validation, prompt building, the upstream call and response rendering.
+# pyinstrument is used when installed (its async mode shows time spent
+# awaiting as such); otherwise cProfile, which also sees whatever else the
+# event loop ran meanwhile.
+#
+# Profiles are written to a directory that keeps only the newest
+# `max_profiles` (a ring), and are listed/downloaded via /internal/profiles.
+
+import io
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import logging
+import pstats
+import cProfile
+import contextvars
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Upstream time of the request being profiled (None when it is not profiled).
+_upstream: "contextvars.ContextVar[Optional[Dict[str, float]]]" = contextvars.ContextVar("profile_upstream", default=None)
+
+
+_pyinstrument: Any = False  # not imported yet; None when unavailable
+
+
+def pyinstrument_profiler() -> Any:
+    """The pyinstrument Profiler class, imported on first profile rather than
+    at start-up (most workers never profile); None when it is not installed."""
+    global _pyinstrument
+    if _pyinstrument is False:
+        try:
+            from pyinstrument import Profiler
+        except ImportError:  # pyinstrument is optional; fall back to cProfile
+            Profiler = None
+        _pyinstrument = Profiler
+    return _pyinstrument
+
+
+def note_upstream(seconds: float) -> None:
+    """Credit time spent waiting on an upstream call to the profiled request, if any."""
+    acc = _upstream.get()
+    if acc is not None:
+        acc["seconds"] += seconds
+        acc["calls"] += 1
+
+
+class ProfileStore:
+    """Directory of profiles: `<id>.json` metadata plus one file per format."""
+
+    def __init__(self, directory: str, max_profiles: int = 50):
+        self.directory = directory
+        self.max_profiles = max_profiles
+
+    def save(self, meta: Dict[str, Any], artifacts: Dict[str, bytes]) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        meta = dict(meta, formats=sorted(artifacts))
+        for fmt, data in artifacts.items():
+            with open(os.path.join(self.directory, f"{meta['id']}.{fmt}"), "wb") as f:
+                f.write(data)
+        # Metadata last: a profile is listed only once its files are complete.
+        with open(os.path.join(self.directory, f"{meta['id']}.json"), "w") as f:
+            json.dump(meta, f)
+        self._trim()
+
+    def _trim(self) -> None:
+        for meta in self.list()[self.max_profiles:]:
+            for fmt in [*meta.get("formats", []), "json"]:
+                try:
+                    os.remove(os.path.join(self.directory, f"{meta['id']}.{fmt}"))
+                except FileNotFoundError:
+                    pass
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Profile metadata, newest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        metas = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                try:
+                    with open(os.path.join(self.directory, name)) as f:
+                        metas.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        return sorted(metas, key=lambda m: m.get("created_at", 0), reverse=True)
+
+    def path(self, profile_id: str, fmt: str) -> Optional[str]:
+        if not profile_id.isalnum() or not fmt.isalnum():
+            return None
+        path = os.path.join(self.directory, f"{profile_id}.{fmt}")
+        return path if os.path.exists(path) else None
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles selected requests into a ProfileStore.
+
+    One request per worker is profiled at a time; others that ask for it are
+    served normally with `X-Profile: skipped`. Profiled responses carry
+    `X-Profile-Id`.
+    """
+
+    def __init__(self, app, store: ProfileStore, token: str = "", sample_rate: float = 0.0,
+                 exclude_prefixes: tuple = ("/internal/profiles", "/metrics", "/health", "/ready")):
+        self.app = app
+        self.store = store
+        self.token = token
+        self.sample_rate = sample_rate
+        self.exclude_prefixes = exclude_prefixes
+        self._busy = False
+
+    def _wanted(self, scope) -> Optional[bool]:
+        """True to profile, None if profiling was asked for but is unavailable, else False."""
+        if scope["type"] != "http" or scope["path"].startswith(self.exclude_prefixes):
+            return False
+        header = dict(scope.get("headers") or []).get(b"x-profile")
+        asked = bool(self.token) and header is not None and header.decode("latin-1") == self.token
+        if not asked and not (self.sample_rate > 0 and random.random() < self.sample_rate):
+            return False
+        return None if self._busy else True
+
+    async def __call__(self, scope, receive, send):
+        wanted = self._wanted(scope)
+        if not wanted:
+            if wanted is None:
+                await self.app(scope, receive, self._with_header(send, b"x-profile", b"skipped"))
+            else:
+                await self.app(scope, receive, send)
+            return
+
+        self._busy = True
+        profile_id = uuid.uuid4().hex
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message = dict(message, headers=[*message.get("headers", []), (b"x-profile-id", profile_id.encode())])
+            await send(message)
+
+        acc = {"seconds": 0.0, "calls": 0}
+        token = _upstream.set(acc)
+        profiler_cls = pyinstrument_profiler()
+        if profiler_cls is not None:
+            profiler = profiler_cls(async_mode="enabled")
+        else:
+            profiler = cProfile.Profile()
+        wall0, cpu0 = time.perf_counter(), time.thread_time()
+        if isinstance(profiler, cProfile.Profile):
+            profiler.enable()
+        else:
+            profiler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if isinstance(profiler, cProfile.Profile):
+                profiler.disable()
+            else:
+                profiler.stop()
+            wall, cpu = time.perf_counter() - wall0, time.thread_time() - cpu0
+            _upstream.reset(token)
+            self._busy = False
+            meta = {
+                "id": profile_id,
+                "created_at": time.time(),
+                "method": scope.get("method"),
+                "path": scope.get("path"),
+                "status": status["code"],
+                "wall_seconds": round(wall, 6),
+                # Thread CPU time: includes other requests the event loop served meanwhile.
+                "cpu_seconds": round(cpu, 6),
+                "upstream_seconds": round(acc["seconds"], 6),
+                "upstream_calls": acc["calls"],
+                "profiler": "pyinstrument" if profiler_cls is not None else "cprofile",
+            }
+            try:
+                await asyncio.to_thread(self.store.save, meta, self._render(profiler))
+                logger.info("[profiling] stored %s %s %s wall=%.3fs", profile_id, meta["method"], meta["path"], wall)
+            except Exception as e:
+                logger.warning("[profiling] could not store profile %s: %s", profile_id, e)
+
+    @staticmethod
+    def _render(profiler) -> Dict[str, bytes]:
+        if isinstance(profiler, cProfile.Profile):
+            out = io.StringIO()
+            stats = pstats.Stats(profiler, stream=out)
+            stats.sort_stats("cumulative").print_stats(60)
+            stats.print_callees(30)
+            return {"txt": out.getvalue().encode("utf-8")}
+        return {
+            "html": profiler.output_html().encode("utf-8"),
+            "txt": profiler.output_text(unicode=True, color=False, show_all=False).encode("utf-8"),
+        }
+
+    @staticmethod
+    def _with_header(send, name: bytes, value: bytes):
+        async def wrapper(message):
+            if message["type"] == "http.response.start":
+                message = dict(message, headers=[*message.get("headers", []), (name, value)])
+            await send(message)
+        return wrapper
@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+"""
+Quantized copy of the embeddings in a `rag_vectors.db` file.
+
+`VectorDB` keeps every embedding as a float64 blob (12 KB for 1536 dims). The
+converter adds an `embeddings_quantized` table next to it holding each vector
+unit-normalised, optionally truncated to its first `dim` values (text-embedding-3
+vectors are trained to stay useful when shortened), and stored as:
+
+  float32  - 4 bytes/value                       (2x smaller than float64)
+  float16  - 2 bytes/value                       (4x)
+  int8     - 1 byte/value, value = code * scale  (8x; 16x+ with --dim 768)
+
+plus the norm of the original vector. The backend scans only the compact codes
+(from one shared mapping, like `VectorIndex`), keeps `rescore` x k candidates
+and re-ranks them by exact cosine against their float64 rows, which are read
+by primary key. The float64 table is left in place for that and for the app.
+
+Convert (re-run after re-indexing or embedding new chunks):
+  python backend/quantized_index.py --db rag_vectors.db --dtype int8
+  python backend/quantized_index.py --db rag_vectors.db --dtype float16 --dim 768 --evaluate 200
+
+If the table does not match the embeddings (different count or max chunk id),
+the backend logs a warning and falls back to the float64 search.
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    from .vector_index import shared_matrices, top_k_indices
+    from .embedding_codec import quantize
+    from .ann_index import db_fingerprint
+except ImportError:
+    from vector_index import shared_matrices, top_k_indices
+    from embedding_codec import quantize
+    from ann_index import db_fingerprint
+
+logger = logging.getLogger(__name__)
+
+DTYPES = {"float32": "<f4", "float16": "<f2", "int8": "i1"}
+TABLE = "embeddings_quantized"
+DEFAULT_RESCORE = 4
+# Rows converted to float32 at a time while scanning (about 8 MB per block).
+SCAN_BLOCK_BYTES = 8 * 1024 * 1024
+
+
+def encode_rows(full: np.ndarray, dtype: str, dim: Optional[int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(codes, scales, norms of `full`) for a float64 (rows, source_dim) matrix."""
+    norms = np.linalg.norm(full, axis=1)
+    vectors = np.asarray(full[:, :dim] if dim else full, dtype=np.float32)
+    lengths = np.linalg.norm(vectors, axis=1)
+    vectors = vectors / np.where(lengths > 0, lengths, 1.0)[:, None]
+    codes, scales = quantize(vectors, dtype)
+    if scales is None:
+        scales = np.ones(len(codes), dtype="<f4")
+    return codes, scales, norms
+
+
+def convert(db_path: str, dtype: str, dim: Optional[int] = None, batch: int = 4096) -> Dict[str, Any]:
+    """Rewrite the `embeddings_quantized` table and its `index_meta` entries."""
+    if dtype not in DTYPES:
+        raise ValueError(f"dtype must be one of {', '.join(DTYPES)}")
+    started = time.time()
+    conn = sqlite3.connect(db_path)
+    try:
+        row = conn.execute("SELECT embedding FROM embeddings WHERE embedding IS NOT NULL LIMIT 1").fetchone()
+        if row is None:
+            raise ValueError("no embeddings to convert")
+        source_dim = len(row[0]) // 8
+        if dim is not None and not 0 < dim <= source_dim:
+            raise ValueError(f"dim must be between 1 and {source_dim}")
+        dim = dim if dim and dim < source_dim else None
+        fingerprint = db_fingerprint(conn)
+
+        conn.execute("CREATE TABLE IF NOT EXISTS index_meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        conn.execute(
+            f"CREATE TABLE {TABLE} (chunk_id INTEGER PRIMARY KEY, vector BLOB NOT NULL, "
+            "scale REAL NOT NULL, norm REAL NOT NULL)"
+        )
+        rows = skipped = 0
+        cur = conn.execute("SELECT chunk_id, embedding FROM embeddings WHERE embedding IS NOT NULL ORDER BY chunk_id")
+        while True:
+            fetched = cur.fetchmany(batch)
+            if not fetched:
+                break
+            good = [(cid, blob) for cid, blob in fetched if blob and len(blob) == source_dim * 8]
+            skipped += len(fetched) - len(good)
+            if not good:
+                continue
+            full = np.frombuffer(b"".join(b for _, b in good), dtype="<f8").reshape(len(good), source_dim)
+            codes, scales, norms = encode_rows(full, dtype, dim)
+            conn.executemany(
+                f"INSERT INTO {TABLE} (chunk_id, vector, scale, norm) VALUES (?, ?, ?, ?)",
+                [(cid, codes[i].tobytes(), float(scales[i]), float(norms[i])) for i, (cid, _) in enumerate(good)],
+            )
+            rows += len(good)
+        info = {
+            "dtype": dtype,
+            "dim": dim or source_dim,
+            "source_dim": source_dim,
+            "rows": rows,
+            "skipped": skipped,
+            "source": fingerprint,
+        }
+        conn.execute("INSERT OR REPLACE INTO index_meta (key, value) VALUES ('quantized', ?)", (json.dumps(info),))
+        conn.commit()
+    finally:
+        conn.close()
+    info["seconds"] = round(time.time() - started, 2)
+    return info
+
+
+def evaluate(db_path: str, queries: int = 200, k: int = 10, rescore: int = DEFAULT_RESCORE,
+             noise: float = 0.05, seed: int = 0) -> Dict[str, Any]:
+    """Recall@k of the quantized scan (with and without rescoring) against exact
+    float64 search, using perturbed stored vectors as queries."""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        info = json.loads(conn.execute("SELECT value FROM index_meta WHERE key = 'quantized'").fetchone()[0])
+        ids, full_blobs, codes_blobs, scales = [], [], [], []
+        for cid, blob, code, scale in conn.execute(
+            f"SELECT e.chunk_id, e.embedding, q.vector, q.scale FROM embeddings e "
+            f"JOIN {TABLE} q ON q.chunk_id = e.chunk_id ORDER BY e.chunk_id"
+        ):
+            ids.append(cid)
+            full_blobs.append(blob)
+            codes_blobs.append(code)
+            scales.append(scale)
+    finally:
+        conn.close()
+    n = len(ids)
+    full = np.frombuffer(b"".join(full_blobs), dtype="<f8").reshape(n, info["source_dim"])
+    norms = np.linalg.norm(full, axis=1)
+    full = full / np.where(norms > 0, norms, 1.0)[:, None]
+    codes = np.frombuffer(b"".join(codes_blobs), dtype=DTYPES[info["dtype"]]).reshape(n, info["dim"])
+    scales_arr = np.asarray(scales, dtype=np.float32)
+
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(n, size=min(queries, n), replace=False)
+    q = full[picks] + rng.normal(0, noise / np.sqrt(info["source_dim"]), size=(len(picks), info["source_dim"]))
+    q /= np.linalg.norm(q, axis=1, keepdims=True)
+    truth = top_k_indices(q @ full.T, k)
+
+    q_scan = q[:, :info["dim"]].astype(np.float32)
+    q_scan /= np.linalg.norm(q_scan, axis=1, keepdims=True)
+    approx = (q_scan @ codes.astype(np.float32).T) * scales_arr
+    plain = top_k_indices(approx, k)
+    cand = top_k_indices(approx, k * rescore)
+    exact = np.einsum("qd,qcd->qc", q, full[cand])
+    rescored = np.take_along_axis(cand, top_k_indices(exact, k), axis=1)
+
+    def recall(found: np.ndarray) -> float:
+        return round(float(np.mean([len(set(a) & set(b)) / k for a, b in zip(found, truth)])), 4)
+
+    bytes_per_row = codes.itemsize * info["dim"] + 8
+    return {
+        "queries": len(picks),
+        "k": k,
+        "recall_scan": recall(plain),
+        "recall_rescored": recall(rescored),
+        "bytes_per_vector": bytes_per_row,
+        "float64_bytes_per_vector": info["source_dim"] * 8,
+    }
+
+
+class QuantizedIndex:
+    """Search over the `embeddings_quantized` table of a `rag_vectors.db` file.
+
+    `ready()` is False (and callers should use the exact `VectorIndex`) when
+    the table is missing or was built from different embeddings. Search
+    results have the same shape as `VectorIndex.search`.
+    """
+
+    def __init__(self, db_path: str, rescore: int = DEFAULT_RESCORE):
+        self.db_path = db_path
+        self.rescore = rescore
+        self.info: Dict[str, Any] = {}
+        self.fresh = False
+        self.books: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}  # book -> (ids, codes, scales)
+        self._buffer = None
+        self._mtime: Optional[float] = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @classmethod
+    def from_env(cls, db_path: str) -> "QuantizedIndex":
+        return cls(db_path, rescore=int(os.getenv("QUANTIZED_RESCORE", str(DEFAULT_RESCORE))))
+
+    def ready(self) -> bool:
+        if not os.path.exists(self.db_path):
+            return False
+        mtime = os.path.getmtime(self.db_path)
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    try:
+                        self._load()
+                    except (OSError, ValueError, sqlite3.Error) as e:
+                        logger.warning("[quantized_index] cannot use %s: %s", self.db_path, e)
+                        self.fresh = False
+                    self._mtime = mtime
+        return self.fresh
+
+    def _load(self) -> None:
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        try:
+            has_table = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (TABLE,)
+            ).fetchone()
+            meta = conn.execute(
+                "SELECT value FROM index_meta WHERE key = 'quantized'"
+            ).fetchone() if has_table else None
+            if meta is None:
+                self.fresh, self.books, self._buffer = False, {}, None
+                return
+            info = json.loads(meta[0])
+            current = db_fingerprint(conn)
+            if current != info.get("source"):
+                logger.warning(
+                    "[quantized_index] %s was built from %s but the embeddings now are %s; "
+                    "using float64 search until it is converted again", TABLE, info.get("source"), current,
+                )
+                self.fresh, self.books, self._buffer = False, {}, None
+                return
+            dtype = np.dtype(DTYPES[info["dtype"]])
+            grouped: Dict[str, Dict[str, list]] = {}
+            for cid, book, blob, scale in conn.execute(
+                f"SELECT q.chunk_id, c.book, q.vector, q.scale FROM {TABLE} q "
+                "JOIN chunks c ON c.id = q.chunk_id ORDER BY c.book, q.chunk_id"
+            ):
+                g = grouped.setdefault(book or "", {"ids": [], "blobs": [], "scales": []})
+                g["ids"].append(cid)
+                g["blobs"].append(blob)
+                g["scales"].append(scale)
+        finally:
+            conn.close()
+
+        codes = {
+            book: np.frombuffer(b"".join(g["blobs"]), dtype=dtype).reshape(len(g["ids"]), info["dim"])
+            for book, g in grouped.items()
+        }
+        buffer, codes = shared_matrices(codes)
+        self.books = {
+            book: (np.asarray(g["ids"], dtype=np.int64), codes[book], np.asarray(g["scales"], dtype=np.float32))
+            for book, g in grouped.items()
+        }
+        self._buffer = buffer
+        self.info = info
+        self.fresh = True
+        logger.info(
+            "[quantized_index] loaded %s: dtype=%s dim=%d/%d rows=%d books=%d bytes=%d",
+            self.db_path, info["dtype"], info["dim"], info["source_dim"],
+            sum(len(b[0]) for b in self.books.values()), len(self.books), len(buffer) if buffer else 0,
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "db_path": self.db_path,
+            "ready": self.fresh,
+            "dtype": self.info.get("dtype"),
+            "dim": self.info.get("dim"),
+            "source_dim": self.info.get("source_dim"),
+            "rows": sum(len(b[0]) for b in self.books.values()),
+            "shared_bytes": len(self._buffer) if self._buffer is not None else 0,
+            "rescore": self.rescore,
+        }
+
+    def _rows_db(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _scan(q: np.ndarray, codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+        # Codes are widened to float32 a block at a time, never as a whole.
+        step = max(1024, SCAN_BLOCK_BYTES // max(1, codes.shape[1] * 4))
+        out = np.empty((q.shape[0], codes.shape[0]), dtype=np.float32)
+        for start in range(0, codes.shape[0], step):
+            block = codes[start:start + step].astype(np.float32)
+            out[:, start:start + step] = (q @ block.T) * scales[start:start + step]
+        return out
+
+    def search(self, queries: Sequence[Sequence[float]], k: int = 5, books: Optional[Sequence[str]] = None,
+               ids: Optional[Sequence[int]] = None) -> List[List[Dict[str, Any]]]:
+        """Cosine top-k for a batch of query vectors (see `VectorIndex.search`).
+
+        Full-length queries are truncated for the scan and the best
+        `rescore * k` candidates are re-ranked at full precision; queries
+        already of the reduced length are answered from the scan alone.
+        """
+        q = np.asarray(queries, dtype=np.float32)
+        if q.ndim == 1:
+            q = q[None, :]
+        dim, source_dim = self.info["dim"], self.info["source_dim"]
+        if q.shape[1] not in (dim, source_dim):
+            raise ValueError(f"Query dimension {q.shape[1]} does not match index dimension {source_dim}")
+        full_q = q if q.shape[1] == source_dim else None
+        q_scan = q[:, :dim]
+        q_norms = np.linalg.norm(q_scan, axis=1, keepdims=True)
+        q_scan = q_scan / np.where(q_norms > 0, q_norms, 1.0)
+
+        targets = [self.books[b] for b in books if b in self.books] if books else list(self.books.values())
+        if not targets:
+            return [[] for _ in range(q.shape[0])]
+        want = k * self.rescore if full_q is not None and self.rescore > 1 else k
+
+        wanted = None if ids is None else np.asarray(ids, dtype=np.int64)
+        cand_scores, cand_ids = [], []
+        for book_ids, codes, scales in targets:
+            if wanted is not None:
+                rows = np.flatnonzero(np.isin(book_ids, wanted))
+                if not len(rows):
+                    continue
+                book_ids, codes, scales = book_ids[rows], codes[rows], scales[rows]
+            scores = self._scan(q_scan, codes, scales)
+            idx = top_k_indices(scores, want)
+            cand_scores.append(np.take_along_axis(scores, idx, axis=1))
+            cand_ids.append(book_ids[idx])
+        if not cand_scores:
+            return [[] for _ in range(q.shape[0])]
+        merged = np.concatenate(cand_scores, axis=1)
+        merged_ids = np.concatenate(cand_ids, axis=1)
+        best = top_k_indices(merged, want)
+        picked = [
+            [(int(merged_ids[qi, c]), float(merged[qi, c])) for c in best[qi]]
+            for qi in range(q.shape[0])
+        ]
+        return self._hydrate(picked, full_q, k)
+
+    def _hydrate(self, picked: List[List[Tuple[int, float]]], full_q: Optional[np.ndarray], k: int) -> List[List[Dict[str, Any]]]:
+        wanted = sorted({cid for hits in picked for cid, _ in hits})
+        meta: Dict[int, Dict[str, Any]] = {}
+        full: Dict[int, Tuple[bytes, float]] = {}
+        conn = self._rows_db()
+        for i in range(0, len(wanted), 500):
+            part = wanted[i:i + 500]
+            marks = ",".join("?" * len(part))
+            if full_q is None:
+                rows = conn.execute(
+                    f"SELECT id, book, start_page, end_page, text, NULL, NULL FROM chunks WHERE id IN ({marks})", part
+                )
+            else:
+                rows = conn.execute(
+                    f"SELECT c.id, c.book, c.start_page, c.end_page, c.text, e.embedding, q.norm FROM chunks c "
+                    f"JOIN embeddings e ON e.chunk_id = c.id JOIN {TABLE} q ON q.chunk_id = c.id "
+                    f"WHERE c.id IN ({marks})", part
+                )
+            for cid, book, start_page, end_page, text, blob, norm in rows:
+                meta[cid] = {"id": cid, "book": book, "start_page": start_page, "end_page": end_page, "text": text}
+                if blob is not None:
+                    full[cid] = (blob, norm)
+
+        results = []
+        for qi, hits in enumerate(picked):
+            hits = [(cid, score) for cid, score in hits if cid in meta]
+            if full_q is not None and hits:
+                q = full_q[qi].astype(np.float64)
+                q_norm = float(np.linalg.norm(q)) or 1.0
+                rescored = []
+                for cid, score in hits:
+                    if cid in full:
+                        blob, norm = full[cid]
+                        score = float(np.frombuffer(blob, dtype="<f8") @ q) / ((norm or 1.0) * q_norm)
+                    rescored.append((cid, score))
+                hits = sorted(rescored, key=lambda h: -h[1])
+            results.append([dict(meta[cid], score=score) for cid, score in hits[:k]])
+        return results
+
+
+def main():
+    p = argparse.ArgumentParser(description="Add a quantized embeddings table to a rag_vectors.db file")
+    p.add_argument("--db", default="rag_vectors.db", help="SQLite DB (chunks + embeddings), converted in place")
+    p.add_argument("--dtype", default="int8", choices=sorted(DTYPES), help="Storage type (default int8)")
+    p.add_argument("--dim", type=int, default=None, help="Keep only the first N dimensions (text-embedding-3 models)")
+    p.add_argument("--evaluate", type=int, default=0, metavar="N",
+                   help="Report recall@10 against float64 search over N sample queries")
+    p.add_argument("--rescore", type=int, default=DEFAULT_RESCORE, help="Candidates per hit re-ranked at full precision")
+    args = p.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"ERROR: database not found: {args.db}", file=sys.stderr)
+        sys.exit(2)
+    try:
+        info = convert(args.db, args.dtype, dim=args.dim)
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(3)
+    print(f"✓ {args.db}: rows={info['rows']} dtype={info['dtype']} dim={info['dim']}/{info['source_dim']} "
+          f"skipped={info['skipped']} in {info['seconds']}s")
+    if args.evaluate:
+        ev = evaluate(args.db, queries=args.evaluate, rescore=args.rescore)
+        print(f"  {ev['bytes_per_vector']} bytes/vector vs {ev['float64_bytes_per_vector']} float64 "
+              f"({ev['float64_bytes_per_vector'] / ev['bytes_per_vector']:.1f}x smaller)")
+        print(f"  recall@{ev['k']} over {ev['queries']} queries: scan={ev['recall_scan']} "
+              f"rescored(x{args.rescore})={ev['recall_rescored']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# Per-user rate limiting with O(1) work and bounded memory per request.
+#
+# Each limit (e.g. 60/minute, 1000/hour) is tracked with a sliding-window
+# counter: the count for the current fixed window plus the previous window's
+# count weighted by how much of it still overlaps the sliding window. That is
+# three integers per user per limit instead of a list of timestamps.
+#
+# State lives in a pluggable store: in-process (per worker) or a SQLite file
+# that every gunicorn worker on the host shares, so limits are not multiplied
+# by the number of workers. Point RATE_LIMIT_DB at /dev/shm to keep it in RAM.
+
+import os
+import time
+import sqlite3
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# (window index, count in current window, count in previous window)
+WindowState = Tuple[int, int, int]
+
+
+def advance(state: Optional[WindowState], now: float, window: int) -> WindowState:
+    """Roll a window's state forward to the window containing `now`."""
+    idx = int(now // window)
+    if state is None:
+        return (idx, 0, 0)
+    prev_idx, curr, prev = state
+    if idx == prev_idx:
+        return state
+    if idx == prev_idx + 1:
+        return (idx, 0, curr)
+    return (idx, 0, 0)
+
+
+def estimate(state: WindowState, now: float, window: int) -> float:
+    """Approximate number of requests in the sliding window ending at `now`."""
+    idx, curr, prev = state
+    elapsed = (now - idx * window) / window
+    return prev * (1.0 - elapsed) + curr
+
+
+def decide(states: Sequence[Optional[WindowState]], limits: Sequence[Tuple[int, int]], now: float) -> Tuple[bool, List[WindowState]]:
+    """Apply one request to the per-limit states.
+
+    Returns whether it is allowed and the new states. A rejected request is
+    not counted, matching the behaviour of the original list-based limiter.
+    """
+    rolled = [advance(s, now, window) for s, (window, _) in zip(states, limits)]
+    allowed = all(estimate(s, now, window) < limit for s, (window, limit) in zip(rolled, limits))
+    if allowed:
+        rolled = [(idx, curr + 1, prev) for idx, curr, prev in rolled]
+    return allowed, rolled
+
+
+class MemoryRateLimitStore:
+    """In-process store. Users idle for longer than the largest window are evicted."""
+
+    # A check is a dict update under a lock: cheap enough for the event loop.
+    blocking = False
+
+    def __init__(self, max_users: int = 100_000):
+        self.max_users = max_users
+        # user -> (last seen, [state per limit]), least recently seen first
+        self._users: "OrderedDict[str, Tuple[float, List[WindowState]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, user_id: str, limits: Sequence[Tuple[int, int]], now: float) -> bool:
+        horizon = max(window for window, _ in limits) * 2
+        with self._lock:
+            entry = self._users.pop(user_id, None)
+            states = entry[1] if entry else [None] * len(limits)
+            allowed, new_states = decide(states, limits, now)
+            self._users[user_id] = (now, new_states)
+            # Oldest entries are at the front; evicting them is amortised O(1).
+            while self._users:
+                oldest_user, (seen, _) = next(iter(self._users.items()))
+                if now - seen <= horizon and len(self._users) <= self.max_users:
+                    break
+                del self._users[oldest_user]
+            return allowed
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+
+class SQLiteRateLimitStore:
+    """Store shared by all processes on a host through one SQLite file.
+
+    Each check is a single short write transaction on one row, but it can wait
+    up to the busy timeout for other workers, so callers on an event loop run
+    it in a thread (see `blocking`).
+    """
+
+    blocking = True
+
+    def __init__(self, db_path: str, cleanup_every: int = 1000):
+        self.db_path = db_path
+        self.cleanup_every = cleanup_every
+        self._local = threading.local()
+        self._calls = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limits ("
+                "user_id TEXT PRIMARY KEY, last_seen REAL NOT NULL, state TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS rate_limits_last_seen ON rate_limits(last_seen)")
+            self._local.conn = conn
+        return conn
+
+    def hit(self, user_id: str, limits: Sequence[Tuple[int, int]], now: float) -> bool:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT state FROM rate_limits WHERE user_id = ?", (user_id,)).fetchone()
+            states: List[Optional[WindowState]] = [None] * len(limits)
+            if row:
+                parsed = [tuple(int(v) for v in part.split(":")) for part in row[0].split(",")]
+                if len(parsed) == len(limits):
+                    states = parsed
+            allowed, new_states = decide(states, limits, now)
+            encoded = ",".join(f"{idx}:{curr}:{prev}" for idx, curr, prev in new_states)
+            conn.execute(
+                "INSERT INTO rate_limits (user_id, last_seen, state) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET last_seen = excluded.last_seen, state = excluded.state",
+                (user_id, now, encoded),
+            )
+            self._calls += 1
+            if self._calls % self.cleanup_every == 0:
+                horizon = max(window for window, _ in limits) * 2
+                conn.execute("DELETE FROM rate_limits WHERE last_seen < ?", (now - horizon,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed
+
+
+class RateLimiter:
+    """Checks a set of (window seconds, max requests) limits per user."""
+
+    def __init__(self, limits: Sequence[Tuple[int, int]], store):
+        self.limits = list(limits)
+        self.store = store
+
+    @classmethod
+    def from_env(cls, requests_per_minute: int, requests_per_hour: int) -> "RateLimiter":
+        limits = [(60, requests_per_minute), (3600, requests_per_hour)]
+        backend = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+        if backend == "sqlite":
+            default_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+            db_path = os.getenv("RATE_LIMIT_DB", os.path.join(default_dir, "tasha_rate_limits.db"))
+            return cls(limits, SQLiteRateLimitStore(db_path))
+        return cls(limits, MemoryRateLimitStore(int(os.getenv("RATE_LIMIT_MAX_USERS", "100000"))))
+
+    @property
+    def blocking(self) -> bool:
+        """True when `allow` may block on I/O and should not run on the event loop."""
+        return getattr(self.store, "blocking", True)
+
+    def allow(self, user_id: str, now: Optional[float] = None) -> bool:
+        return self.store.hit(user_id, self.limits, time.time() if now is None else now)
@@ -0,0 +1,94 @@
+# Single-flight coalescing of identical in-flight upstream calls.
+#
+# When many clients send the same request at once (a class opening the app
+# together), only the first caller for a key runs the upstream call; the others
+# await its result. The call runs as its own task, so a leader that disconnects
+# does not cancel the work the other waiters depend on, and an exception
+# reaches every waiter.
+
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def flight_key(endpoint: str, **parts: Any) -> str:
+    """Canonical hash of (endpoint, params, payload); key order does not matter."""
+    blob = json.dumps([endpoint, parts], sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return f"{endpoint}:{hashlib.sha256(blob.encode('utf-8')).hexdigest()}"
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into one.
+
+    Keeps per-key counters (calls, coalesced waiters, errors) for the
+    `max_tracked_keys` most recently used keys, plus per-endpoint totals.
+    Must be used from a single event loop.
+    """
+
+    def __init__(self, max_tracked_keys: int = 1024):
+        self.max_tracked_keys = max_tracked_keys
+        self._inflight: Dict[str, "asyncio.Task[Any]"] = {}
+        self._keys: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._totals: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, key: str, field: str) -> None:
+        endpoint = key.split(":", 1)[0]
+        stats = self._keys.get(key)
+        if stats is None:
+            stats = {"endpoint": endpoint, "calls": 0, "coalesced": 0, "errors": 0, "last_seen": 0.0}
+            self._keys[key] = stats
+            while len(self._keys) > self.max_tracked_keys:
+                self._keys.popitem(last=False)
+        self._keys.move_to_end(key)
+        stats[field] += 1
+        stats["last_seen"] = time.time()
+        totals = self._totals.setdefault(endpoint, {"calls": 0, "coalesced": 0, "errors": 0})
+        totals[field] += 1
+
+    def _finished(self, key: str, task: "asyncio.Task[Any]") -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if task.cancelled():
+            return
+        # Reading the exception also keeps asyncio from warning when every waiter is gone.
+        if task.exception() is not None:
+            self._count(key, "errors")
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """Run `fn()` once per key among concurrent callers.
+
+        Returns (result, shared): `shared` is True when this caller awaited a call
+        started by another. Every caller receives the same result object, so
+        callers that mutate it must copy it first.
+        """
+        task = self._inflight.get(key)
+        shared = task is not None
+        if shared:
+            self._count(key, "coalesced")
+        else:
+            self._count(key, "calls")
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, key=key: self._finished(key, t))
+        # shield: a waiter that is cancelled leaves the shared call running.
+        return await asyncio.shield(task), shared
+
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    def stats(self, top: Optional[int] = 20) -> Dict[str, Any]:
+        """Per-endpoint totals and the keys with the most coalesced waiters."""
+        keys = sorted(self._keys.items(), key=lambda kv: kv[1]["coalesced"], reverse=True)
+        return {
+            "inflight": len(self._inflight),
+            "endpoints": {name: dict(totals) for name, totals in self._totals.items()},
+            "keys": [dict(stats, key=key) for key, stats in keys[:top]],
+        }
@@ -0,0 +1,98 @@
+# Helpers for streaming RAG answers as Server-Sent Events.
+#
+# The RAG prompt asks the model for a JSON object ({"answer": ..., "citations":
+# ..., "confidence": ...}). While streaming we only want to forward the human
+# readable `answer` text, so AnswerStreamExtractor pulls that string value out
+# of the partial JSON as tokens arrive. The full reply is still parsed at the
+# end for citations and confidence.
+
+import json
+from typing import Any, Dict
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+class AnswerStreamExtractor:
+    """Incrementally decode the `"answer"` string of a streamed JSON reply.
+
+    feed() returns the newly decoded answer text for each delta. If the model
+    does not reply with a JSON object at all, deltas are passed through as-is.
+    """
+
+    def __init__(self, key: str = "answer"):
+        self._marker = f'"{key}"'
+        self._buf = ""
+        self._pos = 0
+        self._state = "detect"  # detect -> seek -> value -> done, or raw
+        self._escape = ""
+
+    def feed(self, delta: str) -> str:
+        if not delta:
+            return ""
+        if self._state == "raw":
+            return delta
+        self._buf += delta
+        if self._state == "detect":
+            stripped = self._buf.lstrip()
+            if not stripped:
+                return ""
+            # Models sometimes wrap JSON in a ```json fence; treat that as JSON too.
+            if stripped[0] not in "{`":
+                self._state = "raw"
+                return self._buf
+            self._state = "seek"
+        if self._state == "seek":
+            idx = self._buf.find(self._marker, self._pos)
+            if idx < 0:
+                self._pos = max(self._pos, len(self._buf) - len(self._marker))
+                return ""
+            j = idx + len(self._marker)
+            while j < len(self._buf) and self._buf[j] in " \t\r\n:":
+                j += 1
+            if j >= len(self._buf):
+                return ""
+            if self._buf[j] != '"':
+                # Not a string value; nothing to stream.
+                self._state = "done"
+                return ""
+            self._pos = j + 1
+            self._state = "value"
+        if self._state == "value":
+            return self._decode()
+        return ""
+
+    def _decode(self) -> str:
+        out = []
+        i = self._pos
+        buf = self._buf
+        while i < len(buf):
+            ch = buf[i]
+            if self._escape:
+                self._escape += ch
+                if self._escape.startswith("\\u"):
+                    if len(self._escape) < 6:
+                        i += 1
+                        continue
+                    try:
+                        out.append(chr(int(self._escape[2:], 16)))
+                    except ValueError:
+                        pass
+                else:
+                    out.append(_ESCAPES.get(ch, ch))
+                self._escape = ""
+            elif ch == "\\":
+                self._escape = "\\"
+            elif ch == '"':
+                self._state = "done"
+                i += 1
+                break
+            else:
+                out.append(ch)
+            i += 1
+        self._pos = i
+        return "".join(out)
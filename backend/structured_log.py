@@ -0,0 +1,111 @@
+# Queue-backed structured logging.
+#
+# Handlers that write to the console can block the event loop when stdout is a
+# slow pipe. Here every logging call only puts the record on a bounded queue;
+# a listener thread formats and writes it. When the queue is full the record is
+# dropped and counted rather than blocking the request.
+#
+# Fields passed with `log_event` are rendered as key=value pairs (LOG_FORMAT=text)
+# or as JSON object members (LOG_FORMAT=json).
+
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+
+class StructuredFormatter(logging.Formatter):
+    def __init__(self, fmt: str = "text"):
+        super().__init__()
+        self.json = fmt == "json"
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, "fields", None) or {}
+        ts = datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds")
+        message = record.getMessage()
+        if self.json:
+            out = {"ts": ts, "level": record.levelname, "logger": record.name, "msg": message, **fields}
+            if record.exc_info:
+                out["exc"] = self.formatException(record.exc_info)
+            return json.dumps(out, ensure_ascii=False, default=str)
+        line = f"{ts} {record.levelname} {record.name} {message}"
+        if fields:
+            line += " " + " ".join(f"{k}={json.dumps(v, ensure_ascii=False, default=str)}" for k, v in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks: records that do not fit are dropped."""
+
+    def __init__(self, q: "queue.Queue[logging.LogRecord]"):
+        super().__init__(q)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_handler: Optional[DroppingQueueHandler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging(level: str = "INFO", fmt: str = "text", queue_size: int = 10000) -> DroppingQueueHandler:
+    """Route the root logger through a bounded queue to a background writer."""
+    global _handler, _listener
+    if _handler is not None:
+        return _handler
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(StructuredFormatter(fmt))
+    q: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=queue_size)
+    handler = DroppingQueueHandler(q)
+    listener = logging.handlers.QueueListener(q, stream, respect_handler_level=False)
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+    listener.start()
+    atexit.register(listener.stop)  # flush what is queued on exit
+    _handler, _listener = handler, listener
+    if hasattr(os, "register_at_fork"):
+        # Threads do not survive fork(): a gunicorn worker forked from a
+        # --preload master needs its own queue and writer thread.
+        os.register_at_fork(after_in_child=lambda: _restart_listener(handler, stream, queue_size))
+    return handler
+
+
+def _restart_listener(handler: DroppingQueueHandler, stream: logging.Handler, queue_size: int) -> None:
+    global _listener
+    # The inherited listener has no thread here; its queue holds the parent's records.
+    atexit.unregister(_listener.stop)
+    q: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=queue_size)
+    handler.queue = q
+    _listener = logging.handlers.QueueListener(q, stream, respect_handler_level=False)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def dropped_records() -> int:
+    return _handler.dropped if _handler is not None else 0
+
+
+def log_event(logger: logging.Logger, event: str, level: int = logging.INFO, **fields: Any) -> None:
+    """Log `event` with structured `fields` (skipped cheaply when the level is off)."""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"fields": fields})
+
+
+def sampled(rate: float) -> bool:
+    """True for about `rate` of calls; used to log bulky details for a sample of requests."""
+    return rate >= 1.0 or (rate > 0.0 and random.random() < rate)
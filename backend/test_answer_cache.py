@@ -0,0 +1,66 @@
+"""
+Tests for answer_cache: scoping, exact vs. semantic matching and the disk tier.
+
+  python -m pytest -q backend/test_answer_cache.py
+"""
+
+import os
+import sys
+
+import pytest
+
+try:
+    from .answer_cache import AnswerCache, answer_scope
+except ImportError:
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from answer_cache import AnswerCache, answer_scope
+
+CHUNKS = [
+    {"book": "edliz", "start_page": 10, "end_page": 10, "text": "Amoxicillin 500 mg three times daily."},
+    {"book": "edliz", "start_page": 11, "end_page": 11, "text": "Children: 25 mg/kg/day in three doses."},
+]
+ANSWER = {"answer": "500 mg three times daily", "citations": [], "confidence": 0.9}
+
+
+def scope(caller="user:u1", chunks=CHUNKS, model="gpt-4o-mini"):
+    return answer_scope(model, None, 0.2, 512, chunks, caller)
+
+
+def test_scope_ignores_chunk_order_but_not_caller_or_settings():
+    assert scope(chunks=CHUNKS) == scope(chunks=list(reversed(CHUNKS)))
+    assert scope(caller="user:u1") != scope(caller="user:u2")
+    assert scope(caller="key:a") != scope(caller="key:b")
+    assert scope(model="gpt-4o-mini") != scope(model="gpt-4o")
+    assert scope(chunks=CHUNKS) != scope(chunks=CHUNKS[:1])
+
+
+def test_exact_match_only_by_default():
+    cache = AnswerCache(None)
+    cache.put(scope(), "q-adult", [1.0, 0.0], ANSWER)
+    assert cache.lookup(scope(), "q-adult") == (ANSWER, 1.0)
+    # A near-identical question ("child" instead of "adult") must not reuse it.
+    assert cache.lookup(scope(), "q-child", [0.999, 0.04]) is None
+    assert cache.lookup(scope(caller="user:u2"), "q-adult") is None
+
+
+def test_semantic_matching_is_opt_in_and_thresholded():
+    cache = AnswerCache(None, semantic=True, threshold=0.95)
+    cache.put(scope(), "q1", [1.0, 0.0], ANSWER)
+    payload, similarity = cache.lookup(scope(), "q2", [0.99, 0.1])
+    assert payload == ANSWER and similarity == pytest.approx(0.995, abs=1e-3)
+    assert cache.lookup(scope(), "q3", [0.8, 0.6]) is None
+    assert cache.lookup(scope(caller="user:u2"), "q2", [0.99, 0.1]) is None
+
+
+def test_expired_entries_do_not_hit():
+    cache = AnswerCache(None, ttl_seconds=-1)
+    cache.put(scope(), "q1", None, ANSWER)
+    assert cache.lookup(scope(), "q1") is None
+
+
+def test_disk_tier_is_shared_between_instances(tmp_path):
+    db = str(tmp_path / "answer_cache.db")
+    AnswerCache(db).put(scope(), "q1", [1.0, 0.0], ANSWER)
+    other = AnswerCache(db)  # another worker, or after a restart
+    assert other.lookup(scope(), "q1") == (ANSWER, 1.0)
+    assert other.lookup(scope(caller="user:u2"), "q1") is None
@@ -0,0 +1,84 @@
+"""
+Tests for context_packing: budgets, deduplication, MMR order and the candidate cap.
+
+  python -m pytest -q backend/test_context_packing.py
+"""
+
+import os
+import sys
+
+try:
+    from .context_packing import (
+        EXCERPT_OVERHEAD_TOKENS, budget_for_request, context_budget, estimate_tokens, pack_chunks,
+    )
+except ImportError:
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from context_packing import (
+        EXCERPT_OVERHEAD_TOKENS, budget_for_request, context_budget, estimate_tokens, pack_chunks,
+    )
+
+MALARIA = "Malaria is treated with artemether lumefantrine for six doses over three days in adults."
+DENGUE = "Dengue fever is managed with fluids and paracetamol; avoid aspirin and ibuprofen entirely."
+TB = "Tuberculosis needs rifampicin isoniazid pyrazinamide and ethambutol for two months initially."
+
+
+def _chunk(text, page, score=None):
+    c = {"book": "edliz", "start_page": page, "end_page": page, "text": text}
+    if score is not None:
+        c["score"] = score
+    return c
+
+
+def test_duplicates_dropped_keeping_the_most_relevant_copy():
+    chunks = [_chunk(MALARIA, 1, 0.2), _chunk(DENGUE, 2, 0.5), _chunk(MALARIA, 3, 0.9)]
+    packed, stats = pack_chunks("malaria treatment", chunks, budget=10_000)
+    assert [c["start_page"] for c in packed] == [3, 2]
+    assert stats["dropped_redundant"] == 1
+
+
+def test_budget_is_respected_and_counted():
+    chunks = [_chunk(MALARIA, 1, 0.9), _chunk(DENGUE, 2, 0.8), _chunk(TB, 3, 0.7)]
+    per_chunk = estimate_tokens(MALARIA) + EXCERPT_OVERHEAD_TOKENS
+    packed, stats = pack_chunks("q", chunks, budget=2 * per_chunk + 1)
+    assert len(packed) == 2 and stats["dropped_budget"] == 1
+    assert stats["packed_tokens"] <= stats["budget"]
+
+
+def test_best_chunk_is_truncated_rather_than_returning_nothing():
+    packed, stats = pack_chunks("malaria", [_chunk(MALARIA * 20, 1)], budget=EXCERPT_OVERHEAD_TOKENS + 5)
+    assert len(packed) == 1 and stats["truncated"] == 1
+    assert len(packed[0]["text"]) == 5 * 4
+
+
+def test_mmr_prefers_a_different_chunk_over_a_near_duplicate():
+    near_dup = MALARIA.replace("adults", "grown adults over sixteen")
+    chunks = [_chunk(MALARIA, 1, 1.0), _chunk(near_dup, 2, 0.95), _chunk(TB, 3, 0.9)]
+    packed, _ = pack_chunks("q", chunks, budget=10_000, diversity=0.5, overlap_threshold=0.99)
+    assert [c["start_page"] for c in packed][:2] == [1, 3]
+
+
+def test_relevance_falls_back_to_question_overlap():
+    chunks = [_chunk(DENGUE, 1), _chunk(TB, 2), _chunk(MALARIA, 3)]
+    packed, _ = pack_chunks("How is malaria treated in adults?", chunks, budget=10_000)
+    assert packed[0]["start_page"] == 3
+
+
+def test_candidates_are_capped_by_relevance():
+    chunks = [_chunk(f"{MALARIA} variant {i} " + "word " * i, i, score=i) for i in range(200)]
+    packed, stats = pack_chunks("q", chunks, budget=100_000, overlap_threshold=1.01, max_candidates=10)
+    assert stats["dropped_candidates"] == 190
+    assert sorted(c["start_page"] for c in packed) == list(range(190, 200))
+
+
+def test_empty_chunks_are_skipped():
+    packed, stats = pack_chunks("q", [_chunk("   ", 1), _chunk(TB, 2)], budget=10_000)
+    assert [c["start_page"] for c in packed] == [2]
+    assert stats["packed_chunks"] == 1
+
+
+def test_budgets_by_model_prefix_and_request():
+    assert context_budget("gpt-4o-mini-2024-07-18") == 6000
+    assert context_budget("gpt-3.5-turbo") == 3000
+    assert context_budget("some-other-model", default=1234) == 1234
+    assert budget_for_request("gpt-4o", 500) == 500
+    assert budget_for_request("gpt-4o", None) == 6000
@@ -0,0 +1,136 @@
+"""
+Tests for embed_batcher: merging, splitting, error fan-out and shutdown.
+
+  python -m pytest -q backend/test_embed_batcher.py
+"""
+
+import os
+import gc
+import sys
+import asyncio
+
+import pytest
+
+try:
+    from .embed_batcher import EmbedBatcher
+except ImportError:
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from embed_batcher import EmbedBatcher
+
+
+class FakeUpstream:
+    """Embeds each text as [len(text)] and records the texts of every call."""
+
+    def __init__(self, error: Exception = None):
+        self.calls = []
+        self.error = error
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def __call__(self, texts, model, api_key):
+        self.calls.append(list(texts))
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return [[float(len(t))] for t in texts]
+
+
+def test_concurrent_requests_share_one_call():
+    async def scenario():
+        upstream = FakeUpstream()
+        batcher = EmbedBatcher(upstream, window_ms=20)
+        results = await asyncio.gather(
+            batcher.embed(["a", "bb"], "m"),
+            batcher.embed(["bb", "ccc"], "m"),
+        )
+        return upstream.calls, results, batcher.stats()
+
+    calls, results, stats = asyncio.run(scenario())
+    assert calls == [["a", "bb", "ccc"]]  # duplicates are sent once
+    assert results == [[[1.0], [2.0]], [[2.0], [3.0]]]
+    assert stats["batches"] == 1 and stats["requests_per_batch"] == 2.0
+
+
+def test_batches_split_at_caps_and_never_split_a_request():
+    async def scenario():
+        upstream = FakeUpstream()
+        batcher = EmbedBatcher(upstream, window_ms=20, max_texts=3)
+        await asyncio.gather(
+            batcher.embed(["a", "b"], "m"),
+            batcher.embed(["c", "d"], "m"),  # would exceed 3 texts: starts a new batch
+            batcher.embed(["e", "f", "g"], "m"),  # at the cap on its own: sent directly
+            batcher.embed(["h"], "other-model"),  # different model: its own batch
+        )
+        return upstream.calls, batcher.stats()
+
+    calls, stats = asyncio.run(scenario())
+    assert sorted(calls) == [["a", "b"], ["c", "d"], ["e", "f", "g"], ["h"]]
+    assert stats["direct"] == 1
+
+
+def test_upstream_error_reaches_every_waiter():
+    async def scenario():
+        batcher = EmbedBatcher(FakeUpstream(error=RuntimeError("boom")), window_ms=20)
+        results = await asyncio.gather(
+            batcher.embed(["a"], "m"), batcher.embed(["b"], "m"), return_exceptions=True,
+        )
+        return results, batcher.stats()
+
+    results, stats = asyncio.run(scenario())
+    assert [str(r) for r in results] == ["boom", "boom"]
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert stats["errors"] == 1
+
+
+def test_cancelled_waiter_does_not_cancel_the_batch():
+    async def scenario():
+        upstream = FakeUpstream()
+        upstream.release.clear()
+        batcher = EmbedBatcher(upstream, window_ms=1)
+        first = asyncio.ensure_future(batcher.embed(["a"], "m"))
+        second = asyncio.ensure_future(batcher.embed(["b"], "m"))
+        while not upstream.calls:
+            await asyncio.sleep(0.005)
+        first.cancel()
+        upstream.release.set()
+        return await second
+
+    assert asyncio.run(scenario()) == [[1.0]]
+
+
+def test_batch_in_flight_is_held_and_awaited_on_close():
+    async def scenario():
+        upstream = FakeUpstream()
+        upstream.release.clear()
+        batcher = EmbedBatcher(upstream, window_ms=1)
+        waiter = asyncio.ensure_future(batcher.embed(["a"], "m"))
+        while not upstream.calls:
+            await asyncio.sleep(0.005)
+        gc.collect()
+        assert batcher.stats()["in_flight"] == 1
+
+        # A batch still collecting is sent by aclose rather than dropped.
+        slow = EmbedBatcher(FakeUpstream(), window_ms=60_000)
+        pending = asyncio.ensure_future(slow.embed(["zz"], "m"))
+        await asyncio.sleep(0)
+        await slow.aclose()
+
+        upstream.release.set()
+        await batcher.aclose()
+        return await waiter, await pending, batcher.stats()["in_flight"]
+
+    vectors, pending, in_flight = asyncio.run(scenario())
+    assert vectors == [[1.0]]
+    assert pending == [[2.0]]
+    assert in_flight == 0
+
+
+@pytest.mark.parametrize("window_ms", [0, -1])
+def test_batching_off_calls_directly(window_ms):
+    async def scenario():
+        upstream = FakeUpstream()
+        batcher = EmbedBatcher(upstream, window_ms=window_ms)
+        await asyncio.gather(batcher.embed(["a"], "m"), batcher.embed(["b"], "m"))
+        return upstream.calls
+
+    assert sorted(asyncio.run(scenario())) == [["a"], ["b"]]
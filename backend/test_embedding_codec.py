@@ -0,0 +1,88 @@
+"""
+Tests for embedding_codec: round trips, int8 scale decoding and binary layouts.
+
+  python -m pytest -q backend/test_embedding_codec.py
+"""
+
+import io
+import os
+import sys
+import json
+import base64
+
+import numpy as np
+import pytest
+
+try:
+    from .embedding_codec import FastJSONResponse, binary_response, encode_json, quantize
+except ImportError:
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from embedding_codec import FastJSONResponse, binary_response, encode_json, quantize
+
+
+def _matrix(count=4, dim=16, seed=0):
+    m = np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+    m[1] = 0.0  # an all-zero vector must survive int8 (scale of a zero peak)
+    return m
+
+
+@pytest.mark.parametrize("encoding, atol", [("float64", 0), ("float32", 0), ("float16", 2e-3)])
+def test_float_encodings_round_trip(encoding, atol):
+    m = _matrix()
+    fields = encode_json(m, encoding)
+    dtype = {"float64": "<f8", "float32": "<f4", "float16": "<f2"}[encoding]
+    decoded = np.stack([np.frombuffer(base64.b64decode(row), dtype=dtype) for row in fields["embeddings"]])
+    assert fields["dim"] == m.shape[1] and "scales" not in fields
+    np.testing.assert_allclose(decoded.astype(np.float32), m, atol=atol, rtol=1e-3 if atol else 0)
+
+
+def test_int8_decodes_with_scales():
+    m = _matrix()
+    fields = encode_json(m, "int8")
+    codes = np.stack([np.frombuffer(base64.b64decode(row), dtype="i1") for row in fields["embeddings"]])
+    decoded = codes.astype(np.float32) * np.asarray(fields["scales"], dtype=np.float32)[:, None]
+    # Rounding to the nearest step: off by at most half a step per value.
+    assert (np.abs(decoded - m) <= np.asarray(fields["scales"])[:, None] / 2 + 1e-7).all()
+    assert np.abs(codes).max() == 127
+    assert not decoded[1].any()
+
+
+def test_quantize_int8_scale_is_peak_over_127():
+    m = np.array([[0.5, -1.0, 0.25], [0.0, 0.0, 0.0]], dtype=np.float32)
+    packed, scales = quantize(m, "int8")
+    assert scales.dtype == np.dtype("<f4")
+    np.testing.assert_allclose(scales, [1.0 / 127, 1.0 / 127])
+    assert packed[0].tolist() == [64, -127, 32]
+
+
+def test_octet_stream_int8_puts_scales_in_the_body():
+    m = _matrix(count=3000, dim=8)  # large batches must not grow the headers
+    resp = binary_response(m, "int8", "application/octet-stream", {"X-Cache-Hits": "0"})
+    count, dim = int(resp.headers["x-embedding-count"]), int(resp.headers["x-embedding-dim"])
+    assert resp.headers["x-embedding-layout"] == "scales,values"
+    assert sum(len(k) + len(v) for k, v in resp.headers.items()) < 1024
+    scales = np.frombuffer(resp.body[: count * 4], dtype="<f4")
+    codes = np.frombuffer(resp.body[count * 4:], dtype=resp.headers["x-embedding-dtype"]).reshape(count, dim)
+    assert (np.abs(codes * scales[:, None] - m) <= scales[:, None] / 2 + 1e-7).all()
+
+
+def test_npy_int8_is_two_arrays():
+    m = _matrix()
+    resp = binary_response(m, "int8", "application/x-npy", {})
+    f = io.BytesIO(resp.body)
+    scales, codes = np.load(f), np.load(f)
+    assert scales.shape == (4,) and codes.shape == (4, 16) and codes.dtype == np.int8
+
+
+def test_float_binary_has_values_only():
+    m = _matrix()
+    resp = binary_response(m, "float", "application/octet-stream", {})
+    assert resp.headers["x-embedding-layout"] == "values"
+    np.testing.assert_array_equal(np.frombuffer(resp.body, dtype="<f4").reshape(m.shape), m)
+
+
+def test_fast_json_response_serializes_numpy():
+    m = _matrix(count=2, dim=3)
+    body = json.loads(FastJSONResponse({"embeddings": m, "n": np.int64(2)}).body)
+    assert body["n"] == 2
+    np.testing.assert_allclose(body["embeddings"], m, rtol=1e-6)
@@ -0,0 +1,93 @@
+"""
+In-process smoke test: the backend app with its upstream routed to fake_openai.
+
+No server, network or API key needed:
+  python -m pytest -q backend/test_fake_upstream.py
+
+Every SQLite store points at a temporary directory and the answer cache is
+disabled, so this also covers warm-up with optional stores turned off.
+"""
+
+import os
+import sys
+import random
+import atexit
+import shutil
+import asyncio
+import tempfile
+
+_TMP = tempfile.mkdtemp(prefix="tasha-test-")
+atexit.register(shutil.rmtree, _TMP, ignore_errors=True)
+for _name in ("EMBED_CACHE_DB", "RAG_VECTORS_DB", "CORPUS_DB", "TRAIN_JOBS_DB"):
+    os.environ[_name] = os.path.join(_TMP, _name.lower() + ".db")
+os.environ["ANSWER_CACHE_ENABLED"] = "0"
+os.environ["RATE_LIMIT_BACKEND"] = "memory"
+
+try:
+    from . import main as backend_main
+    from .loadtest import build_request, in_process_client
+except ImportError:
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main as backend_main
+    from loadtest import build_request, in_process_client
+
+HEADERS = {"Authorization": "Bearer test-token"}
+
+
+async def _with_app(check):
+    """Run the app's lifespan (warm-up included) around `check(client)`."""
+    # Route the upstream to the fake before warm-up opens connections to it;
+    # ASGITransport does not send lifespan events, so run them here.
+    client = in_process_client(timeout=30)
+    async with backend_main.app.router.lifespan_context(backend_main.app):
+        async with client:
+            return await check(client)
+
+
+def test_ready_after_warm_up():
+    async def check(client):
+        resp = await client.get("/ready")
+        assert resp.status_code == 200, resp.text
+        steps = resp.json()["steps"]
+        assert steps and all(step["ok"] for step in steps.values()), steps
+
+    asyncio.run(_with_app(check))
+
+
+def test_embeddings():
+    async def check(client):
+        spec = build_request("embeddings", random.Random(0), unique=False)
+        resp = await client.post(spec["path"], json=spec["json"], headers=HEADERS)
+        assert resp.status_code == 200, resp.text
+        body = resp.json()
+        assert body["success"] is True
+        assert len(body["embeddings"]) == 1 and body["embeddings"][0]
+
+    asyncio.run(_with_app(check))
+
+
+def test_rag_answer():
+    async def check(client):
+        spec = build_request("rag_answer", random.Random(1), unique=True)
+        resp = await client.post(spec["path"], json=spec["json"], headers=HEADERS)
+        assert resp.status_code == 200, resp.text
+        body = resp.json()
+        assert body["success"] is True
+        assert body["answer"]
+
+    asyncio.run(_with_app(check))
+
+
+def test_rag_answer_stream():
+    async def check(client):
+        spec = build_request("rag_stream", random.Random(2), unique=True)
+        events = []
+        async with client.stream("POST", spec["path"], json=spec["json"], headers=HEADERS) as resp:
+            assert resp.status_code == 200, await resp.aread()
+            async for line in resp.aiter_lines():
+                if line.startswith("event: "):
+                    events.append(line[len("event: "):])
+        assert "error" not in events, events
+        assert "token" in events, events
+
+    asyncio.run(_with_app(check))
@@ -0,0 +1,148 @@
+"""
+Tests for the indexer's chunking (tools/index_txt_to_sqlite.py): sentence
+overlap between chunks and tagging chunks with their TOC chapter/section.
+
+  python -m pytest -q backend/test_index_chunks.py
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+import index_txt_to_sqlite as indexer  # noqa: E402
+
+TOC = """Table of Contents
+Foreword.                      i
+Acronyms                      ii
+Chapter 1: Fevers              1
+Malaria.......................  1
+Dengue                         2
+Chapter 2: Lungs               3
+Tuberculosis                   3
+"""
+
+
+def _sentences(topic, n=12):
+    return " ".join(f"{topic.capitalize()} sentence {i} is about {topic} care." for i in range(n))
+
+
+def _book():
+    # PDF page 1 is the book's own contents listing and page 2 a foreword, so
+    # printed page 1 is PDF page 3.
+    pages = [
+        "Contents\nChapter 1: Fevers\nMalaria\nDengue\nChapter 2: Lungs\nTuberculosis\n",
+        "Foreword\n" + _sentences("guideline") + "\n",
+        "Chapter 1: Fevers\nMalaria\n" + _sentences("malaria") + "\n",
+        "Dengue\n" + _sentences("dengue") + "\n",
+        "Chapter 2: Lungs\nTuberculosis\n" + _sentences("tb") + "\n",
+    ]
+    return "\f".join(pages)
+
+
+@pytest.fixture
+def book(tmp_path):
+    toc_dir = tmp_path / "table_of_contents"
+    toc_dir.mkdir()
+    (toc_dir / "fevers.txt").write_text(TOC, encoding="utf-8")
+    path = tmp_path / "fevers.txt"
+    path.write_text(_book(), encoding="utf-8")
+    return path, toc_dir
+
+
+def test_load_toc_splits_chapters_and_sections(book):
+    _, toc_dir = book
+    entries = indexer.load_toc(toc_dir / "fevers.txt")
+    # Roman-numbered front matter and the "Table of Contents" line are skipped.
+    assert [(e.title, e.page, e.chapter, e.section) for e in entries] == [
+        ("Chapter 1: Fevers", 1, "Chapter 1: Fevers", None),
+        ("Malaria", 1, "Chapter 1: Fevers", "Malaria"),
+        ("Dengue", 2, "Chapter 1: Fevers", "Dengue"),
+        ("Chapter 2: Lungs", 3, "Chapter 2: Lungs", None),
+        ("Tuberculosis", 3, "Chapter 2: Lungs", "Tuberculosis"),
+    ]
+
+
+@pytest.mark.parametrize("content_defined", [True, False])
+def test_overlap_carries_whole_sentences(content_defined):
+    text = _sentences("malaria", 40)
+    words = text.split()
+    chunks = indexer.chunk_text(text, chunk_size=40, overlap=12, content_defined=content_defined)
+    assert len(chunks) > 3
+    assert chunks[0][0] == 0 and chunks[-1][1] == len(words)
+    for prev, cur in zip(chunks, chunks[1:]):
+        start, end, body = cur[:3]
+        assert body == " ".join(words[start:end])
+        # The overlap starts at a sentence start, at most 12 words back.
+        assert 0 < prev[1] - start <= 12
+        assert words[start] == "Malaria" and words[start - 1].endswith(".")
+        if content_defined:
+            # Cuts fall on sentence ends: the last whole 7-word sentence, not 12 cut words.
+            assert prev[1] - start == 7
+
+
+def test_overlap_falls_back_to_words_without_a_sentence_start():
+    words = [f"w{i}" for i in range(200)]
+    chunks = indexer.chunk_text(" ".join(words), chunk_size=40, overlap=10, content_defined=False)
+    assert all(prev[1] - cur[0] == 10 for prev, cur in zip(chunks, chunks[1:]))
+
+
+def test_overlap_is_capped_so_every_chunk_has_new_words():
+    chunks = indexer.chunk_text(_sentences("tb", 40), chunk_size=20, overlap=500)
+    assert all(cur[1] > prev[1] for prev, cur in zip(chunks, chunks[1:]))
+    assert all(prev[1] - cur[0] < 10 for prev, cur in zip(chunks, chunks[1:]))
+
+
+def test_chunk_size_must_be_positive():
+    with pytest.raises(ValueError):
+        list(indexer.iter_chunks(iter(()), 0, 0))
+
+
+def test_headings_are_found_after_the_contents_listing(book):
+    path, toc_dir = book
+    bounds = indexer.book_boundaries(path, toc_dir)
+    words = path.read_text(encoding="utf-8").split()
+    assert [(words[pos], chapter, section) for pos, chapter, section in bounds] == [
+        ("Chapter", "Chapter 1: Fevers", None),
+        ("Malaria", "Chapter 1: Fevers", "Malaria"),
+        ("Dengue", "Chapter 1: Fevers", "Dengue"),
+        ("Chapter", "Chapter 2: Lungs", None),
+        ("Tuberculosis", "Chapter 2: Lungs", "Tuberculosis"),
+    ]
+    assert all(pos > 10 for pos, _, _ in bounds)  # not the listing on page 1
+
+
+def test_chunks_are_tagged_and_never_cross_a_heading(book):
+    path, toc_dir = book
+    _, _, chunks, hashes, sections, _ = indexer.chunk_file(str(path), "fevers", 40, 12, toc_dir=str(toc_dir))
+    assert sections == 5 and len(hashes) == len(chunks)
+
+    expected = {
+        "guideline": (None, None),
+        "malaria": ("Chapter 1: Fevers", "Malaria"),
+        "dengue": ("Chapter 1: Fevers", "Dengue"),
+        "tb": ("Chapter 2: Lungs", "Tuberculosis"),
+    }
+    for _, _, text, first_page, last_page, chapter, section in chunks:
+        # Sentences of one topic per chunk, tagged with that topic's section.
+        body = {topic for topic in expected if f"{topic} care." in text}
+        assert len(body) == 1, text
+        assert (chapter, section) == expected[body.pop()]
+        if section:
+            assert first_page == last_page
+
+    # A chapter title right above its first section starts that section's chunk.
+    starts = [c[2] for c in chunks]
+    assert any(s.startswith("Chapter 1: Fevers Malaria Malaria sentence 0") for s in starts)
+    assert any(s.startswith("Dengue Dengue sentence 0") for s in starts)
+    assert any(s.startswith("Chapter 2: Lungs Tuberculosis Tb sentence 0") for s in starts)
+
+
+def test_no_tags_without_a_matching_toc(book, tmp_path):
+    path, toc_dir = book
+    assert indexer.book_boundaries(path, None) == []
+    assert indexer.book_boundaries(path, tmp_path / "missing") == []
+    (toc_dir / "fevers.txt").write_text("Chapter 9: Something else  1\nUnrelated  2\n", encoding="utf-8")
+    chunks = indexer.chunk_file(str(path), "fevers", 40, 12, toc_dir=str(toc_dir))[2]
+    assert {(c[5], c[6]) for c in chunks} == {(None, None)}
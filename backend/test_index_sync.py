@@ -0,0 +1,141 @@
+"""
+Tests for the indexer's incremental sync (tools/index_txt_to_sqlite.py):
+content-hash diffing in sync_book and keeping chunks_fts in step with it.
+
+  python -m pytest -q backend/test_index_sync.py
+"""
+
+import os
+import sys
+import sqlite3
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+import index_txt_to_sqlite as indexer  # noqa: E402
+
+BOOK = "edliz"
+
+
+def _paragraph(topic, n=30):
+    return " ".join(f"{topic}{i}" for i in range(n)) + "."
+
+
+def _book(*topics):
+    return "\n\n".join(_paragraph(t) for t in topics)
+
+
+def _chunks(text):
+    # overlap 0: each paragraph is one chunk, so hashes change only where the text does.
+    chunks = indexer.chunk_text(text, chunk_size=40, overlap=0)
+    return chunks, [indexer.content_hash(c[2]) for c in chunks]
+
+
+def _sync(conn, text, **kwargs):
+    chunks, hashes = _chunks(text)
+    return indexer.sync_book(conn, BOOK, chunks, hashes, indexer.book_content_version(hashes), **kwargs)
+
+
+def _rows(conn):
+    return conn.execute("SELECT id, text FROM chunks WHERE book = ? ORDER BY id", (BOOK,)).fetchall()
+
+
+def _fts_ids(conn, word):
+    return sorted(r[0] for r in conn.execute("SELECT rowid FROM chunks_fts WHERE chunks_fts MATCH ?", (word,)))
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "rag_vectors.db"))
+    indexer.ensure_schema(conn)
+    yield conn
+    conn.close()
+
+
+def test_first_sync_inserts_every_chunk(conn):
+    change = _sync(conn, _book("alpha", "beta", "gamma"))
+    assert change["total"] == 3
+    assert (change["inserted"], change["deleted"], change["unchanged"], change["moved"]) == (3, 0, 0, 0)
+    stored = conn.execute("SELECT start_page, content_hash, book_version FROM chunks ORDER BY id").fetchall()
+    assert [r[0] for r in stored] == [1, 2, 3]  # ordinal placeholders for text without pages
+    assert all(r[1] and r[2] for r in stored)
+
+
+def test_resync_of_the_same_text_changes_nothing(conn):
+    _sync(conn, _book("alpha", "beta", "gamma"))
+    before = _rows(conn)
+    change = _sync(conn, _book("alpha", "beta", "gamma"))
+    assert (change["inserted"], change["deleted"], change["unchanged"], change["moved"]) == (0, 0, 3, 0)
+    assert _rows(conn) == before
+
+
+def test_only_edited_chunks_are_replaced_and_embeddings_kept(conn):
+    _sync(conn, _book("alpha", "beta", "gamma"))
+    ids = {text.split()[0]: chunk_id for chunk_id, text in _rows(conn)}
+    conn.executemany("INSERT INTO embeddings (chunk_id, embedding) VALUES (?, ?)",
+                     [(chunk_id, b"\0" * 8) for chunk_id in ids.values()])
+    conn.commit()
+
+    change = _sync(conn, _book("alpha", "delta", "gamma"))
+    assert (change["inserted"], change["deleted"], change["unchanged"]) == (1, 1, 2)
+    assert change["embeddings_kept"] == 2 and change["embeddings_dropped"] == 1
+    after = {text.split()[0]: chunk_id for chunk_id, text in _rows(conn)}
+    assert after["alpha0"] == ids["alpha0"] and after["gamma0"] == ids["gamma0"]
+    assert "beta0" not in after and after["delta0"] > max(ids.values())
+    embedded = {r[0] for r in conn.execute("SELECT chunk_id FROM embeddings")}
+    assert embedded == {ids["alpha0"], ids["gamma0"]}
+
+
+def test_paragraph_inserted_at_the_top_is_not_a_move_of_everything_below(conn):
+    _sync(conn, _book("alpha", "beta", "gamma"))
+    change = _sync(conn, _book("preface", "alpha", "beta", "gamma"))
+    # Ordinals shift by one, but they are placeholders, not pages: nothing moved.
+    assert (change["inserted"], change["deleted"], change["unchanged"], change["moved"]) == (1, 0, 3, 0)
+
+
+def test_paged_chunks_that_shift_pages_are_moved_in_place(conn):
+    _sync(conn, "\n\n\f".join(_paragraph(t) for t in ("alpha", "beta")))
+    first = _rows(conn)
+    change = _sync(conn, "\n\n\f".join(_paragraph(t) for t in ("cover", "alpha", "beta")))
+    assert (change["inserted"], change["unchanged"], change["moved"]) == (1, 2, 2)
+    pages = dict(conn.execute("SELECT id, start_page FROM chunks"))
+    assert [pages[chunk_id] for chunk_id, _ in first] == [2, 3]
+
+
+def test_dry_run_reports_the_changeset_without_writing(conn):
+    _sync(conn, _book("alpha", "beta"))
+    before = _rows(conn)
+    change = _sync(conn, _book("alpha", "gamma"), dry_run=True)
+    assert (change["inserted"], change["deleted"]) == (1, 1)
+    assert _rows(conn) == before
+
+
+def test_fts_follows_deletes_and_inserts(conn):
+    _sync(conn, _book("alpha", "beta", "gamma"))
+    assert indexer.ensure_fts(conn)
+    beta_id = _fts_ids(conn, "beta3")
+    assert len(beta_id) == 1
+
+    _sync(conn, _book("alpha", "delta", "gamma"), fts=True)
+    assert _fts_ids(conn, "beta3") == []
+    delta_id = conn.execute("SELECT id FROM chunks WHERE text LIKE 'delta0 %'").fetchone()[0]
+    assert _fts_ids(conn, "delta3") == [delta_id]
+    # FTS5's own check that the index matches the content table (raises if not).
+    conn.execute("INSERT INTO chunks_fts(chunks_fts, rank) VALUES ('integrity-check', 1)")
+
+
+def test_ensure_fts_rebuilds_an_unmarked_table(conn):
+    _sync(conn, _book("alpha", "beta"))
+    # As left by an older run: the table exists but was never filled or marked synced.
+    conn.execute("CREATE VIRTUAL TABLE chunks_fts USING fts5(text, content='chunks', content_rowid='id')")
+    conn.commit()
+    assert _fts_ids(conn, "alpha3") == []
+
+    assert indexer.ensure_fts(conn, create=False)
+    assert len(_fts_ids(conn, "alpha3")) == 1
+    assert indexer.get_meta(conn, "fts_synced") == "1"
+
+
+def test_ensure_fts_without_a_table_and_create_false(conn):
+    assert not indexer.ensure_fts(conn, create=False)
+    assert conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunks_fts'").fetchone() is None
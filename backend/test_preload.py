@@ -0,0 +1,79 @@
+"""
+gunicorn --preload imports main once in the master and forks the workers from
+it, so the import must leave nothing per-process behind (see the start-up
+notes in main.py). Checked in a fresh interpreter, since pytest may already
+have imported main with other settings.
+
+  python -m pytest -q backend/test_preload.py
+"""
+
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+CHECK = r"""
+import os, sys, json, sqlite3, threading
+
+opened = []
+_connect = sqlite3.connect
+def connect(*args, **kwargs):
+    conn = _connect(*args, **kwargs)
+    opened.append(conn)
+    return conn
+sqlite3.connect = connect
+
+sys.path.insert(0, sys.argv[1])
+import main
+import structured_log
+
+def is_open(conn):
+    try:
+        conn.execute("SELECT 1")
+        return True
+    except sqlite3.ProgrammingError:
+        return False
+
+listener = getattr(structured_log._listener, "_thread", None)
+report = {
+    "open_connections": sum(is_open(c) for c in opened),
+    "threads": [t.name for t in threading.enumerate() if t is not threading.main_thread() and t is not listener],
+    "http_client": main.OPENAI_POOL._http is not None,
+    "sweeper": main.TRAIN_JOBS._sweeper is not None,
+    "owner": main.TRAIN_JOBS.owner,
+}
+r, w = os.pipe()
+pid = os.fork()
+if pid == 0:
+    os.write(w, main.TRAIN_JOBS.owner.encode())
+    os._exit(0)
+os.close(w)
+with os.fdopen(r) as f:
+    report["child_owner"] = f.read()
+os.waitpid(pid, 0)
+print(json.dumps(report))
+"""
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_import_leaves_nothing_per_process(tmp_path):
+    env = dict(os.environ)
+    for name in ("EMBED_CACHE_DB", "CORPUS_DB", "TRAIN_JOBS_DB", "ANSWER_CACHE_DB"):
+        env[name] = str(tmp_path / (name.lower() + ".db"))
+    vectors = os.path.join(HERE, "..", "test_rag_vectors.db")
+    env["RAG_VECTORS_DB"] = vectors if os.path.exists(vectors) else str(tmp_path / "rag_vectors.db")
+    env["RATE_LIMIT_BACKEND"] = "sqlite"
+    env["RATE_LIMIT_DB"] = str(tmp_path / "rate_limits.db")
+    out = subprocess.run([sys.executable, "-c", CHECK, HERE], cwd=str(tmp_path), env=env,
+                         capture_output=True, text=True, timeout=120)
+    assert out.returncode == 0, out.stderr
+    report = json.loads(out.stdout.strip().splitlines()[-1])
+    assert report["open_connections"] == 0
+    assert report["threads"] == []
+    assert not report["http_client"]
+    assert not report["sweeper"]
+    assert report["child_owner"] != report["owner"]
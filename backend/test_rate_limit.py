@@ -0,0 +1,92 @@
+"""
+Tests for rate_limit: the sliding-window estimate and both stores.
+
+  python -m pytest -q backend/test_rate_limit.py
+"""
+
+import os
+import sys
+import threading
+
+import pytest
+
+try:
+    from .rate_limit import MemoryRateLimitStore, RateLimiter, SQLiteRateLimitStore, advance, decide, estimate
+except ImportError:
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from rate_limit import MemoryRateLimitStore, RateLimiter, SQLiteRateLimitStore, advance, decide, estimate
+
+
+def test_advance_rolls_windows_forward():
+    assert advance(None, 125.0, 60) == (2, 0, 0)
+    assert advance((2, 5, 1), 130.0, 60) == (2, 5, 1)  # same window
+    assert advance((2, 5, 1), 185.0, 60) == (3, 0, 5)  # next window: current becomes previous
+    assert advance((2, 5, 1), 300.0, 60) == (5, 0, 0)  # a gap of whole windows forgets both
+
+
+def test_estimate_weights_the_previous_window_by_overlap():
+    # 15s into window 3: 75% of window 2 still falls inside the sliding minute.
+    assert estimate((3, 4, 8), 195.0, 60) == pytest.approx(8 * 0.75 + 4)
+    assert estimate((3, 4, 8), 239.999, 60) == pytest.approx(4, abs=1e-3)
+
+
+def test_decide_counts_only_allowed_requests():
+    limits = [(60, 2), (3600, 100)]
+    states = [None, None]
+    results = []
+    for _ in range(3):
+        allowed, states = decide(states, limits, 10.0)
+        results.append(allowed)
+    assert results == [True, True, False]
+    assert states[0] == (0, 2, 0) and states[1] == (0, 2, 0)
+
+
+def test_every_limit_must_allow():
+    allowed, states = decide([(0, 1, 0), (0, 5, 0)], [(60, 10), (3600, 5)], 30.0)
+    assert not allowed and states == [(0, 1, 0), (0, 5, 0)]
+
+
+def test_limit_recovers_as_the_window_slides():
+    limiter = RateLimiter([(60, 3)], MemoryRateLimitStore())
+    assert [limiter.allow("u", now=59.0) for _ in range(4)] == [True, True, True, False]
+    # 30s into the next window half of the previous 3 still count: 1.5 < 3.
+    assert limiter.allow("u", now=90.0)
+    assert limiter.allow("other", now=59.5)  # limits are per user
+
+
+def test_memory_store_evicts_idle_and_excess_users():
+    store = MemoryRateLimitStore(max_users=2)
+    limits = [(60, 10)]
+    store.hit("a", limits, 0.0)
+    store.hit("b", limits, 1.0)
+    store.hit("c", limits, 2.0)
+    assert len(store) == 2
+    store.hit("d", limits, 500.0)  # a, b, c idle for more than two windows
+    assert len(store) == 1
+
+
+def test_sqlite_store_is_shared_and_consistent(tmp_path):
+    db = str(tmp_path / "rate_limits.db")
+    limits = [(60, 50)]
+    workers = [RateLimiter(limits, SQLiteRateLimitStore(db)) for _ in range(2)]
+    allowed = []
+    lock = threading.Lock()
+
+    def hammer(limiter):
+        for _ in range(40):
+            ok = limiter.allow("u", now=10.0)
+            with lock:
+                allowed.append(ok)
+
+    threads = [threading.Thread(target=hammer, args=(w,)) for w in workers for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # 160 requests from two "workers" and four threads: exactly the limit gets through.
+    assert sum(allowed) == 50
+
+
+def test_only_the_sqlite_store_blocks():
+    assert RateLimiter([(60, 1)], SQLiteRateLimitStore(":memory:")).blocking
+    assert not RateLimiter([(60, 1)], MemoryRateLimitStore()).blocking
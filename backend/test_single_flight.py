@@ -0,0 +1,118 @@
+"""
+Tests for single_flight: coalescing, cancellation shielding and error fan-out.
+
+  python -m pytest -q backend/test_single_flight.py
+"""
+
+import os
+import sys
+import asyncio
+
+import pytest
+
+try:
+    from .single_flight import SingleFlight, flight_key
+except ImportError:
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from single_flight import SingleFlight, flight_key
+
+
+class Upstream:
+    """Counts calls and finishes them only when released."""
+
+    def __init__(self, error: Exception = None):
+        self.calls = 0
+        self.error = error
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return {"value": self.calls}
+
+
+async def _started(flight):
+    while flight.inflight() == 0:
+        await asyncio.sleep(0)
+
+
+def test_flight_key_ignores_argument_order_but_not_values():
+    assert flight_key("embeddings", model="m", texts=["a"]) == flight_key("embeddings", texts=["a"], model="m")
+    assert flight_key("embeddings", model="m", texts=["a"]) != flight_key("embeddings", model="m", texts=["b"])
+    assert flight_key("rag_answer", x=1).startswith("rag_answer:")
+
+
+def test_concurrent_callers_share_one_call():
+    async def scenario():
+        flight, upstream = SingleFlight(), Upstream()
+        waiters = [asyncio.ensure_future(flight.do("k", upstream)) for _ in range(5)]
+        await _started(flight)
+        upstream.release.set()
+        results = await asyncio.gather(*waiters)
+        return upstream.calls, results, flight.stats()
+
+    calls, results, stats = asyncio.run(scenario())
+    assert calls == 1
+    assert all(r[0] is results[0][0] for r in results)  # the same object
+    assert [shared for _, shared in results] == [False, True, True, True, True]
+    assert stats["endpoints"]["k"] == {"calls": 1, "coalesced": 4, "errors": 0}
+    assert stats["inflight"] == 0
+
+
+def test_a_finished_key_runs_again():
+    async def scenario():
+        flight, upstream = SingleFlight(), Upstream()
+        upstream.release.set()
+        await flight.do("k", upstream)
+        await flight.do("k", upstream)
+        return upstream.calls
+
+    assert asyncio.run(scenario()) == 2
+
+
+def test_cancelled_leader_does_not_cancel_the_shared_call():
+    async def scenario():
+        flight, upstream = SingleFlight(), Upstream()
+        leader = asyncio.ensure_future(flight.do("k", upstream))
+        await _started(flight)
+        follower = asyncio.ensure_future(flight.do("k", upstream))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        upstream.release.set()
+        return await follower, leader.cancelled(), upstream.calls
+
+    (result, shared), leader_cancelled, calls = asyncio.run(scenario())
+    assert result == {"value": 1} and shared
+    assert leader_cancelled and calls == 1
+
+
+def test_error_reaches_every_waiter_and_is_counted_once():
+    async def scenario():
+        flight, upstream = SingleFlight(), Upstream(error=RuntimeError("upstream down"))
+        waiters = [asyncio.ensure_future(flight.do("embeddings:x", upstream)) for _ in range(3)]
+        await _started(flight)
+        upstream.release.set()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        return results, flight.stats()
+
+    results, stats = asyncio.run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert stats["endpoints"]["embeddings"]["errors"] == 1
+
+
+@pytest.mark.parametrize("tracked", [1, 3])
+def test_key_stats_are_bounded(tracked):
+    async def scenario():
+        flight = SingleFlight(max_tracked_keys=tracked)
+        upstream = Upstream()
+        upstream.release.set()
+        for i in range(10):
+            await flight.do(f"ep:{i}", upstream)
+        return flight.stats(top=None)
+
+    stats = asyncio.run(scenario())
+    assert len(stats["keys"]) == tracked
+    assert stats["endpoints"]["ep"]["calls"] == 10
@@ -0,0 +1,175 @@
+"""
+Tests for train_jobs: job leases, caller-key holders and the per-process runner identity.
+
+  python -m pytest -q backend/test_train_jobs.py
+"""
+
+import os
+import sys
+import asyncio
+
+import pytest
+
+try:
+    from .train_jobs import MISSING_KEY_ERROR, TrainJobStore, TrainJobRunner
+except ImportError:
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from train_jobs import MISSING_KEY_ERROR, TrainJobStore, TrainJobRunner
+
+
+async def _no_batch(idx, chunks, params, semaphore):
+    raise AssertionError("no batch should run in these tests")
+
+
+@pytest.fixture
+def store(tmp_path):
+    return TrainJobStore(str(tmp_path / "train_jobs.db"))
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_forked_workers_get_distinct_owners(store):
+    # gunicorn --preload builds the runner in the master and forks the workers.
+    runner = TrainJobRunner(store, _no_batch)
+    parent_owner = runner.owner
+    owners = []
+    for _ in range(2):
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(r)
+            os.write(w, runner.owner.encode())
+            os._exit(0)
+        os.close(w)
+        with os.fdopen(r) as f:
+            owners.append(f.read())
+        os.waitpid(pid, 0)
+    assert len({parent_owner, *owners}) == 3
+    assert runner.owner == parent_owner
+
+
+async def _drain(runner):
+    while runner.running():
+        await asyncio.sleep(0.01)
+
+
+def test_caller_keyed_job_waits_for_its_key_holder(store):
+    seen_keys = []
+
+    async def record_key(idx, chunks, params, semaphore):
+        seen_keys.append(params["api_key"])
+        return {"pairs": [], "stats": {"batch": idx}}
+
+    async def scenario():
+        holder = TrainJobRunner(store, record_key, max_jobs=0)  # busy: leaves the job queued
+        other = TrainJobRunner(store, _no_batch)
+        job_id = await holder.create("u1", "book", {}, [[{"text": "a"}]], api_key="sk-caller")
+
+        await other.sweep()
+        assert other.running() == 0
+        assert store.get(job_id, "u1")["status"] == "queued"
+
+        holder.max_jobs = 1
+        await holder.sweep()
+        await _drain(holder)
+        return store.get(job_id, "u1")["status"]
+
+    assert asyncio.run(scenario()) == "completed"
+    assert seen_keys == ["sk-caller"]
+
+
+def test_caller_keyed_job_fails_once_its_key_holder_is_gone(store):
+    async def scenario():
+        holder = TrainJobRunner(store, _no_batch, max_jobs=0)
+        other = TrainJobRunner(store, _no_batch)
+        job_id = await holder.create("u1", "book", {}, [[{"text": "a"}]], api_key="sk-caller")
+        await holder.stop()  # the key goes with the process
+
+        await other.sweep()
+        await _drain(other)
+        return store.get(job_id, "u1")
+
+    job = asyncio.run(scenario())
+    assert job["status"] == "failed"
+    assert job["error"] == MISSING_KEY_ERROR
+
+
+def _job(store, batches=2):
+    return store.create("u1", "book", {}, [[{"text": str(i)}] for i in range(batches)])
+
+
+def _expire(store, job_id):
+    with store._lock:
+        conn = store._db()
+        with conn:
+            conn.execute("UPDATE train_jobs SET lease_until = 0 WHERE id = ?", (job_id,))
+
+
+def test_lease_claim_renew_and_steal(store):
+    job_id = _job(store)
+    assert store.claim("A", 60) == [job_id]
+    assert store.claim("B", 60) == []  # leased to A
+    assert store.renew(job_id, "A", 60)
+    assert not store.renew(job_id, "B", 60)
+
+    _expire(store, job_id)  # A stalled past its lease
+    assert store.claim("B", 60) == [job_id]
+    assert not store.renew(job_id, "A", 60)
+    assert not store.finish_batch(job_id, "A", 0, [{"q": "stale"}], {})
+    store.finalize(job_id, "A")  # ignored: not the owner
+    assert store.get(job_id, "u1")["status"] == "running"
+    assert store.finish_batch(job_id, "B", 0, [{"q": "fresh"}], {})
+
+
+def test_release_makes_a_job_claimable_at_once(store):
+    job_id = _job(store)
+    store.claim("A", 60)
+    store.release(job_id, "A")
+    assert store.claim("B", 60) == [job_id]
+
+
+def test_finalize_status_and_retry_of_failed_batches(store):
+    job_id = _job(store)
+    store.claim("A", 60)
+    store.finish_batch(job_id, "A", 0, [{"q": "1"}], {"batch": 0})
+    store.finish_batch(job_id, "A", 1, [], {"batch": 1, "error": "429"})
+    store.finalize(job_id, "A")
+    job = store.get(job_id, "u1")
+    assert job["status"] == "completed_with_errors"
+    assert job["failed_batches"] == 1 and job["qa_pairs"] == [{"q": "1"}]
+
+    assert store.retry_failed(job_id, "someone-else") is None
+    assert store.retry_failed(job_id, "u1") == 1
+    job = store.get(job_id, "u1")
+    assert job["status"] == "queued" and job["pending_batches"] == 1
+    assert [idx for idx, _ in store.pending_batches(job_id)] == [1]
+
+
+def test_runner_stops_without_writing_when_its_lease_is_stolen(store):
+    async def scenario():
+        release = asyncio.Event()
+
+        async def blocked(idx, chunks, params, semaphore):
+            await release.wait()
+            return {"pairs": [{"q": "late"}], "stats": {}}
+
+        runner = TrainJobRunner(store, blocked, lease_seconds=0.3)
+        job_id = _job(store, batches=1)
+        await runner.submit(job_id)
+        await asyncio.sleep(0.05)
+        _expire(store, job_id)
+        assert store.claim("thief", 60) == [job_id]
+        for _ in range(100):  # the heartbeat notices within lease_seconds / 3
+            if not runner.running():
+                break
+            await asyncio.sleep(0.02)
+        release.set()
+        await asyncio.sleep(0.05)
+        return job_id, runner.running()
+
+    job_id, running = asyncio.run(scenario())
+    assert running == 0
+    job = store.get(job_id, "u1")
+    assert job["status"] == "running" and job["pending_batches"] == 1  # still the thief's to run
+    with store._lock:
+        owner = store._db().execute("SELECT owner FROM train_jobs WHERE id = ?", (job_id,)).fetchone()[0]
+    assert owner == "thief"
@@ -0,0 +1,472 @@
+# Background book-training jobs persisted in SQLite.
+#
+# `POST /train/jobs` stores the book's batches and returns at once; a runner
+# inside each web worker trains pending batches and commits every finished
+# batch, so the batches table is the checkpoint. Jobs are leased to one worker
+# at a time: the lease is renewed while the job runs, and a job whose lease
+# expired (its worker died or restarted) is picked up by the next sweep and
+# resumes at its first unfinished batch.
+
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+import logging
+import sqlite3
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (batch index, chunks, job params, semaphore) -> {"pairs": [...], "stats": {...}}
+BatchFn = Callable[[int, List[Dict[str, Any]], Dict[str, Any], asyncio.Semaphore], Awaitable[Dict[str, Any]]]
+
+ACTIVE_STATUSES = ("queued", "running")
+
+# Jobs submitted with the caller's own API key record that in their params
+# (never the key itself), and the worker holding the key in memory in
+# `key_holder`. Other workers leave such a job alone while its holder is alive
+# (see train_workers); once the holder is gone the key is gone with it, and the
+# job fails rather than being billed to the server's key.
+CALLER_KEY_PARAM = "caller_api_key"
+MISSING_KEY_ERROR = ("api key required, resubmit: this job was started with the caller's API key, "
+                     "which is not kept across restarts or workers; retry it with the api_key")
+
+# Claimable by `owner` unless another live worker holds the job's caller key.
+_KEY_HOLDER_OK = (
+    "(key_holder IS NULL OR key_holder = ? OR NOT EXISTS ("
+    "SELECT 1 FROM train_workers w WHERE w.owner = train_jobs.key_holder AND w.alive_until >= ?))"
+)
+
+
+class LeaseLost(Exception):
+    """This worker no longer holds the job's lease (another worker may be running it)."""
+
+
+class TrainJobStore:
+    """SQLite tables for jobs and their batches. Thread-safe; call from a threadpool."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(
+                "CREATE TABLE IF NOT EXISTS train_jobs ("
+                "id TEXT PRIMARY KEY, user_id TEXT NOT NULL, book_id TEXT NOT NULL, status TEXT NOT NULL, "
+                "params TEXT NOT NULL, total_batches INTEGER NOT NULL, owner TEXT, lease_until REAL, "
+                "error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS train_jobs_status ON train_jobs (status);"
+                "CREATE TABLE IF NOT EXISTS train_job_batches ("
+                "job_id TEXT NOT NULL, batch_idx INTEGER NOT NULL, status TEXT NOT NULL, chunks TEXT NOT NULL, "
+                "pairs TEXT, stats TEXT, PRIMARY KEY (job_id, batch_idx)) WITHOUT ROWID;"
+                "CREATE TABLE IF NOT EXISTS train_workers (owner TEXT PRIMARY KEY, alive_until REAL NOT NULL);"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(train_jobs)")}
+            if "key_holder" not in columns:
+                conn.execute("ALTER TABLE train_jobs ADD COLUMN key_holder TEXT")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def create(self, user_id: str, book_id: str, params: Dict[str, Any], batches: List[List[Dict[str, Any]]],
+               job_id: Optional[str] = None, key_holder: Optional[str] = None) -> str:
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            conn = self._db()
+            with conn:
+                conn.execute(
+                    "INSERT INTO train_jobs (id, user_id, book_id, status, params, total_batches, key_holder, "
+                    "created_at, updated_at) VALUES (?, ?, ?, 'queued', ?, ?, ?, ?, ?)",
+                    (job_id, user_id, book_id, json.dumps(params), len(batches), key_holder, now, now),
+                )
+                conn.executemany(
+                    "INSERT INTO train_job_batches (job_id, batch_idx, status, chunks) VALUES (?, ?, 'pending', ?)",
+                    [(job_id, i, json.dumps(batch)) for i, batch in enumerate(batches)],
+                )
+        return job_id
+
+    def claim(self, owner: str, lease_seconds: float, job_id: Optional[str] = None, limit: int = 1) -> List[str]:
+        """Lease up to `limit` active jobs that no live worker holds, skipping
+        jobs whose caller key another live worker holds."""
+        now = time.time()
+        with self._lock:
+            conn = self._db()
+            with conn:
+                if job_id is not None:
+                    candidates = [job_id]
+                else:
+                    candidates = [row[0] for row in conn.execute(
+                        "SELECT id FROM train_jobs WHERE status IN ('queued', 'running') "
+                        f"AND (lease_until IS NULL OR lease_until < ?) AND {_KEY_HOLDER_OK} ORDER BY created_at LIMIT ?",
+                        (now, owner, now, limit),
+                    )]
+                claimed = []
+                for cid in candidates:
+                    cur = conn.execute(
+                        "UPDATE train_jobs SET owner = ?, lease_until = ?, status = 'running', updated_at = ? "
+                        "WHERE id = ? AND status IN ('queued', 'running') AND (lease_until IS NULL OR lease_until < ?) "
+                        f"AND {_KEY_HOLDER_OK}",
+                        (owner, now + lease_seconds, now, cid, now, owner, now),
+                    )
+                    if cur.rowcount:
+                        claimed.append(cid)
+        return claimed
+
+    def heartbeat(self, owner: str, alive_seconds: float) -> None:
+        """Record that `owner` is alive, and so still holds its jobs' caller keys."""
+        now = time.time()
+        with self._lock:
+            conn = self._db()
+            with conn:
+                conn.execute(
+                    "INSERT INTO train_workers (owner, alive_until) VALUES (?, ?) "
+                    "ON CONFLICT(owner) DO UPDATE SET alive_until = excluded.alive_until",
+                    (owner, now + alive_seconds),
+                )
+                conn.execute("DELETE FROM train_workers WHERE alive_until < ?", (now - 86400,))
+
+    def retire(self, owner: str) -> None:
+        """Forget a stopping worker, so jobs whose keys it held fail without waiting."""
+        with self._lock:
+            conn = self._db()
+            with conn:
+                conn.execute("DELETE FROM train_workers WHERE owner = ?", (owner,))
+
+    def renew(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        with self._lock:
+            conn = self._db()
+            with conn:
+                cur = conn.execute(
+                    "UPDATE train_jobs SET lease_until = ? WHERE id = ? AND owner = ?",
+                    (time.time() + lease_seconds, job_id, owner),
+                )
+        return bool(cur.rowcount)
+
+    def params(self, job_id: str) -> Dict[str, Any]:
+        with self._lock:
+            row = self._db().execute("SELECT params FROM train_jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def pending_batches(self, job_id: str) -> List[Tuple[int, List[Dict[str, Any]]]]:
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT batch_idx, chunks FROM train_job_batches WHERE job_id = ? AND status = 'pending' ORDER BY batch_idx",
+                (job_id,),
+            ).fetchall()
+        return [(idx, json.loads(chunks)) for idx, chunks in rows]
+
+    def finish_batch(self, job_id: str, owner: str, batch_idx: int, pairs: List[Any], stats: Dict[str, Any]) -> bool:
+        """Store a batch's result if `owner` still holds the job; False when it does not."""
+        status = "failed" if stats.get("error") else "done"
+        with self._lock:
+            conn = self._db()
+            with conn:
+                cur = conn.execute(
+                    "UPDATE train_jobs SET updated_at = ? WHERE id = ? AND owner = ?", (time.time(), job_id, owner)
+                )
+                if not cur.rowcount:
+                    return False
+                conn.execute(
+                    "UPDATE train_job_batches SET status = ?, pairs = ?, stats = ? WHERE job_id = ? AND batch_idx = ?",
+                    (status, json.dumps(pairs), json.dumps(stats), job_id, batch_idx),
+                )
+        return True
+
+    def finalize(self, job_id: str, owner: str, error: Optional[str] = None) -> None:
+        """Mark a job finished and release its lease: `failed` with `error`,
+        `completed_with_errors` when some of its batches failed, else `completed`."""
+        with self._lock:
+            conn = self._db()
+            with conn:
+                status = "failed" if error else "completed"
+                if not error:
+                    failed = conn.execute(
+                        "SELECT COUNT(*) FROM train_job_batches WHERE job_id = ? AND status = 'failed'", (job_id,)
+                    ).fetchone()[0]
+                    if failed:
+                        status = "completed_with_errors"
+                        error = f"{failed} batch(es) failed; POST /train/jobs/{job_id}/retry re-runs them"
+                conn.execute(
+                    "UPDATE train_jobs SET status = ?, error = ?, owner = NULL, lease_until = NULL, updated_at = ? "
+                    "WHERE id = ? AND owner = ?",
+                    (status, error, time.time(), job_id, owner),
+                )
+
+    def release(self, job_id: str, owner: str) -> None:
+        """Give up a lease without finishing, so another worker can resume the job."""
+        with self._lock:
+            conn = self._db()
+            with conn:
+                conn.execute(
+                    "UPDATE train_jobs SET owner = NULL, lease_until = NULL WHERE id = ? AND owner = ?",
+                    (job_id, owner),
+                )
+
+    def retry_failed(self, job_id: str, user_id: str, key_holder: Optional[str] = None) -> Optional[int]:
+        """Re-queue a finished job's failed batches, and the unfinished ones of a
+        failed job. Returns how many, or None if not found. `key_holder` is the
+        worker now holding a caller key sent with the retry."""
+        with self._lock:
+            conn = self._db()
+            with conn:
+                row = conn.execute("SELECT status FROM train_jobs WHERE id = ? AND user_id = ?", (job_id, user_id)).fetchone()
+                if row is None:
+                    return None
+                cur = conn.execute(
+                    "UPDATE train_job_batches SET status = 'pending', pairs = NULL, stats = NULL "
+                    "WHERE job_id = ? AND status = 'failed'",
+                    (job_id,),
+                )
+                retried = cur.rowcount
+                if key_holder is not None:
+                    conn.execute("UPDATE train_jobs SET key_holder = ? WHERE id = ?", (key_holder, job_id))
+                if row[0] == "failed":
+                    retried += conn.execute(
+                        "SELECT COUNT(*) FROM train_job_batches WHERE job_id = ? AND status = 'pending'", (job_id,)
+                    ).fetchone()[0]
+                if retried and row[0] not in ACTIVE_STATUSES:
+                    conn.execute(
+                        "UPDATE train_jobs SET status = 'queued', error = NULL, updated_at = ? WHERE id = ?",
+                        (time.time(), job_id),
+                    )
+        return retried
+
+    def get(self, job_id: str, user_id: str, include_pairs: bool = True) -> Optional[Dict[str, Any]]:
+        """Job status, progress, per-batch stats and the pairs of finished batches in batch order."""
+        with self._lock:
+            conn = self._db()
+            job = conn.execute(
+                "SELECT id, book_id, status, total_batches, error, created_at, updated_at FROM train_jobs "
+                "WHERE id = ? AND user_id = ?",
+                (job_id, user_id),
+            ).fetchone()
+            if job is None:
+                return None
+            rows = conn.execute(
+                f"SELECT batch_idx, status, stats{', pairs' if include_pairs else ''} FROM train_job_batches "
+                "WHERE job_id = ? ORDER BY batch_idx",
+                (job_id,),
+            ).fetchall()
+        counts = {"pending": 0, "done": 0, "failed": 0}
+        batch_stats, qa_pairs = [], []
+        for row in rows:
+            counts[row[1]] = counts.get(row[1], 0) + 1
+            if row[2]:
+                batch_stats.append(json.loads(row[2]))
+            if include_pairs and row[1] == "done" and row[3]:
+                qa_pairs.extend(json.loads(row[3]))
+        total = job[3]
+        finished = counts["done"] + counts["failed"]
+        result: Dict[str, Any] = {
+            "job_id": job[0],
+            "book_id": job[1],
+            "status": job[2],
+            "error": job[4],
+            "batches": total,
+            "done_batches": counts["done"],
+            "failed_batches": counts["failed"],
+            "pending_batches": counts["pending"],
+            "progress": round(finished / total, 4) if total else 1.0,
+            "created_at": job[5],
+            "updated_at": job[6],
+            "batch_stats": batch_stats,
+        }
+        if include_pairs:
+            result["qa_pairs"] = qa_pairs
+            result["count"] = len(qa_pairs)
+        return result
+
+
+class TrainJobRunner:
+    """Runs leased jobs inside one worker process.
+
+    At most `max_jobs` jobs run at once in this worker, and each job has at
+    most `concurrency` batches in flight. A sweep every `sweep_seconds` picks
+    up queued jobs and jobs whose lease expired, and marks this worker alive
+    for the jobs whose caller keys it holds.
+    """
+
+    def __init__(self, store: TrainJobStore, run_batch: BatchFn, max_jobs: int = 2, concurrency: int = 4,
+                 lease_seconds: float = 60.0, sweep_seconds: float = 15.0):
+        self.store = store
+        self.run_batch = run_batch
+        self.max_jobs = max_jobs
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.sweep_seconds = sweep_seconds
+        self._owner: Optional[Tuple[int, str]] = None  # (pid, lease owner id)
+        # Request API keys are kept in memory only (see CALLER_KEY_PARAM).
+        self.api_keys: Dict[str, str] = {}
+        self._running: Dict[str, asyncio.Task] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+
+    @property
+    def owner(self) -> str:
+        """Lease owner id of this process.
+
+        Derived per pid rather than fixed at construction: with gunicorn
+        --preload the runner is built once in the master, and forked workers
+        sharing one id would all pass each other's `WHERE owner = ?` checks.
+        """
+        pid = os.getpid()
+        if self._owner is None or self._owner[0] != pid:
+            self._owner = (pid, f"{socket.gethostname()}:{pid}:{uuid.uuid4().hex[:8]}")
+        return self._owner[1]
+
+    def start(self) -> None:
+        if self._sweeper is None:
+            self._sweeper = asyncio.ensure_future(self._sweep_forever())
+
+    async def stop(self) -> None:
+        tasks = [t for t in [self._sweeper, *self._running.values()] if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._sweeper = None
+        # The caller keys held here are gone with this process.
+        await asyncio.to_thread(self.store.retire, self.owner)
+
+    @property
+    def alive_seconds(self) -> float:
+        """How long one heartbeat keeps this worker counted as a key holder."""
+        return max(self.lease_seconds, 3 * self.sweep_seconds)
+
+    async def create(self, user_id: str, book_id: str, params: Dict[str, Any],
+                     batches: List[List[Dict[str, Any]]], api_key: Optional[str] = None) -> str:
+        """Store a new job and start it here if there is room; otherwise a sweep will.
+        With a caller `api_key`, only this worker (which holds the key) runs it."""
+        job_id = uuid.uuid4().hex
+        params = {**params, CALLER_KEY_PARAM: bool(api_key)}
+        if api_key:
+            self.api_keys[job_id] = api_key
+            await asyncio.to_thread(self.store.heartbeat, self.owner, self.alive_seconds)
+        try:
+            await asyncio.to_thread(self.store.create, user_id, book_id, params, batches, job_id,
+                                    self.owner if api_key else None)
+        except BaseException:
+            self.api_keys.pop(job_id, None)
+            raise
+        await self.submit(job_id)
+        return job_id
+
+    async def retry(self, job_id: str, user_id: str, api_key: Optional[str] = None) -> Optional[int]:
+        """Re-queue a job's failed batches and start it here if there is room.
+        A caller `api_key` makes this worker the job's key holder."""
+        previous = self.api_keys.get(job_id)
+        if api_key:
+            self.api_keys[job_id] = api_key
+            await asyncio.to_thread(self.store.heartbeat, self.owner, self.alive_seconds)
+        retried = await asyncio.to_thread(self.store.retry_failed, job_id, user_id, self.owner if api_key else None)
+        if retried is None:  # not this caller's job: keep whatever key was held before
+            if previous is None:
+                self.api_keys.pop(job_id, None)
+            else:
+                self.api_keys[job_id] = previous
+            return None
+        if retried:
+            await self.submit(job_id)
+        return retried
+
+    def running(self) -> int:
+        return len(self._running)
+
+    async def submit(self, job_id: str) -> None:
+        """Start a just-created job here if there is room; otherwise a sweep will."""
+        if len(self._running) < self.max_jobs:
+            claimed = await asyncio.to_thread(self.store.claim, self.owner, self.lease_seconds, job_id)
+            for cid in claimed:
+                self._launch(cid)
+
+    async def sweep(self) -> None:
+        await asyncio.to_thread(self.store.heartbeat, self.owner, self.alive_seconds)
+        free = self.max_jobs - len(self._running)
+        if free <= 0:
+            return
+        for job_id in await asyncio.to_thread(self.store.claim, self.owner, self.lease_seconds, None, free):
+            logger.info("[train_jobs] resuming job %s", job_id)
+            self._launch(job_id)
+
+    async def _sweep_forever(self) -> None:
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.warning("[train_jobs] sweep failed: %s", e)
+            await asyncio.sleep(self.sweep_seconds)
+
+    def _launch(self, job_id: str) -> None:
+        task = asyncio.ensure_future(self._run(job_id))
+        self._running[job_id] = task
+        task.add_done_callback(lambda _t, job_id=job_id: self._running.pop(job_id, None))
+
+    async def _heartbeat(self, job_id: str, run: asyncio.Task, lease_lost: asyncio.Event) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not await asyncio.to_thread(self.store.renew, job_id, self.owner, self.lease_seconds):
+                # The lease expired and another worker may have claimed the job:
+                # stop rather than train (and bill) the same batches twice.
+                logger.warning("[train_jobs] job %s: lease lost, stopping", job_id)
+                lease_lost.set()
+                run.cancel()
+                return
+
+    async def _run(self, job_id: str) -> None:
+        lease_lost = asyncio.Event()
+        heartbeat = asyncio.ensure_future(self._heartbeat(job_id, asyncio.current_task(), lease_lost))
+        try:
+            params = await asyncio.to_thread(self.store.params, job_id)
+            params["api_key"] = self.api_keys.get(job_id)
+            if params.get(CALLER_KEY_PARAM) and not params["api_key"]:
+                logger.warning("[train_jobs] job %s: caller's API key not available here, failing the job", job_id)
+                await asyncio.to_thread(self.store.finalize, job_id, self.owner, MISSING_KEY_ERROR)
+                return
+            semaphore = asyncio.Semaphore(max(1, min(params.get("concurrency") or self.concurrency, self.concurrency)))
+
+            async def one(idx: int, chunks: List[Dict[str, Any]]) -> None:
+                result = await self.run_batch(idx, chunks, params, semaphore)
+                if lease_lost.is_set():
+                    raise LeaseLost(job_id)
+                # Committed per batch: a restart loses at most the batches in flight.
+                if not await asyncio.to_thread(
+                    self.store.finish_batch, job_id, self.owner, idx, result["pairs"], result["stats"]
+                ):
+                    lease_lost.set()
+                    raise LeaseLost(job_id)
+
+            # Loop so batches re-queued by a retry while the job runs are not missed.
+            while True:
+                pending = await asyncio.to_thread(self.store.pending_batches, job_id)
+                if not pending:
+                    break
+                logger.info("[train_jobs] job %s: %d batches pending", job_id, len(pending))
+                tasks = [asyncio.ensure_future(one(idx, chunks)) for idx, chunks in pending]
+                try:
+                    await asyncio.gather(*tasks)
+                finally:
+                    for task in tasks:  # after a lost lease, stop the batches still running
+                        task.cancel()
+            await asyncio.to_thread(self.store.finalize, job_id, self.owner)
+            self.api_keys.pop(job_id, None)
+            logger.info("[train_jobs] job %s finished", job_id)
+        except asyncio.CancelledError:
+            if lease_lost.is_set():
+                return  # the job is no longer ours to release
+            # Shutting down: let another worker resume the job right away.
+            await asyncio.to_thread(self.store.release, job_id, self.owner)
+            raise
+        except LeaseLost:
+            logger.warning("[train_jobs] job %s: lease lost, results of the batches in flight dropped", job_id)
+        except Exception as e:
+            logger.exception("[train_jobs] job %s failed: %s", job_id, e)
+            await asyncio.to_thread(self.store.finalize, job_id, self.owner, f"{type(e).__name__}: {e}")
+        finally:
+            heartbeat.cancel()
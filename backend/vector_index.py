@@ -0,0 +1,240 @@
+# Server-side vector index over the `VectorDB` SQLite schema used by the app.
+#
+# The Flutter app stores chunks in a `chunks` table and their embeddings in an
+# `embeddings` table as little-endian float64 blobs. This module loads those
+# tables once into one contiguous float32 matrix per book (rows normalised
+# ahead of time) so a query is scored with a single matrix multiply instead of
+# a per-row loop.
+#
+# The matrices live in one anonymous shared memory mapping, read-only once
+# filled. Loaded in the gunicorn master (`--preload`), it is inherited by every
+# worker and stays a single physical copy: unlike heap memory, no worker write
+# or allocator reuse can make the kernel copy those pages.
+
+import os
+import mmap
+import sqlite3
+import threading
+import logging
+from typing import Optional, List, Dict, Any, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def decode_embedding(blob: bytes) -> np.ndarray:
+    """Decode a `VectorDB` embedding blob (little-endian float64) into a vector."""
+    return np.frombuffer(blob, dtype="<f8")
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Return the indices of the `k` best scores per row, best first.
+
+    `scores` is a (queries, rows) matrix. Uses argpartition so only the
+    selected candidates are fully sorted.
+    """
+    n = scores.shape[1]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    if k < n:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        part = np.tile(np.arange(n), (scores.shape[0], 1))
+    order = np.argsort(-np.take_along_axis(scores, part, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(part, order, axis=1)
+
+
+def shared_matrices(matrices: Dict[str, np.ndarray], align: int = 64) -> Tuple[Optional[mmap.mmap], Dict[str, np.ndarray]]:
+    """Copy matrices into one anonymous shared mapping and return read-only
+    views of them (plus the mapping, which must be kept alive)."""
+    offsets: Dict[str, int] = {}
+    total = 0
+    for name, m in matrices.items():
+        offsets[name] = total
+        total += -(-m.nbytes // align) * align
+    if total == 0:
+        return None, dict(matrices)
+    buf = mmap.mmap(-1, total)
+    views: Dict[str, np.ndarray] = {}
+    for name, m in matrices.items():
+        view = np.frombuffer(buf, dtype=m.dtype, count=m.size, offset=offsets[name]).reshape(m.shape)
+        view[...] = m
+        view.flags.writeable = False
+        views[name] = view
+    return buf, views
+
+
+class BookMatrix:
+    """Embeddings and row metadata for a single book."""
+
+    def __init__(self, book: str, ids: np.ndarray, vectors: np.ndarray, norms: np.ndarray, rows: List[Dict[str, Any]]):
+        self.book = book
+        self.ids = ids
+        # Rows are stored unit-normalised so a dot product is a cosine score.
+        self.vectors = vectors
+        self.norms = norms
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+
+class VectorIndex:
+    """Per-book cosine index loaded from a `rag_vectors.db` file.
+
+    The file is loaded lazily on first use and reloaded when its modification
+    time changes, so re-running the offline indexer does not need a restart.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.books: Dict[str, BookMatrix] = {}
+        self.dim: Optional[int] = None
+        self._mtime: Optional[float] = None
+        self._buffer: Optional[mmap.mmap] = None
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return os.path.exists(self.db_path)
+
+    def ensure_loaded(self) -> None:
+        """Load (or reload) the database if it changed on disk."""
+        if not self.available:
+            raise FileNotFoundError(f"Vector database not found: {self.db_path}")
+        mtime = os.path.getmtime(self.db_path)
+        if self._mtime == mtime:
+            return
+        with self._lock:
+            if self._mtime == mtime:
+                return
+            self._load()
+            self._mtime = mtime
+
+    def _load(self) -> None:
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        try:
+            cur = conn.execute(
+                "SELECT c.id, c.book, c.start_page, c.end_page, c.text, e.embedding "
+                "FROM chunks c JOIN embeddings e ON c.id = e.chunk_id "
+                "WHERE e.embedding IS NOT NULL ORDER BY c.book, c.id"
+            )
+            grouped: Dict[str, Dict[str, list]] = {}
+            dim = None
+            skipped = 0
+            for chunk_id, book, start_page, end_page, text, blob in cur:
+                if not blob or len(blob) % 8:
+                    skipped += 1
+                    continue
+                row_dim = len(blob) // 8
+                if dim is None:
+                    dim = row_dim
+                elif row_dim != dim:
+                    skipped += 1
+                    continue
+                g = grouped.setdefault(book or "", {"ids": [], "blobs": [], "rows": []})
+                g["ids"].append(chunk_id)
+                g["blobs"].append(blob)
+                g["rows"].append({
+                    "id": chunk_id,
+                    "book": book,
+                    "start_page": start_page,
+                    "end_page": end_page,
+                    "text": text,
+                })
+        finally:
+            conn.close()
+
+        matrices: Dict[str, np.ndarray] = {}
+        norms: Dict[str, np.ndarray] = {}
+        for book, g in grouped.items():
+            raw = np.frombuffer(b"".join(g["blobs"]), dtype="<f8").reshape(len(g["ids"]), dim)
+            vectors = np.ascontiguousarray(raw, dtype=np.float32)
+            norms[book] = np.linalg.norm(vectors, axis=1)
+            safe = np.where(norms[book] > 0, norms[book], 1.0).astype(np.float32)
+            vectors /= safe[:, None]
+            matrices[book] = vectors
+            g["blobs"] = None
+        buffer, matrices = shared_matrices(matrices)
+        books = {
+            book: BookMatrix(book, np.asarray(g["ids"], dtype=np.int64), matrices[book], norms[book], g["rows"])
+            for book, g in grouped.items()
+        }
+
+        # The previous mapping is released when the last view of it is dropped.
+        self.books = books
+        self._buffer = buffer
+        self.dim = dim
+        logger.info(
+            "[vector_index] loaded %s: books=%d chunks=%d dim=%s skipped=%d",
+            self.db_path, len(books), sum(len(b) for b in books.values()), dim, skipped,
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "db_path": self.db_path,
+            "dim": self.dim,
+            "books": {name: len(b) for name, b in self.books.items()},
+            "shared_bytes": len(self._buffer) if self._buffer is not None else 0,
+        }
+
+    def search(self, queries: Sequence[Sequence[float]], k: int = 5, books: Optional[Sequence[str]] = None,
+               ids: Optional[Sequence[int]] = None) -> List[List[Dict[str, Any]]]:
+        """Cosine top-k for a batch of query vectors.
+
+        Returns one list of hits per query, each hit being the chunk row plus
+        its `score`. When `books` is given only those books are searched; when
+        `ids` is given (e.g. the chunks of a TOC section) only those chunks are
+        scored.
+        """
+        self.ensure_loaded()
+        q = np.asarray(queries, dtype=np.float32)
+        if q.ndim == 1:
+            q = q[None, :]
+        if self.dim is None or not self.books:
+            return [[] for _ in range(q.shape[0])]
+        if q.shape[1] != self.dim:
+            raise ValueError(f"Query dimension {q.shape[1]} does not match index dimension {self.dim}")
+        q_norms = np.linalg.norm(q, axis=1, keepdims=True)
+        q = q / np.where(q_norms > 0, q_norms, 1.0)
+
+        targets = [self.books[b] for b in books if b in self.books] if books else list(self.books.values())
+        if not targets:
+            return [[] for _ in range(q.shape[0])]
+
+        wanted = None if ids is None else np.asarray(ids, dtype=np.int64)
+
+        # Score each book with one matmul, keep its local top-k, then merge.
+        cand_scores = []
+        cand_refs = []
+        for bm in targets:
+            if wanted is None:
+                rows, scores = None, q @ bm.vectors.T
+            else:
+                rows = np.flatnonzero(np.isin(bm.ids, wanted))
+                if not len(rows):
+                    continue
+                scores = q @ bm.vectors[rows].T
+            idx = top_k_indices(scores, k)
+            cand_scores.append(np.take_along_axis(scores, idx, axis=1))
+            if rows is not None:
+                idx = rows[idx]
+            cand_refs.extend((bm, idx, j) for j in range(idx.shape[1]))
+        if not cand_scores:
+            return [[] for _ in range(q.shape[0])]
+
+        merged = np.concatenate(cand_scores, axis=1)
+        best = top_k_indices(merged, k)
+
+        results: List[List[Dict[str, Any]]] = []
+        for qi in range(q.shape[0]):
+            hits = []
+            for col in best[qi]:
+                bm, bm_idx, j = cand_refs[int(col)]
+                row = dict(bm.rows[int(bm_idx[qi, j])])
+                row["score"] = float(merged[qi, col])
+                hits.append(row)
+            results.append(hits)
+        return results
@@ -0,0 +1,85 @@
+# Worker start-up and readiness.
+#
+# Procfile / render.yaml run gunicorn with `--preload`: main.py (and openai,
+# fastapi, numpy) is imported once in the master, and `preload` steps run
+# there too, so the read-only indexes are loaded before the fork and shared
+# by every worker instead of being rebuilt per worker. `gc.freeze()` then moves
+# everything allocated so far out of the collector's reach, so garbage
+# collection in a worker does not touch (and copy) the inherited pages.
+#
+# Steps that must run inside each worker (connections, sockets, threads) are
+# run by `WarmUp.run` from the app lifespan. `/ready` reports 503 until they
+# have all finished, while `/health` only says the process is up.
+
+import gc
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Step = Callable[[], Awaitable[Any]]
+
+
+class WarmUp:
+    """Named warm-up steps and their outcomes, for the /ready probe.
+
+    A failed or timed-out step is recorded but does not keep the worker out of
+    rotation: it can still serve requests, only more slowly at first.
+    """
+
+    def __init__(self) -> None:
+        self.ready = False
+        self.steps: Dict[str, Dict[str, Any]] = {}
+        self._worker_steps: List[Tuple[str, Step, float]] = []
+
+    def _record(self, name: str, started: float, error: Optional[str], detail: Any = None) -> None:
+        entry: Dict[str, Any] = {"ok": error is None, "seconds": round(time.perf_counter() - started, 3)}
+        if error is not None:
+            entry["error"] = error
+            logger.warning("[warmup] %s failed after %.3fs: %s", name, entry["seconds"], error)
+        else:
+            logger.info("[warmup] %s done in %.3fs", name, entry["seconds"])
+        if detail is not None:
+            entry["detail"] = detail
+        self.steps[name] = entry
+
+    def preload(self, name: str, fn: Callable[[], Any]) -> None:
+        """Run `fn` now (in the gunicorn master under --preload). Must not open
+        anything that cannot cross a fork: sockets, threads, SQLite handles."""
+        started = time.perf_counter()
+        try:
+            detail = fn()
+        except Exception as e:
+            self._record(name, started, f"{type(e).__name__}: {e}")
+        else:
+            self._record(name, started, None, detail)
+
+    def freeze(self) -> None:
+        """Exempt objects allocated so far from garbage collection (call last, before the fork)."""
+        gc.collect()
+        gc.freeze()
+
+    def add(self, name: str, fn: Step, timeout: float = 10.0) -> None:
+        """Register an async step for `run` (each worker)."""
+        self._worker_steps.append((name, fn, timeout))
+
+    async def run(self) -> None:
+        """Run the worker steps concurrently, then mark the worker ready."""
+        async def one(name: str, fn: Step, timeout: float) -> None:
+            started = time.perf_counter()
+            try:
+                detail = await asyncio.wait_for(fn(), timeout)
+            except asyncio.TimeoutError:
+                self._record(name, started, f"timed out after {timeout}s")
+            except Exception as e:
+                self._record(name, started, f"{type(e).__name__}: {e}")
+            else:
+                self._record(name, started, None, detail)
+
+        await asyncio.gather(*(one(*step) for step in self._worker_steps))
+        self.ready = True
+
+    def status(self) -> Dict[str, Any]:
+        return {"ready": self.ready, "steps": self.steps}
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+extract_pdf_text.py
+
+Extract the text of guideline PDFs page by page into page-tagged text files
+that tools/index_txt_to_sqlite.py indexes with real page numbers.
+
+Pages are extracted in parallel: each PDF is split into runs of pages that a
+process pool works on, and finished pages are streamed to the output in page
+order as soon as every page before them is done, so a large PDF never has to
+be held in memory whole. The output follows the `pdftotext` convention: pages
+are separated by a form feed (\\f), so page N of the text is page N of the PDF.
+
+Needs the `pypdf` package (pip install -r tools/requirements.txt).
+
+Usage:
+  python tools/extract_pdf_text.py                                  # assets/BooksSource -> assets/txt_books
+  python tools/extract_pdf_text.py --pdf "assets/BooksSource/Zimbabwe Malaria Treatment Guidelines 2015.pdf"
+  python tools/extract_pdf_text.py --pdf assets/BooksSource --out assets/txt_books --workers 8 --force
+
+Arguments:
+  --pdf PATH...    PDF file(s), directories (all *.pdf inside) or glob patterns.
+                   Default: assets/BooksSource
+  --out DIR        Directory for <pdf name>.txt outputs (default: assets/txt_books)
+  --workers N      Extraction processes (default: CPU count)
+  --pages-per-task N  Pages handed to a worker at a time (default: 8)
+  --force          Re-extract even when the text file is newer than the PDF
+
+The indexer can also run this step itself: pass --pdf to
+tools/index_txt_to_sqlite.py.
+"""
+
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+PAGE_BREAK = '\f'
+
+# Runs of blank lines and trailing spaces left by the layout are collapsed.
+_TRAILING_SPACE_RE = re.compile(r'[ \t]+\n')
+_BLANK_LINES_RE = re.compile(r'\n{3,}')
+
+# One open reader per worker process, reused across that worker's tasks.
+_readers = {}
+
+
+def _reader(path: str):
+    reader = _readers.get(path)
+    if reader is None:
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            raise RuntimeError('PDF extraction needs the pypdf package (pip install -r tools/requirements.txt)')
+        reader = _readers[path] = PdfReader(path)
+    return reader
+
+
+def page_count(path: str) -> int:
+    return len(_reader(path).pages)
+
+
+def clean_page_text(text: str) -> str:
+    # A form feed inside a page would shift every later page number.
+    text = (text or '').replace(PAGE_BREAK, '\n').replace('\r\n', '\n')
+    text = _TRAILING_SPACE_RE.sub('\n', text)
+    return _BLANK_LINES_RE.sub('\n\n', text).strip()
+
+
+def extract_page_range(path: str, first: int, last: int):
+    """Worker entry point: texts of pages first..last (0-based, inclusive)."""
+    reader = _reader(path)
+    texts = []
+    for i in range(first, last + 1):
+        try:
+            texts.append(clean_page_text(reader.pages[i].extract_text()))
+        except Exception as e:  # one broken page must not lose the book
+            print(f'WARNING: {path}: page {i + 1}: {e}', file=sys.stderr, flush=True)
+            texts.append('')
+    return first, texts
+
+
+def iter_pdf_pages(path: str, pool: ProcessPoolExecutor, pages_per_task: int = 8, max_pending: int = 64):
+    """Yield (page_number, text) for every page of `path`, 1-based and in order,
+    while later pages are still being extracted by `pool`."""
+    total = page_count(path)
+    step = max(1, pages_per_task)
+    ranges = [(first, min(first + step, total) - 1) for first in range(0, total, step)]
+    pending = {}
+    submitted = 0
+    for first, _ in ranges:
+        # Keep a bounded window of tasks ahead of the page being written.
+        while submitted < len(ranges) and len(pending) < max_pending:
+            f, l = ranges[submitted]
+            pending[f] = pool.submit(extract_page_range, path, f, l)
+            submitted += 1
+        _, texts = pending.pop(first).result()
+        for offset, text in enumerate(texts):
+            yield first + offset + 1, text
+
+
+def write_page_tagged(pages, out_path: Path):
+    """Write (page_number, text) pairs separated by form feeds; returns (pages, empty pages).
+
+    Written to a temporary file first, so an interrupted run never leaves a
+    truncated book behind for the indexer.
+    """
+    tmp = out_path.with_name(out_path.name + '.part')
+    count = empty = 0
+    with open(tmp, 'w', encoding='utf-8') as f:
+        for number, text in pages:
+            if count:
+                f.write(PAGE_BREAK)
+            f.write(text)
+            f.write('\n')
+            count += 1
+            empty += not text
+    os.replace(tmp, out_path)
+    return count, empty
+
+
+def extract_pdf(path: Path, out_path: Path, pool: ProcessPoolExecutor, pages_per_task: int = 8):
+    started = time.perf_counter()
+    count, empty = write_page_tagged(iter_pdf_pages(str(path), pool, pages_per_task), out_path)
+    secs = time.perf_counter() - started
+    print(f'  {path.name}: {count} pages -> {out_path} in {secs:.2f}s'
+          + (f' ({empty} pages without text, e.g. scans)' if empty else ''), flush=True)
+    if count and empty == count:
+        print(f'WARNING: no text layer in {path}; it needs OCR before it can be indexed', file=sys.stderr)
+    return count
+
+
+def needs_extract(pdf: Path, out_path: Path) -> bool:
+    return not out_path.exists() or out_path.stat().st_size == 0 or out_path.stat().st_mtime < pdf.stat().st_mtime
+
+
+def resolve_pdfs(patterns):
+    """Expand files, directories (*.pdf inside) and glob patterns into a sorted file list."""
+    files = []
+    for pattern in patterns:
+        p = Path(pattern)
+        if p.is_dir():
+            files.extend(sorted(p.glob('*.pdf')))
+        elif p.is_file():
+            files.append(p)
+        else:
+            files.extend(Path(m) for m in sorted(glob.glob(pattern)) if Path(m).is_file())
+    return list(dict.fromkeys(files))
+
+
+def extract_all(pdfs, out_dir: Path, workers: int, pages_per_task: int = 8, force: bool = False):
+    """Extract every PDF (all sharing one process pool); returns the text paths."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    outputs = []
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+        for pdf in pdfs:
+            out_path = out_dir / f'{pdf.stem}.txt'
+            if force or needs_extract(pdf, out_path):
+                extract_pdf(pdf, out_path, pool, pages_per_task)
+            else:
+                print(f'  {pdf.name}: up to date ({out_path})', flush=True)
+            outputs.append(out_path)
+    return outputs
+
+
+def main():
+    p = argparse.ArgumentParser(description='Extract page-tagged text from PDFs for the indexer')
+    p.add_argument('--pdf', nargs='+', default=['assets/BooksSource'], help='PDF file(s), directories or glob patterns')
+    p.add_argument('--out', default='assets/txt_books', help='Output directory for .txt files')
+    p.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Extraction processes')
+    p.add_argument('--pages-per-task', type=int, default=8, help='Pages per worker task')
+    p.add_argument('--force', action='store_true', help='Re-extract even if the text is up to date')
+    args = p.parse_args()
+
+    pdfs = resolve_pdfs(args.pdf)
+    if not pdfs:
+        print(f'ERROR: no PDF files found for: {" ".join(args.pdf)}', file=sys.stderr)
+        sys.exit(2)
+    print(f'Extracting {len(pdfs)} PDF(s) -> {args.out} workers={args.workers}')
+    started = time.perf_counter()
+    try:
+        extract_all(pdfs, Path(args.out), args.workers, args.pages_per_task, args.force)
+    except RuntimeError as e:
+        print(f'ERROR: {e}', file=sys.stderr)
+        sys.exit(3)
+    print(f'\n✓ Done in {time.perf_counter() - started:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,34 +2,141 @@
 """
 index_txt_to_sqlite.py
 
-Simple terminal tool to split a text file into small chunks and insert them into
+Simple terminal tool to split text files into small chunks and insert them into
 an SQLite database that follows the `VectorDB` schema used by the Flutter app.
 
-This script does NOT compute embeddings. It inserts rows into the `chunks`
-table only (and leaves `embeddings` empty). This allows testing the indexing
-and retrieval logic from the app using text-only fallback.
+By default this script does NOT compute embeddings. It inserts rows into the
+`chunks` table only (and leaves `embeddings` empty). This allows testing the
+indexing and retrieval logic from the app using text-only fallback.
+
+With --embed it also embeds every chunk that has no embedding yet (through the
+OpenAI API; needs the `openai` package and OPENAI_API_KEY, and honours
+OPENAI_BASE_URL) and stores float64 blobs in exactly the `VectorDB` layout.
+Each finished batch is committed, so an interrupted run resumes where it
+stopped when re-run (use --embed-only to skip re-indexing the text).
 
 Usage:
-  python tools/index_txt_to_sqlite.py --txt assets/txt_books/edliz 2020.txt --db ./test_rag_vectors.db --book "edliz 2020" --chunk-size 500 --overlap 50
+  python tools/index_txt_to_sqlite.py --txt "assets/txt_books/edliz 2020.txt" --db ./test_rag_vectors.db --book "edliz 2020" --chunk-size 500 --overlap 50
+
+Bulk mode (a directory, a glob, or several files; one book per file):
+  python tools/index_txt_to_sqlite.py --txt assets/txt_books --db ./rag_vectors.db --workers 4
+
+Straight from the PDFs (text extracted page by page first, see tools/extract_pdf_text.py):
+  python tools/index_txt_to_sqlite.py --pdf assets/BooksSource --db ./rag_vectors.db
 
 Arguments:
-  --txt PATH       Path to the input text file to index.
+  --txt PATH...    Text file(s), directories (all *.txt inside) or glob patterns to index.
+  --pdf PATH...    PDF file(s), directories (all *.pdf inside) or glob patterns; each is
+                   extracted (in parallel, skipped when up to date) to --pdf-text-dir
+                   and indexed from there. Needs pypdf.
+  --pdf-text-dir D Where extracted text goes (default: assets/txt_books).
   --db PATH        Path to the sqlite DB file to create/append (default: ./rag_vectors.db)
-  --book NAME      Book id/name to store in `chunks.book` (default: basename of txt file)
+  --book NAME      Book id/name to store in `chunks.book` (default: basename of txt file;
+                   only valid with a single input file)
   --chunk-size N   Target chunk size in WORDS (not chars). Default: 500 words per chunk.
-  --overlap N      Overlap between chunks in WORDS. Default: 50 words.
+  --overlap N      Overlap between chunks in WORDS: each chunk starts with the last
+                   whole sentences of the previous one, up to N words. Default: 120.
+  --workers N      Processes used to chunk books in parallel (default: CPU count).
+                   All DB writes happen in the main process.
+  --embed          Embed chunks that have no embedding yet, after indexing.
+  --embed-only     Only run the embedding stage on an existing DB (no --txt needed).
+  --embed-model M  Embedding model (default: text-embedding-3-small).
+  --embed-batch-size N     Max chunks per embeddings request (default: 256, provider max 2048).
+  --embed-max-tokens N     Approx. max tokens per request (default: 250000).
+  --embed-concurrency N    Embedding requests in flight (default: 4).
+
+  --book-version V Version label stored on chunks written by this run
+                   (default: a short hash of the book's content).
+  --fixed-chunks   Cut chunks every --chunk-size words, ignoring sentences (legacy behaviour).
+  --toc-dir DIR    Tables of contents, one per book, named like the book's text file
+                   (default: assets/table_of_contents).
+  --no-toc         Do not tag chunks with TOC chapters/sections.
+  --dry-run        Print the changeset per book without writing anything.
+  --no-fts         Do not create the `chunks_fts` FTS5 index (BM25/hybrid search in the
+                   backend); one that already exists is still kept up to date.
+
+The indexer also maintains `chunks_fts`, an FTS5 index over chunks.text that
+the backend uses for BM25 and hybrid retrieval (`"retrieval": "bm25"` or
+`"hybrid"` on /rag/query and /rag/ask). It is created and filled on the first
+run against an existing DB and then updated with each changeset.
+
+Resume an interrupted embedding run:
+  python tools/index_txt_to_sqlite.py --db ./rag_vectors.db --embed-only
+
+Re-indexing a revised book is incremental: every chunk stores a sha256 of its
+text, and re-running on a book that is already in the DB inserts only chunks
+whose hash is new, deletes chunks (and their embeddings) that disappeared and
+keeps unchanged rows and their embeddings. A changeset summary is printed per
+book, and a following --embed only embeds the inserted chunks.
+
+Chunks end on paragraph breaks and sentence ends, not mid-sentence or in the
+middle of a table row. Which sentence end is content-defined (one whose last
+word hashes to a boundary value, between chunk-size/2 and 2*chunk-size
+words), so an edit in one chapter does not shift the boundaries of all later
+chunks.
+
+Sections: when assets/table_of_contents has a file named like the book's text
+file, its entries are located in the text (by heading, else by printed page
+number) and every chunk is stored with its `chapter` and `section`; a heading
+always starts a new chunk. The backend can then restrict retrieval to a
+section (`"sections": ["13. Malaria"]` on /rag/query and /rag/ask).
+
+Page numbers: text with form feeds between pages (extract_pdf_text.py or
+pdftotext output) gives every chunk its real start_page/end_page. Text without
+them gets the chunk's ordinal as a placeholder page.
 
-Note: Chunking is word-based for efficiency. 
-      Recommended: chunk-size=500-1000 words, overlap=50-100 words.
+Note: Chunk sizes are counted in words.
+      Recommended: chunk-size=500-1000 words, overlap=50-150 words.
       For fast testing: chunk-size=100, overlap=10.
+      Input files are memory-mapped and streamed word by word through a
+      generator, so a book is never held in memory as one Python string.
 """
 
 import argparse
+import glob
+import hashlib
+import mmap
 import os
+import re
 import sqlite3
 import sys
+import time
+import zlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
 from pathlib import Path
 
+# Words, line breaks, and the form feeds that separate pages in pdftotext-style text.
+_TOKEN_RE = re.compile(rb'\S+|\n|\f')
+
+# Strength of the boundary in front of a word; chunks are cut at the strongest one available.
+BREAK_NONE, BREAK_LINE, BREAK_SENTENCE, BREAK_PARAGRAPH = range(4)
+
+_CLOSERS = '"\')]\u201d\u2019'
+_OPENERS = '"\'(\u201c\u2018'
+_BULLETS = frozenset(['•', '-', '–', '*', 'o', '▪', '\uf0b7'])
+_ABBREVIATIONS = frozenset(['e.g.', 'i.e.', 'etc.', 'vs.', 'cf.', 'dr.', 'mr.', 'mrs.', 'no.', 'fig.', 'approx.', 'st.'])
+
+# "Causative agent          17" or "Foreword ........ 2": a title, then an arabic page number.
+_TOC_LINE_RE = re.compile(r'^\s*(.*?\S)[\s.]+(\d{1,4})\s*$')
+_CHAPTER_RE = re.compile(r'^(?:(?:chapter|part|annex|appendix|section)\s*\d+|\d+[a-z]?\.\s)', re.IGNORECASE)
+_NON_ALNUM_RE = re.compile(r'[^a-z0-9]+')
+
+# LISTING_RUN headings in a row, each fewer than LISTING_GAP words after the
+# previous one, are a printed contents listing rather than the headings themselves.
+LISTING_RUN = 4
+LISTING_GAP = 60
+
+# Fewer words than this before a TOC heading are a title, kept with what follows.
+HEADING_WORDS = 20
+
+# Rows per executemany() call during bulk insert.
+INSERT_BATCH = 1000
+
+# Provider limits for one embeddings request.
+EMBED_MAX_INPUTS = 2048
+EMBED_MAX_INPUT_TOKENS = 8191
+
 
 def ensure_schema(conn: sqlite3.Connection):
     c = conn.cursor()
@@ -49,107 +156,865 @@ def ensure_schema(conn: sqlite3.Connection):
       embedding BLOB
     );
     ''')
+    # Columns used for incremental re-indexing; added in place to older DBs.
+    columns = {row[1] for row in c.execute('PRAGMA table_info(chunks)')}
+    if 'content_hash' not in columns:
+        c.execute('ALTER TABLE chunks ADD COLUMN content_hash TEXT')
+    if 'book_version' not in columns:
+        c.execute('ALTER TABLE chunks ADD COLUMN book_version TEXT')
+    # TOC chapter/section of each chunk, for section-filtered retrieval.
+    if 'chapter' not in columns:
+        c.execute('ALTER TABLE chunks ADD COLUMN chapter TEXT')
+    if 'section' not in columns:
+        c.execute('ALTER TABLE chunks ADD COLUMN section TEXT')
     conn.commit()
 
 
-def chunk_text(text: str, chunk_size: int, overlap: int):
+def ensure_meta(conn: sqlite3.Connection):
+    # Key/value table recording how the embeddings were produced and progress.
+    conn.execute('CREATE TABLE IF NOT EXISTS index_meta (key TEXT PRIMARY KEY, value TEXT)')
+    conn.commit()
+
+
+def get_meta(conn: sqlite3.Connection, key: str, default=None):
+    row = conn.execute('SELECT value FROM index_meta WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else default
+
+
+def set_meta(conn: sqlite3.Connection, key: str, value):
+    conn.execute('INSERT OR REPLACE INTO index_meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+
+def ensure_fts(conn: sqlite3.Connection, create: bool = True) -> bool:
+    """Create the `chunks_fts` FTS5 index over chunks.text if possible.
+
+    It is an external-content table (the text is stored once, in `chunks`)
+    that the indexer keeps in step with its own inserts and deletes, so an
+    existing table is always maintained, even when `create` is False
+    (--no-fts): skipping it would leave postings for deleted rows behind.
+    A new table, and an existing one not yet marked `fts_synced` in
+    index_meta (older --no-fts runs could leave it stale), is rebuilt from
+    the chunks.
+    Returns False when there is no table to maintain or no FTS5.
     """
-    Split text into chunks by WORDS sequentially (NO overlap to avoid duplication).
-    chunk_size = number of words per chunk (simple, predictable)
-    This is the fastest and most straightforward approach.
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chunks_fts'").fetchone()
+    if exists:
+        ensure_meta(conn)
+        if get_meta(conn, 'fts_synced') is None:
+            print('  Rebuilding chunks_fts (it may be out of date)...', flush=True)
+            with conn:
+                conn.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild')")
+                set_meta(conn, 'fts_synced', 1)
+        return True
+    if not create:
+        return False
+    try:
+        with conn:
+            conn.execute(
+                "CREATE VIRTUAL TABLE chunks_fts USING fts5("
+                "text, content='chunks', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+            )
+            conn.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild')")
+            ensure_meta(conn)
+            set_meta(conn, 'fts_synced', 1)
+    except sqlite3.OperationalError as e:
+        print(f'WARNING: FTS5 not available ({e}); skipping the lexical index', file=sys.stderr)
+        return False
+    return True
+
+
+def ensure_indexes(conn: sqlite3.Connection):
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chunks_book_hash ON chunks(book, content_hash)')
+    # Created after the bulk load so inserts don't pay for index maintenance.
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chunks_book ON chunks(book)')
+    conn.commit()
+
+
+def open_db(db_path: Path, dry_run: bool = False) -> sqlite3.Connection:
+    """Open (or create) the DB; a dry run opens it read-only, so it reports on
+    the file without changing its schema, journal mode or contents."""
+    if not dry_run:
+        return sqlite3.connect(str(db_path))
+    if db_path.exists():
+        return sqlite3.connect(db_path.resolve().as_uri() + '?mode=ro', uri=True)
+    # Nothing indexed yet: compare against an empty in-memory schema.
+    conn = sqlite3.connect(':memory:')
+    ensure_schema(conn)
+    return conn
+
+
+def begin_bulk_load(conn: sqlite3.Connection, synchronous: str = 'OFF'):
+    """Tune the connection for a large load.
+
+    The chunk load uses synchronous=OFF: it is one pass that a failed run
+    simply repeats. The embed stage passes NORMAL instead, since its committed
+    batches are what --embed-only resumes from; under WAL, NORMAL keeps them
+    across a power loss at the cost of an fsync per checkpoint, not per batch.
+    """
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(f'PRAGMA synchronous={synchronous}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-65536')  # 64 MB page cache
+
+
+def end_bulk_load(conn: sqlite3.Connection):
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+
+def iter_tokens(buf):
+    """Yield (word, page, brk) for UTF-8 text in `buf` (bytes or a memory map).
+
+    `brk` is the strongest boundary between the previous word and this one:
+    BREAK_NONE, BREAK_LINE, BREAK_SENTENCE or BREAK_PARAGRAPH (a blank line).
+    Pages are counted from 1 at each form feed (tools/extract_pdf_text.py and
+    pdftotext output); in text without form feeds the page is None.
+    """
+    page = 1 if buf.find(b'\f') != -1 else None
+    newlines = 0
+    prev = None
+    for m in _TOKEN_RE.finditer(buf):
+        token = m.group()
+        if token == b'\n':
+            newlines += 1
+            continue
+        if token == b'\f':
+            page += 1
+            newlines = max(newlines, 1)
+            continue
+        word = token.decode('utf-8', errors='ignore')
+        if prev is None or newlines > 1:
+            brk = BREAK_PARAGRAPH
+        elif (ends_sentence(prev) and starts_sentence(word)) or (newlines and word in _BULLETS):
+            brk = BREAK_SENTENCE
+        else:
+            brk = BREAK_LINE if newlines else BREAK_NONE
+        newlines = 0
+        prev = word
+        yield word, page, brk
+
+
+def iter_file_tokens(path: Path):
+    """`iter_tokens` over a memory map of a text file, so a book is never read
+    into one Python string."""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield from iter_tokens(mm)
+
+
+def ends_sentence(word: str) -> bool:
+    stripped = word.rstrip(_CLOSERS)
+    if not stripped or stripped[-1] not in '.?!':
+        return False
+    # "e.g." / "Dr." / "J." end with a dot but not a sentence.
+    return stripped.lower() not in _ABBREVIATIONS and not (len(stripped) == 2 and stripped[0].isalpha())
+
+
+def starts_sentence(word: str) -> bool:
+    first = word.lstrip(_OPENERS)[:1]
+    return first.isupper() or first.isdigit() or word in _BULLETS
+
+
+def normalize_heading(text: str) -> str:
+    # "CHAPTER1:Executive Summary" and "Chapter 1: Executive summary." compare equal.
+    return _NON_ALNUM_RE.sub('', text.lower())
+
+
+class TocEntry:
+    """One table-of-contents line: its title, printed page and the chapter it
+    belongs to (`section` is None for the chapter heading itself)."""
+
+    def __init__(self, title: str, page: int, chapter: str, section):
+        self.title = title
+        self.page = page
+        self.chapter = chapter
+        self.section = section
+        self.key = normalize_heading(title)
+
+    def __repr__(self):
+        return f'TocEntry({self.title!r}, page={self.page})'
+
+
+def load_toc(path: Path):
+    """Parse an assets/table_of_contents file into TocEntry objects.
+
+    A line is "<title>  <page>". Titles starting with "Chapter 3", "Part 1",
+    "Annex 2" or "13." open a chapter; other lines are sections of the chapter
+    above them (front matter before the first chapter is a chapter of its own).
+    Lines with roman page numbers (front matter) have no page and are skipped.
+    """
+    entries = []
+    chapter = None
+    with open(path, encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            m = _TOC_LINE_RE.match(line)
+            if not m:
+                continue
+            title = m.group(1).rstrip(' .')
+            if not any(ch.isalpha() for ch in title) or normalize_heading(title) == 'tableofcontents':
+                continue
+            if _CHAPTER_RE.match(title) or chapter is None:
+                chapter = title
+                entries.append(TocEntry(title, int(m.group(2)), chapter, None))
+            else:
+                entries.append(TocEntry(title, int(m.group(2)), chapter, title))
+    return entries
+
+
+def toc_boundaries(tokens, entries, lookahead: int = 40):
+    """Locate TOC entries in a book; returns sorted (word_index, chapter, section).
+
+    Headings are found by comparing each line of the text (and each pair of
+    lines, for wrapped titles) with the entries still ahead, in order, so a
+    stray "Introduction" far from its chapter does not match. A run of
+    headings only a few words apart is the book's own contents listing: those
+    matches are dropped and the entries are looked for again further on. In
+    page-tagged text an entry is not accepted before its printed
+    page plus the offset seen at the previous heading; entries whose heading
+    was not found start on that page instead. Printed and PDF page numbers
+    often drift apart through a book, so offsets follow the last match.
+
+    Returns [] when fewer than two headings are found: the TOC then does not
+    describe this text (another edition, or not a TOC at all).
+    """
+    if not entries:
+        return []
+    keys = {}
+    for i, entry in enumerate(entries):
+        keys.setdefault(entry.key, []).append(i)
+
+    matched = {}  # entry index -> (word index, pdf page)
+    page_starts = {}
+    nxt = 0  # first entry that may still match
+    offset = 0
+    line, line_start, line_page = [], 0, None
+    prev_key, prev_start = '', 0
+    run, run_offset = [], 0  # consecutive matches less than LISTING_GAP words apart
+    listing_end = None  # last heading seen inside a contents listing
+
+    def close_line():
+        nonlocal nxt, offset, prev_key, prev_start, run, run_offset, listing_end
+        key = normalize_heading(' '.join(line))
+        for candidate, start in ((key, line_start), (prev_key + key, prev_start)):
+            for i in keys.get(candidate, ()):
+                if nxt <= i < nxt + lookahead and (
+                    line_page is None or line_page >= entries[i].page + offset - 1
+                ):
+                    prev_key = ''
+                    if listing_end is not None and start - listing_end < LISTING_GAP:
+                        listing_end = start
+                        return
+                    if run and start - matched[run[-1]][0] < LISTING_GAP:
+                        run.append(i)
+                    else:
+                        run, run_offset = [i], offset
+                    matched[i] = (start, line_page)
+                    if line_page is not None:
+                        offset = line_page - entries[i].page
+                    nxt = i + 1
+                    if len(run) >= LISTING_RUN:
+                        for j in run:
+                            del matched[j]
+                        nxt, offset, listing_end, run = run[0], run_offset, start, []
+                    return
+        prev_key, prev_start = key, line_start
+
+    index = 0
+    for word, page, brk in tokens:
+        if brk != BREAK_NONE and line:
+            close_line()
+            line = []
+        if not line:
+            line_start, line_page = index, page
+        if page is not None and page not in page_starts:
+            page_starts[page] = index
+        line.append(word)
+        index += 1
+    if line:
+        close_line()
+    if len(matched) < 2:
+        return []
+
+    bounds = []
+    anchor_pos, anchor_offset = 0, 0
+    for i, entry in enumerate(entries):
+        if i in matched:
+            anchor_pos, page = matched[i]
+            if page is not None:
+                anchor_offset = page - entry.page
+            pos = anchor_pos
+        elif page_starts:
+            page = entry.page + anchor_offset
+            pos = page_starts.get(page)
+            if pos is None:
+                continue
+            later = [matched[j][0] for j in matched if j > i]
+            if pos < anchor_pos or (later and pos > min(later)):
+                continue
+        else:
+            continue
+        bounds.append((pos, entry.chapter, entry.section))
+    bounds.sort(key=lambda b: b[0])
+    return bounds
+
+
+def book_boundaries(path: Path, toc_dir):
+    """TOC boundaries for a book file, from `<toc_dir>/<file name>` if present."""
+    if not toc_dir:
+        return []
+    toc_path = Path(toc_dir) / path.name
+    if not toc_path.is_file():
+        return []
+    return toc_boundaries(iter_file_tokens(path), load_toc(toc_path))
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def is_boundary(word: str, divisor: int) -> bool:
+    # crc32 rather than hash(): it must be stable across processes and runs.
+    return zlib.crc32(word.encode('utf-8')) % divisor == 0
+
+
+def overlap_start(brks, end: int, overlap: int) -> int:
+    """Where the overlap carried into the next chunk starts: the first sentence
+    that begins within the last `overlap` words before `end` (or exactly
+    `overlap` words back when no sentence starts there)."""
+    if overlap <= 0:
+        return end
+    lo = max(1, end - overlap)
+    for j in range(lo, end):
+        if brks[j] >= BREAK_SENTENCE:
+            return j
+    return lo
+
+
+def iter_chunks(tokens, chunk_size: int, overlap: int, content_defined: bool = True, boundaries=()):
+    """
+    Group (word, page, brk) tokens (see `iter_tokens`) into chunks of about
+    `chunk_size` words. Yields (start_word, end_word, text, start_page,
+    end_page, chapter, section) tuples; pages are None when the text had none,
+    chapter/section are None without TOC `boundaries` (see `toc_boundaries`).
+
+    Chunks end on a structural boundary: with `content_defined`, at the first
+    paragraph break after chunk_size/2 words or at a sentence end whose word
+    hashes to a boundary value, so inserting or deleting text only changes the
+    chunks around the edit. A chunk that reaches 2*chunk_size words is cut at
+    its last sentence end (else line break) after chunk_size/2 words. Otherwise
+    chunks are cut every `chunk_size` words. A TOC heading always starts a new
+    chunk, unless all that precedes it is another heading.
+
+    Each chunk after the first starts with the whole sentences that ended the
+    previous one, up to `overlap` words (not across a TOC heading), so a
+    sentence cut off at a boundary is still seen whole by one of the chunks.
     """
     if chunk_size <= 0:
         raise ValueError('chunk_size must be > 0')
-    
-    # Split into words
-    words = text.split()
-    if not words:
-        return []
-    
-    print(f'  Text has {len(words)} words. Creating chunks of {chunk_size} words (no overlap)...', flush=True)
-    
-    chunks = []
-    for i in range(0, len(words), chunk_size):
-        end = min(i + chunk_size, len(words))
-        chunk_words = words[i:end]
-        chunk_text = ' '.join(chunk_words)
-        if chunk_text.strip():
-            chunks.append((i, end, chunk_text))
-        
-        # Print progress every 50 chunks
-        if len(chunks) % 50 == 0:
-            pct = int(100 * end / len(words))
-            print(f'    Progress: {len(chunks)} chunks, {pct}% done...', flush=True)
-    
-    print(f'  Created {len(chunks)} chunks total.', flush=True)
+
+    min_words = max(1, chunk_size // 2)
+    max_words = chunk_size * 2
+    # Sentence ends come about every 20 words; aim for a cut around chunk_size.
+    divisor = max(1, (chunk_size - min_words) // 20)
+    # The carried overlap must leave room for new words before the next cut.
+    overlap = max(0, min(overlap, min_words - 1))
+
+    bounds = iter(boundaries)
+    next_bound = next(bounds, None)
+    chapter = section = None
+    tag = (None, None)
+    words, pages, brks = [], [], []
+    carried = 0
+    start = 0
+    titled = True  # no cut since the last heading (or the start of the book)
+
+    def emit(end):
+        return (start, start + end, ' '.join(words[:end]), pages[0], pages[end - 1]) + tag
+
+    for index, (word, page, brk) in enumerate(tokens):
+        heading = False
+        while next_bound is not None and next_bound[0] <= index:
+            heading = True
+            chapter, section = next_bound[1], next_bound[2]
+            next_bound = next(bounds, None)
+
+        n = len(words)
+        if heading and titled and n - carried < HEADING_WORDS:
+            # Only a title since the last heading (a chapter title right above
+            # its first section): it belongs to the chunk that follows.
+            heading = False
+            start += carried
+            del words[:carried], pages[:carried], brks[:carried]
+            carried = 0
+            n = len(words)
+            tag = (chapter, section)
+        cut = None
+        if n > carried:
+            if heading or (not content_defined and n >= chunk_size):
+                cut = n
+            elif content_defined and n >= min_words and (
+                brk == BREAK_PARAGRAPH or (brk == BREAK_SENTENCE and is_boundary(words[-1], divisor))
+            ):
+                cut = n
+            elif content_defined and n >= max_words:
+                cut = n
+                for level in (BREAK_SENTENCE, BREAK_LINE):
+                    best = max((j for j in range(max(carried + 1, min_words), n) if brks[j] >= level), default=None)
+                    if best is not None:
+                        cut = best
+                        break
+        if cut is not None:
+            yield emit(cut)
+            keep = cut if heading else overlap_start(brks, cut, overlap)
+            start += keep
+            carried = cut - keep
+            titled = False
+            del words[:keep], pages[:keep], brks[:keep]
+        if heading:
+            # Nothing from before a heading is carried into its chunk.
+            start += len(words)
+            carried = 0
+            words, pages, brks = [], [], []
+            titled = True
+        if len(words) == carried:
+            tag = (chapter, section)
+        words.append(word)
+        pages.append(page)
+        brks.append(brk)
+    if len(words) > carried:
+        yield emit(len(words))
+
+
+def chunk_text(text: str, chunk_size: int, overlap: int, content_defined: bool = True):
+    """Split a string into chunks (see `iter_chunks`); returns a list."""
+    chunks = list(iter_chunks(iter_tokens(text.encode('utf-8')), chunk_size, overlap, content_defined))
+    print(f'  Created {len(chunks)} chunks of ~{chunk_size} words ({overlap} words overlap).', flush=True)
     return chunks
 
 
+def chunk_file(path: str, book: str, chunk_size: int, overlap: int, content_defined: bool = True, toc_dir=None):
+    """Worker entry point: chunk and hash one book file.
 
-def insert_chunks(conn: sqlite3.Connection, book: str, chunks):
-    c = conn.cursor()
-    inserted = 0
-    total = len(chunks)
-    print(f'  Inserting {total} chunks into DB...', flush=True)
-    for i, (start, end, chunk) in enumerate(chunks):
-        # Using start_page/end_page placeholders (1-based chunk index)
-        sp = i + 1
-        ep = sp
-        c.execute('INSERT INTO chunks (book, start_page, end_page, text) VALUES (?, ?, ?, ?)', (book, sp, ep, chunk))
-        inserted += 1
-        # Print progress every 10% and commit in batches to avoid memory buildup
-        if (i + 1) % max(1, total // 10) == 0:
-            pct = int(100 * (i + 1) / total)
-            print(f'    Inserted {i + 1}/{total} ({pct}%)...', flush=True)
-            conn.commit()  # Commit batch to prevent huge transaction
-    conn.commit()
-    print(f'  Completed: inserted {inserted} chunks.', flush=True)
-    return inserted
+    The file is scanned twice: once to place its TOC headings (when
+    `<toc_dir>/<file name>` exists), then to stream the chunks.
+    Returns (book, path, chunks, hashes, sections found, seconds).
+    """
+    started = time.perf_counter()
+    boundaries = book_boundaries(Path(path), toc_dir)
+    chunks = list(iter_chunks(iter_file_tokens(Path(path)), chunk_size, overlap, content_defined, boundaries))
+    hashes = [content_hash(chunk[2]) for chunk in chunks]
+    return book, path, chunks, hashes, len(boundaries), time.perf_counter() - started
+
+
+def book_content_version(hashes) -> str:
+    """Default book version: a short digest of the book's chunk hashes."""
+    h = hashlib.sha256()
+    for digest in hashes:
+        h.update(digest.encode('ascii'))
+    return h.hexdigest()[:12]
+
+
+def backfill_hashes(conn: sqlite3.Connection, book: str):
+    """Hash rows written before content hashes existed."""
+    rows = conn.execute('SELECT id, text FROM chunks WHERE book = ? AND content_hash IS NULL', (book,)).fetchall()
+    if rows:
+        conn.executemany('UPDATE chunks SET content_hash = ? WHERE id = ?',
+                         [(content_hash(text or ''), chunk_id) for chunk_id, text in rows])
+    return len(rows)
+
+
+def sync_book(conn: sqlite3.Connection, book: str, chunks, hashes, version: str, dry_run: bool = False, fts: bool = False):
+    """Bring the stored chunks of `book` in line with `chunks`.
+
+    Unchanged chunks (same content hash) keep their row id and embedding; only
+    their pages and TOC chapter/section are updated if they moved. Chunks of
+    text without page breaks get their 1-based ordinal as a page placeholder
+    when inserted, which is not updated when an edit elsewhere shifts it.
+    Chunks that are gone are deleted together with their embeddings; new ones
+    are inserted. With `fts` the same changes are applied to `chunks_fts`.
+    With `dry_run` nothing is written, and columns an older schema lacks are
+    read as NULL (hashes are then computed from the text).
+    Returns the changeset as a dict of counts.
+    """
+    with conn:  # one transaction per book
+        backfilled = 0 if dry_run else backfill_hashes(conn, book)
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(chunks)')}
+        select = ', '.join(
+            c if c in columns else 'NULL'
+            for c in ('id', 'content_hash', 'start_page', 'end_page', 'chapter', 'section', 'text')
+        )
+        existing = {}
+        for chunk_id, digest, start_page, end_page, chapter, section, text in conn.execute(
+            f'SELECT {select} FROM chunks WHERE book = ? ORDER BY id', (book,)
+        ):
+            digest = digest or content_hash(text or '')
+            existing.setdefault(digest, []).append((chunk_id, (start_page, end_page, chapter, section), text))
+
+        inserts, moves = [], []
+        for i, ((start, end, text, first_page, last_page, chapter, section), digest) in enumerate(zip(chunks, hashes)):
+            if first_page is None:
+                first_page = last_page = i + 1
+                paged = False
+            else:
+                paged = True
+            place = (first_page, last_page, chapter, section)
+            rows = existing.get(digest)
+            if rows:
+                chunk_id, stored, _ = rows.pop(0)
+                if not paged:
+                    # An ordinal placeholder shifts with every edit above the
+                    # chunk: keep the stored one, only the TOC tags can move.
+                    place = stored[:2] + place[2:]
+                if stored != place:
+                    moves.append(place + (chunk_id,))
+            else:
+                inserts.append((book, first_page, last_page, chapter, section, text, digest, version))
+        removed = [(chunk_id, text) for rows in existing.values() for chunk_id, _, text in rows]
+        deletes = [(chunk_id,) for chunk_id, _ in removed]
+
+        kept_embedded = conn.execute(
+            'SELECT COUNT(*) FROM chunks c JOIN embeddings e ON c.id = e.chunk_id WHERE c.book = ?', (book,)
+        ).fetchone()[0]
+        removed_embedded = 0
+        for i in range(0, len(deletes), INSERT_BATCH):
+            ids = [d[0] for d in deletes[i:i + INSERT_BATCH]]
+            marks = ','.join('?' * len(ids))
+            removed_embedded += conn.execute(
+                f'SELECT COUNT(*) FROM embeddings WHERE chunk_id IN ({marks})', ids
+            ).fetchone()[0]
+
+        if not dry_run:
+            if fts and removed:
+                # External-content FTS needs the old text to remove its postings.
+                conn.executemany("INSERT INTO chunks_fts(chunks_fts, rowid, text) VALUES ('delete', ?, ?)", removed)
+            for i in range(0, len(deletes), INSERT_BATCH):
+                batch = deletes[i:i + INSERT_BATCH]
+                conn.executemany('DELETE FROM embeddings WHERE chunk_id = ?', batch)
+                conn.executemany('DELETE FROM chunks WHERE id = ?', batch)
+            last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM chunks').fetchone()[0]
+            for i in range(0, len(moves), INSERT_BATCH):
+                conn.executemany(
+                    'UPDATE chunks SET start_page = ?, end_page = ?, chapter = ?, section = ? WHERE id = ?',
+                    moves[i:i + INSERT_BATCH],
+                )
+            for i in range(0, len(inserts), INSERT_BATCH):
+                conn.executemany(
+                    'INSERT INTO chunks (book, start_page, end_page, chapter, section, text, content_hash, book_version) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    inserts[i:i + INSERT_BATCH],
+                )
+            if fts and inserts:
+                # AUTOINCREMENT ids only grow, so the new rows are those past last_id.
+                conn.execute(
+                    'INSERT INTO chunks_fts(rowid, text) SELECT id, text FROM chunks WHERE id > ? AND book = ?',
+                    (last_id, book),
+                )
+            ensure_meta(conn)
+            set_meta(conn, f'book_version:{book}', version)
+
+    return {
+        'total': len(chunks),
+        'inserted': len(inserts),
+        'deleted': len(deletes),
+        'unchanged': len(chunks) - len(inserts),
+        'moved': len(moves),
+        'backfilled': backfilled,
+        'embeddings_kept': kept_embedded - removed_embedded,
+        'embeddings_dropped': removed_embedded,
+    }
+
+
+def print_changeset(book: str, version: str, change, dry_run: bool = False):
+    prefix = '  [dry run] ' if dry_run else '  '
+    print(f'{prefix}Book "{book}" @ {version}: +{change["inserted"]} inserted, -{change["deleted"]} deleted, '
+          f'{change["unchanged"]} unchanged ({change["moved"]} moved); '
+          f'{change["embeddings_kept"]} embeddings kept, {change["embeddings_dropped"]} dropped, '
+          f'{change["inserted"]} to embed', flush=True)
+
+
+def vector_to_blob(vec) -> bytes:
+    """Encode a vector as little-endian float64 bytes (the `VectorDB` blob layout)."""
+    a = array('d', vec)
+    if sys.byteorder != 'little':
+        a.byteswap()
+    return a.tobytes()
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text; only used for batch sizing.
+    return len(text) // 4 + 1
+
+
+def pending_chunk_ids(conn: sqlite3.Connection):
+    """Ids of chunks that have no embedding yet (the resume point)."""
+    rows = conn.execute(
+        'SELECT c.id FROM chunks c LEFT JOIN embeddings e ON c.id = e.chunk_id '
+        'WHERE e.chunk_id IS NULL ORDER BY c.id'
+    )
+    return [r[0] for r in rows]
+
+
+def iter_embed_batches(conn: sqlite3.Connection, chunk_ids, batch_size: int, max_tokens: int):
+    """Yield lists of (chunk_id, text) capped by input count and estimated tokens.
+
+    Texts are read in slices of ids so the whole corpus is never held in memory.
+    """
+    batch, tokens = [], 0
+    for start in range(0, len(chunk_ids), 500):
+        ids = chunk_ids[start:start + 500]
+        marks = ','.join('?' * len(ids))
+        rows = conn.execute(f'SELECT id, text FROM chunks WHERE id IN ({marks}) ORDER BY id', ids).fetchall()
+        for chunk_id, text in rows:
+            text = text or ' '
+            # The API rejects single inputs over the per-input token limit.
+            if estimate_tokens(text) > EMBED_MAX_INPUT_TOKENS:
+                text = text[:EMBED_MAX_INPUT_TOKENS * 4]
+            t = estimate_tokens(text)
+            if batch and (len(batch) >= batch_size or tokens + t > max_tokens):
+                yield batch
+                batch, tokens = [], 0
+            batch.append((chunk_id, text))
+            tokens += t
+    if batch:
+        yield batch
+
+
+def embed_pending(conn: sqlite3.Connection, model: str, batch_size: int, max_tokens: int, concurrency: int):
+    """Embed every chunk without an embedding; commits after each batch."""
+    try:
+        from openai import OpenAI
+    except ImportError:
+        raise RuntimeError('the embedding stage needs the openai package (pip install -r tools/requirements.txt)')
+
+    ensure_meta(conn)
+    stored_model = get_meta(conn, 'embedding_model')
+    has_embeddings = conn.execute('SELECT 1 FROM embeddings LIMIT 1').fetchone() is not None
+    if stored_model and stored_model != model and has_embeddings:
+        raise RuntimeError(f'DB already holds {stored_model} embeddings; refusing to mix in {model}')
+
+    chunk_ids = pending_chunk_ids(conn)
+    pending = len(chunk_ids)
+    done_before = conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+    print(f'  {pending} chunks to embed ({done_before} already embedded) with {model}...', flush=True)
+    if pending == 0:
+        return 0
+
+    with conn:
+        set_meta(conn, 'embedding_model', model)
+        set_meta(conn, 'embedding_layout', 'float64-le')
+
+    client = OpenAI(max_retries=6)  # SDK retries 429s/timeouts with backoff
+    batch_size = max(1, min(batch_size, EMBED_MAX_INPUTS))
+    started = time.perf_counter()
+
+    def embed_batch(batch):
+        response = client.embeddings.create(model=model, input=[text for _, text in batch], timeout=120)
+        return [(chunk_id, item.embedding) for (chunk_id, _), item in zip(batch, response.data)]
+
+    embedded = 0
+    dim = None
+    batches = iter_embed_batches(conn, chunk_ids, batch_size, max_tokens)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        in_flight = set()
+        exhausted = False
+        while in_flight or not exhausted:
+            # Keep a bounded number of requests in flight; HTTP runs in threads,
+            # all writes happen here on the main thread.
+            while not exhausted and len(in_flight) < concurrency * 2:
+                batch = next(batches, None)
+                if batch is None:
+                    exhausted = True
+                    break
+                in_flight.add(pool.submit(embed_batch, batch))
+            if not in_flight:
+                break
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for fut in done:
+                rows = fut.result()
+                if rows and dim is None:
+                    dim = len(rows[0][1])
+                with conn:  # checkpoint: each batch is committed as soon as it lands
+                    conn.executemany(
+                        'INSERT OR REPLACE INTO embeddings (chunk_id, embedding) VALUES (?, ?)',
+                        [(chunk_id, vector_to_blob(vec)) for chunk_id, vec in rows],
+                    )
+                    set_meta(conn, 'embedding_dim', dim)
+                    set_meta(conn, 'embedded_chunks', done_before + embedded + len(rows))
+                embedded += len(rows)
+                rate = embedded / max(time.perf_counter() - started, 1e-9)
+                print(f'    Embedded {embedded}/{pending} ({int(100 * embedded / pending)}%, {rate:.0f} chunks/s)...', flush=True)
+    return embedded
+
+
+def resolve_inputs(patterns):
+    """Expand files, directories (*.txt inside) and glob patterns into a sorted file list."""
+    files = []
+    for pattern in patterns:
+        p = Path(pattern)
+        if p.is_dir():
+            files.extend(sorted(p.glob('*.txt')))
+        elif p.is_file():
+            files.append(p)
+        else:
+            files.extend(Path(m) for m in sorted(glob.glob(pattern)) if Path(m).is_file())
+    seen = set()
+    unique = []
+    for f in files:
+        key = f.resolve()
+        if key not in seen:
+            seen.add(key)
+            unique.append(f)
+    return unique
 
 
 def main():
-    p = argparse.ArgumentParser(description='Index a txt file into an sqlite DB (chunks only)')
-    p.add_argument('--txt', required=True, help='Path to txt file')
+    p = argparse.ArgumentParser(description='Index txt files into an sqlite DB (optionally embedding the chunks)')
+    p.add_argument('--txt', nargs='+', help='Text file(s), directories or glob patterns')
+    p.add_argument('--pdf', nargs='+', help='PDF file(s), directories or glob patterns (extracted first)')
+    p.add_argument('--pdf-text-dir', default='assets/txt_books', help='Directory for text extracted from --pdf')
     p.add_argument('--db', default='rag_vectors.db', help='Path to sqlite DB file')
-    p.add_argument('--book', default=None, help='Book id/name to use in DB')
-    p.add_argument('--chunk-size', type=int, default=800, help='Target chunk size (chars)')
-    p.add_argument('--overlap', type=int, default=120, help='Overlap between chunks (chars)')
+    p.add_argument('--book', default=None, help='Book id/name to use in DB (single input only)')
+    p.add_argument('--chunk-size', type=int, default=800, help='Target chunk size (words)')
+    p.add_argument('--overlap', type=int, default=120, help='Overlap between chunks (words)')
+    p.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Parallel chunking processes')
+    p.add_argument('--book-version', default=None, help='Version label for chunks written by this run')
+    p.add_argument('--fixed-chunks', action='store_true', help='Cut chunks every --chunk-size words, ignoring structure')
+    p.add_argument('--toc-dir', default='assets/table_of_contents', help='Directory of <book file name> TOC files')
+    p.add_argument('--no-toc', action='store_true', help='Do not tag chunks with TOC chapters/sections')
+    p.add_argument('--dry-run', action='store_true', help='Print the changeset without writing')
+    p.add_argument('--no-fts', action='store_true', help='Do not create the chunks_fts lexical index')
+    p.add_argument('--embed', action='store_true', help='Embed chunks that have no embedding yet')
+    p.add_argument('--embed-only', action='store_true', help='Skip indexing; only embed pending chunks in --db')
+    p.add_argument('--embed-model', default='text-embedding-3-small', help='Embedding model')
+    p.add_argument('--embed-batch-size', type=int, default=256, help=f'Max chunks per request (<= {EMBED_MAX_INPUTS})')
+    p.add_argument('--embed-max-tokens', type=int, default=250000, help='Approx. max tokens per request')
+    p.add_argument('--embed-concurrency', type=int, default=4, help='Embedding requests in flight')
 
     args = p.parse_args()
 
-    txt_path = Path(args.txt)
-    if not txt_path.exists():
-        print(f'ERROR: txt file not found: {txt_path}', file=sys.stderr)
+    if args.embed_only:
+        run_embed_stage(Path(args.db), args)
+        return
+    if not args.txt and not args.pdf:
+        p.error('--txt or --pdf is required unless --embed-only is given')
+
+    files = resolve_inputs(args.txt or [])
+    if args.pdf:
+        files = list(dict.fromkeys(files + extract_pdf_inputs(args)))
+    if not files:
+        print(f'ERROR: no input files found for: {" ".join((args.txt or []) + (args.pdf or []))}', file=sys.stderr)
+        sys.exit(2)
+    if args.book and len(files) > 1:
+        print('ERROR: --book can only be used with a single input file', file=sys.stderr)
         sys.exit(2)
 
-    book = args.book or txt_path.stem
     db_path = Path(args.db)
-
-    print(f'Indexing {txt_path} -> {db_path} as book="{book}" chunk_size={args.chunk_size} overlap={args.overlap}')
-    print('Step 1: Reading text file...')
-    text = txt_path.read_text(encoding='utf-8', errors='ignore')
-    if not text.strip():
+    books = []
+    for f in files:
+        if f.stat().st_size == 0:
+            print(f'WARNING: skipping empty file: {f}', file=sys.stderr)
+            continue
+        books.append((args.book or f.stem, f))
+    if not books:
         print('ERROR: input text is empty', file=sys.stderr)
         sys.exit(3)
-    print(f'  Read {len(text)} characters.')
 
-    print('Step 2: Creating chunks...')
-    chunks = chunk_text(text, args.chunk_size, args.overlap)
-    print(f'Generated {len(chunks)} chunks (approx).')
+    print(f'Indexing {len(books)} book(s) -> {db_path} chunk_size={args.chunk_size} overlap={args.overlap} workers={args.workers}')
+    started = time.perf_counter()
 
-    print('Step 3: Opening/creating database...')
-    conn = sqlite3.connect(str(db_path))
+    print('Step 1: Opening/creating database...' if not args.dry_run else 'Step 1: Opening database read-only (dry run)...')
+    conn = open_db(db_path, args.dry_run)
+    totals = {'inserted': 0, 'deleted': 0, 'unchanged': 0, 'moved': 0, 'embeddings_kept': 0, 'embeddings_dropped': 0}
     try:
-        print('  Ensuring schema...')
-        ensure_schema(conn)
-        print('Step 4: Inserting chunks...')
-        inserted = insert_chunks(conn, book, chunks)
-        print(f'\n✓ Success! Inserted {inserted} chunks into {db_path}')
+        fts = False
+        if not args.dry_run:
+            print('  Ensuring schema...')
+            ensure_schema(conn)
+            begin_bulk_load(conn)
+            fts = ensure_fts(conn, create=not args.no_fts)
+
+        print('Step 2: Chunking books and syncing chunks...')
+        # Books are chunked and hashed in worker processes; this process is the single writer.
+        workers = max(1, min(args.workers, len(books)))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(chunk_file, str(path), book, args.chunk_size, args.overlap, not args.fixed_chunks,
+                            None if args.no_toc else args.toc_dir)
+                for book, path in books
+            ]
+            for fut in as_completed(futures):
+                book, path, chunks, hashes, sections, secs = fut.result()
+                tagged = f', {sections} TOC sections' if sections else ''
+                print(f'  Book "{book}": {len(chunks)} chunks from {path}{tagged} (chunked in {secs:.2f}s)', flush=True)
+                if not chunks:
+                    print(f'WARNING: no text in {path}', file=sys.stderr)
+                    continue
+                version = args.book_version or book_content_version(hashes)
+                change = sync_book(conn, book, chunks, hashes, version, dry_run=args.dry_run, fts=fts)
+                print_changeset(book, version, change, args.dry_run)
+                for key in totals:
+                    totals[key] += change[key]
+
+        if not args.dry_run:
+            print('Step 3: Building indexes...')
+            ensure_indexes(conn)
+            end_bulk_load(conn)
+        elapsed = time.perf_counter() - started
+        print(f'\n{"Dry run" if args.dry_run else "✓ Success!"} {len(books)} book(s) in {db_path}: '
+              f'+{totals["inserted"]} inserted, -{totals["deleted"]} deleted, {totals["unchanged"]} unchanged '
+              f'({totals["moved"]} moved), {totals["embeddings_kept"]} embeddings kept in {elapsed:.2f}s')
     except Exception as e:
         print(f'\nERROR during insertion: {e}', file=sys.stderr)
         sys.exit(4)
     finally:
         conn.close()
 
+    if args.embed and not args.dry_run:
+        run_embed_stage(db_path, args)
+
+
+def extract_pdf_inputs(args):
+    """Extract --pdf inputs to page-tagged text; returns the text files to index."""
+    from extract_pdf_text import extract_all, resolve_pdfs
+
+    pdfs = resolve_pdfs(args.pdf)
+    if not pdfs:
+        print(f'ERROR: no PDF files found for: {" ".join(args.pdf)}', file=sys.stderr)
+        sys.exit(2)
+    print(f'Step 0: Extracting text from {len(pdfs)} PDF(s) -> {args.pdf_text_dir}...')
+    try:
+        return extract_all(pdfs, Path(args.pdf_text_dir), args.workers)
+    except RuntimeError as e:
+        print(f'ERROR: {e}', file=sys.stderr)
+        sys.exit(3)
+
+
+def run_embed_stage(db_path: Path, args):
+    if not db_path.exists():
+        print(f'ERROR: database not found: {db_path}', file=sys.stderr)
+        sys.exit(2)
+    print(f'Step 4: Embedding pending chunks in {db_path}...')
+    started = time.perf_counter()
+    conn = sqlite3.connect(str(db_path))
+    try:
+        ensure_schema(conn)
+        begin_bulk_load(conn, synchronous='NORMAL')
+        embedded = embed_pending(conn, args.embed_model, args.embed_batch_size,
+                                 args.embed_max_tokens, max(1, args.embed_concurrency))
+        end_bulk_load(conn)
+        elapsed = time.perf_counter() - started
+        print(f'\n✓ Embedded {embedded} chunks in {elapsed:.2f}s')
+    except KeyboardInterrupt:
+        print('\nInterrupted; finished batches are saved. Re-run with --embed-only to resume.', file=sys.stderr)
+        sys.exit(5)
+    except Exception as e:
+        print(f'\nERROR during embedding: {e}', file=sys.stderr)
+        print('Finished batches are saved. Re-run with --embed-only to resume.', file=sys.stderr)
+        sys.exit(5)
+    finally:
+        conn.close()
+
 if __name__ == '__main__':
     main()